@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+#
+# radio_ax25.py
+# AX.25 UI frames w/ raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# frame -> FCS(CRC-16/X.25) -> bit stuffing -> flags -> NRZI [-> G3RUH scrambler]
+# The FCS and the bit stuffing are done by 256 entry tables a byte at a time,
+# NRZI is a prefix XOR of the whole frame in python int (a few shifts per frame),
+# the scrambler (1 + x^12 + x^17) runs on the int 12 bits at a time.
+# Output:
+#   encode()      : bytes of 0/1 per bit, for tx_bits()/tx_data() in direct FSK
+#   encode_fifo() : packed bytes MSB first, for send_packet() in packet mode
+# The 2FSK of the hat is keyed by the bits. With scrambler=True it is 9600 baud
+# packet of G3RUH, 1200 baud AFSK tones are not generated.
+#
+import si4063 as radio
+import time
+import sys
+
+__version__ = "2023.12.23"
+
+FLAG = "01111110"   # 0x7e, not stuffed
+CONTROL_UI = 0x03
+PID_NO_L3 = 0xf0
+
+### FCS
+# CRC-16/X.25 (reflected 0x1021) table
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for i in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+CRC_TABLE = _crc_table()
+
+# FCS of a frame
+# data : address - control - pid - info
+# return : FCS (sent low byte first)
+def fcs(data):
+    crc = 0xffff
+    for b in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ b) & 0xff]
+    return crc ^ 0xffff
+
+### bit stuffing
+# Bits of a byte stuffed, LSB first
+# run : 1s sent before the byte (0-4)
+# return : bits("0"/"1"), 1s at the end
+def _stuff_byte(byte, run):
+    bits = []
+    for i in range(8):
+        if(byte >> i & 1):
+            bits.append("1")
+            run += 1
+            if(run == 5):
+                bits.append("0")
+                run = 0
+        else:
+            bits.append("0")
+            run = 0
+    return "".join(bits), run
+
+# STUFF_TABLE[run][byte] = (bits, run after)
+STUFF_TABLE = tuple(tuple(_stuff_byte(byte, run) for byte in range(256)) for run in range(5))
+
+# Bits of data with bit stuffing
+# return : str of "0"/"1" in the order sent
+def stuff(data):
+    parts = []
+    append = parts.append
+    run = 0
+    for b in data:
+        bits, run = STUFF_TABLE[run][b]
+        append(bits)
+    return "".join(parts)
+
+### NRZI
+# 0: level changes, 1: level stays
+# bits : str of "0"/"1"
+# level : level before the first bit
+# return : levels as int, first bit at MSB
+def nrzi(bits, level=0):
+    n = len(bits)
+    x = int(bits, 2) ^ ((1 << n) - 1)   # 1 at each change
+    shift = 1
+    while(shift < n):
+        x ^= x >> shift     # prefix XOR from MSB
+        shift <<= 1
+    if(level):
+        x ^= (1 << n) - 1
+    return x
+
+### G3RUH scrambler, 1 + x^12 + x^17
+# out = in ^ (out 12 bits before) ^ (out 17 bits before)
+# x : levels as int, first bit at MSB
+# n : bits in x
+# state : 17 bits sent before x, the last one at LSB
+# return : scrambled levels as int, first bit at MSB
+def scramble(x, n, state=0):
+    y = state & 0x1ffff
+    for pos in range(0, n, 12):     # the bits 12 and 17 before a block are out already
+        k = min(12, n - pos)
+        mask = (1 << k) - 1
+        block = (x >> (n - pos - k)) & mask
+        y = (y << k) | (block ^ (y >> (12 - k)) ^ (y >> (17 - k))) & mask
+    return y & ((1 << n) - 1)
+
+# Inverse of scramble(), the descrambler of a receiver
+def descramble(y, n, state=0):
+    y |= (state & 0x1ffff) << n
+    return (y ^ (y >> 12) ^ (y >> 17)) & ((1 << n) - 1)
+
+### frame
+# Address field of a station
+# call : "JA1XXX-7" (SSID 0 if no "-")
+# last : last address of the field
+# command : C bit (command/response)
+def encode_address(call, last=False, command=False):
+    call, sep, ssid = call.upper().partition("-")
+    if(not 1 <= len(call) <= 6 or not call.isalnum()):
+        raise Exception("Error: callsign {}".format(call))
+    ssid = int(ssid) if ssid else 0
+    if(not 0 <= ssid <= 15):
+        raise Exception("Error: SSID {}".format(ssid))
+    field = bytes(ord(c) << 1 for c in call.ljust(6))
+    return field + bytes([(command << 7) | 0x60 | (ssid << 1) | last])
+
+# UI frame without FCS
+# dest, src : callsigns
+# info : bytes or str
+# path : digipeaters, e.g. ("WIDE1-1", "WIDE2-1")
+def ui_frame(dest, src, info, path=(), pid=PID_NO_L3):
+    if(isinstance(info, str)):
+        info = info.encode("ascii")
+    if(len(path) > 8):
+        raise Exception("Error: path of {} digipeaters".format(len(path)))
+    calls = [dest, src] + list(path)
+    address = b"".join(encode_address(call, i == len(calls) - 1, i == 0)
+                       for i, call in enumerate(calls))
+    return address + bytes([CONTROL_UI, pid]) + info
+
+# Bits of a frame on air, before NRZI
+# frame : frame without FCS
+# preamble : flags before the frame (TXDELAY)
+# postamble : flags after the frame
+# return : str of "0"/"1"
+def hdlc_bits(frame, preamble=16, postamble=2):
+    crc = fcs(frame)
+    return FLAG * preamble + stuff(frame + bytes([crc & 0xff, crc >> 8])) + FLAG * postamble
+
+# Levels of a frame on air
+# scrambler : G3RUH scrambler after NRZI (9600 baud packet)
+# return : levels as int first bit at MSB, bits
+def _levels(frame, preamble, postamble, level, scrambler):
+    bits = hdlc_bits(frame, preamble, postamble)
+    n = len(bits)
+    x = nrzi(bits, level)
+    if(scrambler):
+        x = scramble(x, n)
+    return x, n
+
+# Encode a frame for tx_bits()/tx_data()
+# return : bytes of 0/1 per bit (NRZI levels)
+def encode(frame, preamble=16, postamble=2, level=0, scrambler=False):
+    x, n = _levels(frame, preamble, postamble, level, scrambler)
+    return format(x, "0{}b".format(n)).encode().translate(_LEVELS)
+
+_LEVELS = bytes.maketrans(b"01", b"\x00\x01")
+
+# Encode a frame for send_packet(), padded with 1s(no change) to a byte
+# return : bytes MSB first
+def encode_fifo(frame, preamble=16, postamble=2, level=0, scrambler=False):
+    x, n = _levels(frame, preamble, postamble, level, scrambler)
+    pad = -n % 8
+    x = (x << pad) | (((1 << pad) - 1) * (x & 1))   # stay at the last level
+    return x.to_bytes((n + pad) // 8, "big")
+
+# Encode frames
+# fifo : for send_packet()
+# return : list of encoded frames
+def encode_batch(frames, preamble=16, postamble=2, fifo=True, scrambler=False):
+    func = encode_fifo if fifo else encode
+    return [func(frame, preamble, postamble, scrambler=scrambler) for frame in frames]
+
+### APRS information field
+# Position without timestamp
+# lat, lon : degrees (north, east positive)
+# symbol : table and code, "/>" car, "/-" house ...
+def aprs_position(lat, lon, comment="", symbol="/-"):
+    return "!{}{}{}{}{}".format(_aprs_angle(lat, 2, "NS"), symbol[0],
+                                _aprs_angle(lon, 3, "EW"), symbol[1], comment)
+
+# Degrees and minutes, ddmm.mmN / dddmm.mmE
+# The whole angle is rounded to 0.01 minute first, 35.99999 is 3600.00N.
+# digits : digits of degrees
+# signs : hemisphere of positive and negative angle
+def _aprs_angle(angle, digits, signs):
+    total = round(abs(angle) * 6000)    # 0.01 minute
+    deg, minute = divmod(total, 6000)
+    sign = signs[1] if angle < 0 and total else signs[0]
+    return "{:0{}d}{:02d}.{:02d}{}".format(deg, digits, minute // 100, minute % 100, sign)
+
+# Telemetry report
+# seq : 0-999
+# values : 5 analog values 0-255
+# bits : 8 digital values
+def aprs_telemetry(seq, values, bits=(0,) * 8):
+    return "T#{:03d},{},{}".format(seq % 1000, ",".join("{:03d}".format(int(v)) for v in values),
+                                   "".join(str(b & 1) for b in bits))
+
+##### TEST #####
+# python radio_ax25.py [--sim] [--dma] --freq Hz call [text] : send a UI frame at 9600bps(G3RUH)
+#   packet mode(TX FIFO), --dma: direct mode by tx_bits()
+#   no default frequency, 144.64MHz of APRS in Japan is 1200 baud AFSK
+if __name__ == "__main__":
+    args = sys.argv
+    sim = "--sim" in args
+    if(sim):
+        args.remove("--sim")
+    dma = "--dma" in args
+    if(dma):
+        args.remove("--dma")
+    freq = None
+    if("--freq" in args):
+        i = args.index("--freq")
+        try:
+            freq = int(args[i + 1])
+        except:
+            pass
+        del args[i:i + 2]
+    try:
+        src = args[1]
+        if(freq is None):
+            raise Exception("Error: no --freq")
+    except:
+        print("usage: python radio_ax25.py [--sim] [--dma] --freq Hz call [text]")
+        exit()
+    text = " ".join(args[2:]) or ">si4063 hat"
+    bps = 9600
+    frame = ui_frame("APRS", src, text, ("WIDE1-1",))
+    t = time.perf_counter()
+    frames = encode_batch([frame] * 1000, scrambler=True)
+    print("encode: {:.0f} frames/S".format(1000 / (time.perf_counter() - t)))
+
+    pi = None
+    if(sim):
+        import si4063sim     # no hat
+        pi = si4063sim.pi()
+    si4063 = radio.Si4063(pi=pi, spi="bb")
+    si4063.reset()
+    si4063.power_up()
+    si4063.set_radio_frequency(freq)
+    si4063.set_pa_pwr_lvl(0x3f)
+    if(dma):
+        si4063.setup(radio.MOD_TYPE_FSK, 3000)
+        si4063.start_tx()
+        si4063.tx_bits(encode(frame, scrambler=True), bps)
+        si4063.tx_data(0)
+        si4063.stop_tx()
+    else:
+        si4063.setup(radio.MOD_TYPE_FSK, 3000, radio.MOD_SOURCE_PACKET, bps)
+        si4063.send_packet(frames[0])
+    print("sent {} bytes frame, {} bytes on air".format(len(frame) + 2, len(frames[0])))
+    del si4063
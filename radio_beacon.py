@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# radio_beacon.py
+# morse beacon w/ raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# A message is sent in slots every interval seconds (on the wall clock, e.g.
+# every 10 minutes at :00, :10 ...). The message is compiled once, between
+# slots the thread sleeps on the absolute time of the next slot and the chip
+# is in SLEEP state(registers kept). The chip is woken lead seconds before
+# the slot, the keying starts on the slot within a ms.
+# A slot is late by the first TX_DATA edge (pigpio callback), the keyer is
+# calibrated when the beacon is made, not in the first slot.
+# A slot started later than tolerance is missed, slots passed during a
+# transmission or a stop of the raspi are counted as missed too.
+#
+# usage:
+#   beacon = Beacon(radio, "DE JA1XXX BEACON", wpm=20, interval=600)
+#   beacon.start()      # or beacon.run() in this thread
+#
+import os
+import si4063 as radio
+import si4063cfg
+import radio_morse
+import time
+import sys
+import threading
+from collections import deque
+from si4063const import *
+from si4063keyer import Keyer
+
+SPIN = 0.002    # S before a deadline spent in a busy wait
+
+class Beacon:
+    # radio : Si4063 in OOK after setup()
+    # text : message to send
+    # wpm, fwpm : morse speed, Farnsworth timing if fwpm < wpm
+    # interval : S between slots
+    # offset : S of the slots after the interval grid
+    # dma : timed by pigpio DMA waves instead of sleep
+    # tolerance : max S a slot can be started late
+    # lead : S the chip is woken before a slot
+    # on_report : called with each report
+    def __init__(self, radio, text, wpm=20, interval=600, offset=0, fwpm=None, dma=False,
+                 tolerance=1.0, lead=0.05, on_report=None):
+        if(interval <= 0):
+            raise Exception("Error: beacon interval {}".format(interval))
+        self.radio = radio
+        self.text = text
+        self.dot_time = radio_morse.calculate_unit_time(wpm)/1000
+        self.schedule = radio_morse.compile_morse(text, wpm, fwpm)
+        self.duration = radio_morse.schedule_units(self.schedule) * self.dot_time
+        self.dma = dma
+        self.interval = interval
+        self.offset = offset
+        self.tolerance = tolerance
+        self.lead = lead
+        self.on_report = on_report
+        self.reports = deque(maxlen=1000)   # (slot time.time(), late S or None, status)
+        self.counts = {"sent": 0, "late": 0, "missed": 0}
+        self.max_late = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        if(not dma and radio.keyer is None):
+            radio.keyer = Keyer(radio)      # calibrated now, before the first slot
+
+    # Time of the first slot after now
+    # now : time.time()
+    def next_slot(self, now):
+        return ((now - self.offset) // self.interval + 1) * self.interval + self.offset
+
+    def start(self, count=None):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(count,), name="si4063_beacon", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if(self._thread is not None):
+            self._thread.join()
+            self._thread = None
+
+    # Send the beacon in slots until stop()
+    # count : slots to run (None: forever)
+    def run(self, count=None):
+        self.radio.change_state(STATE_SLEEP)
+        slot = self.next_slot(time.time())
+        n = 0
+        while(count is None or n < count):
+            if(not self._sleep_until(slot - self.lead)):
+                break
+            self.radio.change_state(STATE_READY)    # wake-up, registers kept
+            if(not self._sleep_until(slot)):
+                break
+            late = time.time() - slot
+            if(late > self.tolerance):
+                self._report(slot, late, "missed")
+            else:
+                edge = self._send()
+                if(edge is not None):
+                    late = edge - slot
+                self._report(slot, late, "late" if late > 0.001 else "sent")
+            self.radio.change_state(STATE_SLEEP)
+            n += 1
+            # slots passed on air or while the raspi was stopped
+            following = self.next_slot(time.time())
+            for i in range(1, round((following - slot) / self.interval)):
+                self._report(slot + i * self.interval, None, "missed")
+                n += 1
+            slot = following
+
+    # Sleep until deadline(time.time()), the last SPIN S in a busy wait
+    # The wall clock is read again at least every minute(NTP adjust, suspend)
+    # return : False if stopped
+    def _sleep_until(self, deadline):
+        while(True):
+            remain = deadline - time.time()
+            if(remain <= SPIN):
+                break
+            if(self._stop.wait(min(remain - SPIN, 60))):
+                return False
+        while(time.time() < deadline):
+            pass
+        return not self._stop.is_set()
+
+    # Send the message
+    # return : time.time() of the first TX_DATA edge, None if no edge
+    def _send(self):
+        pi = self.radio.pi
+        first = []      # tick of the first rising edge
+        cb = pi.callback(self.radio.pins.TX_DATA, radio.RISING_EDGE,
+                         lambda gpio, level, tick: first or first.append(tick))
+        now, tick = time.time(), pi.get_current_tick()
+        try:
+            if(self.dma):
+                radio_morse.key_schedule_dma(self.dot_time, self.schedule, self.radio)
+            else:
+                radio_morse.key_schedule(self.dot_time, self.schedule, self.radio)
+        finally:
+            cb.cancel()
+        if(not first):
+            return None
+        return now + ((first[0] - tick) & 0xffffffff) / 1e6
+
+    def _report(self, slot, late, status):
+        if(status != "missed"):
+            self.counts["sent"] += 1
+            self.max_late = max(self.max_late, late)
+        if(status != "sent"):
+            self.counts[status] += 1
+        report = (slot, late, status)
+        self.reports.append(report)
+        if(self.on_report):
+            self.on_report(*report)
+
+    # Counts of the slots
+    # return : {"sent": n, "late": n, "missed": n, "max_late": S}
+    def stats(self):
+        stats = dict(self.counts)
+        stats["max_late"] = self.max_late
+        return stats
+
+##### main #####
+# python radio_beacon.py [--sim] [--dma] interval(S) wpm text
+if __name__ == "__main__":
+    args = sys.argv
+    sim = "--sim" in args
+    if(sim):
+        args.remove("--sim")
+    dma = "--dma" in args
+    if(dma):
+        args.remove("--dma")
+    try:
+        interval = float(args[1])
+        wpm = min(max(int(args[2]), 5), 30)
+        text = " ".join(args[3:])
+    except:
+        print("usage: python radio_beacon.py [--sim] [--dma] interval(S) wpm text")
+        exit()
+    pi = None
+    if(sim):
+        import si4063sim     # no hat
+        pi = si4063sim.pi()
+    si4063 = radio.Si4063(pi=pi, keep_power=True)
+    if(si4063cfg.bring_up(si4063, si4063cfg.read_config(os.path.join(si4063cfg.PROFILE_DIR, "ook.bin")))):
+        print("Warm attach")
+    def show(slot, late, status):
+        print("{} {} {}".format(time.strftime("%H:%M:%S", time.localtime(slot)), status,
+                                "" if late is None else "{:+.1f} mS".format(late * 1e3)), flush=True)
+    beacon = Beacon(si4063, text, wpm, interval, dma=dma, on_report=show)
+    print("Beacon every {} S, {:.1f} S on air: {}".format(interval, beacon.duration, text))
+    try:
+        beacon.run()
+    except KeyboardInterrupt:
+        pass
+    si4063.tx_data(0)
+    si4063.stop_tx()
+    print(beacon.stats())
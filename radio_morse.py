@@ -9,8 +9,13 @@
 # https://opensource.org/licenses/mit-license.php
 # 
 import si4063 as radio
-import time
+import si4063cfg
+from si4063keyer import Keyer
 import sys
+import time
+import queue
+import itertools
+import threading
 
 __version__ = "2023.12.23"
 
@@ -33,56 +38,303 @@ morse_code = {
 # text : text to encode
 # return : morse code("." and "-")
 def text_to_morse(text):
-    morse = ''
-    for char in text.upper():
-        if char in morse_code:
-            morse += morse_code[char] + ' '  # Add space after char
-        elif char == ' ':  # Add partition
-            morse += '/ '
-    return morse
+    # Add space after char, '/' for partition
+    return ''.join([morse_code[char] + ' ' if char in morse_code else '/ '
+                    for char in text.upper() if char in morse_code or char == ' '])
+
+### keying schedule : list of (level, duration in dot units)
+MARK_DOT = (1, 1)
+MARK_DASH = (1, 3)
+GAP_ELEMENT = (0, 1)
+
+# pulses of a character, a gap between elements
+def _char_pulses(code):
+    pulses = []
+    for symbol in code:
+        if(pulses):
+            pulses.append(GAP_ELEMENT)
+        pulses.append(MARK_DOT if symbol == '.' else MARK_DASH)
+    return tuple(pulses)
+
+# precomputed pulses of each character (upper and lower case)
+char_pulses = {char: _char_pulses(code) for char, code in morse_code.items()}
+char_pulses.update({char.lower(): pulses for char, pulses in char_pulses.items()})
+
+# Gap stretch of Farnsworth timing
+# wpm : character speed, fwpm : overall speed (fwpm < wpm)
+# return : char/word gaps are multiplied by this
+def farnsworth_factor(wpm, fwpm):
+    if(not fwpm):
+        return 1
+    if(not wpm):
+        raise Exception("Error: Farnsworth fwpm {} needs the character speed wpm".format(fwpm))
+    if(fwpm >= wpm):
+        return 1
+    return (60 * wpm - 37.2 * fwpm) / (22.8 * fwpm)
+
+# Compile text into a keying schedule
+# Gaps are merged, 3 units between chars, 7 units between words.
+# text : text to encode
+# wpm, fwpm : Farnsworth timing if fwpm < wpm
+# return : list of (level, duration in dot units at wpm)
+def compile_morse(text, wpm=None, fwpm=None):
+    k = farnsworth_factor(wpm, fwpm)
+    schedule = []
+    _compile(text, schedule, None, (0, 3 * k), (0, 7 * k))
+    return schedule
+
+# Compile text and append to schedule
+# gap : gap before the next char (None at the start)
+# return : gap after text
+def _compile(text, schedule, gap, gap_char, gap_word):
+    append, extend, get = schedule.append, schedule.extend, char_pulses.get
+    for char in text:
+        pulses = get(char)
+        if(pulses):
+            if(gap):
+                append(gap)
+            extend(pulses)
+            gap = gap_char
+        elif(gap and char.isspace()):
+            gap = gap_word
+    return gap
+
+# Compile text chunks lazily, gaps are kept across chunks
+# A schedule ends on the gap after its text, TX_DATA is Low while the next
+# chunk is waited for. The next schedule starts with the rest of the gap
+# (a word gap when the next chunk starts with a space).
+# chunks : iterable of text (lines, blocks of a file ...)
+# wpm, fwpm : Farnsworth timing if fwpm < wpm
+# return : generator of (text, schedule) per chunk
+def iter_morse(chunks, wpm=None, fwpm=None):
+    k = farnsworth_factor(wpm, fwpm)
+    gap_char, gap_word = (0, 3 * k), (0, 7 * k)
+    gap = None
+    keyed = 0       # units of gap at the end of the last schedule
+    for text in chunks:
+        schedule = []
+        gap = _compile(text, schedule, gap, gap_char, gap_word)
+        if(schedule):
+            if(keyed):
+                rest = schedule[0][1] - keyed
+                if(rest > 0):
+                    schedule[0] = (0, rest)
+                else:
+                    del schedule[0]
+            schedule.append(gap)
+            keyed = gap[1]
+            yield text, schedule
+
+# Read a file in blocks
+# f : text file (sys.stdin ...)
+# size : chars in a block
+def read_chunks(f, size=4096):
+    return iter(lambda: f.read(size), '')
+
+# Total time of a schedule
+# return : dot units
+def schedule_units(schedule):
+    return sum(units for level, units in schedule)
+
+# Convert a schedule to runs for si4063wave (lazy)
+# dot_time : time for dot (Second)
+# return : generator of (level, duration_us)
+def schedule_to_runs(schedule, dot_time):
+    dot_us = dot_time * 1e6
+    return ((level, units * dot_us) for level, units in schedule)
+
+# transmit a keying schedule, timed by python on absolute deadlines
+# dot_time : time for dot (Second)
+# schedule : list of (level, dot units)
+# radio : Si4063 to transmit (None: si4063 of __main__)
+def key_schedule(dot_time, schedule, radio=None):
+    if(radio is None):
+        radio = si4063
+    radio.start_tx()
+    try:
+        radio.key_runs(schedule_to_runs(schedule, dot_time))
+    finally:
+        radio.tx_data(0)
+        radio.stop_tx()
+
+# transmit a keying schedule, timed by pigpio DMA waves
+# dot_time : time for dot (Second)
+# schedule : list of (level, dot units)
+# radio : Si4063 to transmit (None: si4063 of __main__)
+def key_schedule_dma(dot_time, schedule, radio=None):
+    if(radio is None):
+        radio = si4063
+    radio.start_tx()
+    try:
+        radio.tx_runs(schedule_to_runs(schedule, dot_time))
+    finally:
+        radio.tx_data(0)
+        radio.stop_tx()
 
 # Convert unit time from wpm
 # wpm : words per minute(morse speed)
 def calculate_unit_time(wpm):
     return 1200 / wpm  # 5 chars/word, unit_time/char=1/5×60×1000=1200/wpm Second
 
-# transmit radio morse code
+# Convert morse code to runs, a symbol is the progress mark of its first run
 # dot_time : time for dot (Second)
-# morse_code : morse code text ("." and "-") 
-def morse_code_to_ook(dot_time, morse_code):
-    si4063.start_tx()
+# morse_code : morse code text ("." and "-")
+# return : generator of (level, duration_us, mark) or (level, duration_us)
+def morse_code_to_runs(dot_time, morse_code):
+    dot_us = dot_time * 1e6
     for symbol in morse_code:
-        print(symbol, end="", flush=True)
         if symbol == '.':
-            si4063.tx_data(1)
-            time.sleep(dot_time)
-            si4063.tx_data(0)
-            time.sleep(dot_time)
+            yield 1, dot_us, symbol
+            yield 0, dot_us
         elif symbol == '-':
-            si4063.tx_data(1)
-            time.sleep(3 * dot_time)
-            si4063.tx_data(0)
-            time.sleep(dot_time)
+            yield 1, 3 * dot_us, symbol
+            yield 0, dot_us
         elif symbol == ' ':
-            time.sleep(3 * dot_time)
-    print("")
-    si4063.stop_tx()
+            yield 0, 3 * dot_us, symbol
+        else:
+            yield 0, 0, symbol
+
+# transmit radio morse code
+# dot_time : time for dot (Second)
+# morse_code : morse code text ("." and "-") 
+# radio : Si4063 to transmit (None: si4063 of __main__)
+def morse_code_to_ook(dot_time, morse_code, radio=None):
+    if(radio is None):
+        radio = si4063
+    radio.start_tx()
+    try:
+        radio.key_runs(morse_code_to_runs(dot_time, morse_code))
+    finally:
+        radio.tx_data(0)
+        print("")
+        radio.stop_tx()
+
+# Send text chunks of any length with bounded memory
+# A thread reads and compiles chunk N+1 while chunk N is on air.
+# Keying runs on absolute deadlines (or DMA waves), no gap at chunk boundaries.
+# A chunk ends on a space, a late chunk stretches the space, not a mark.
+# An error of chunks (UnicodeDecodeError ...) is raised after the chunks before it.
+# chunks : iterable of text, read lazily
+# wpm : words per minute(morse speed)
+# radio : Si4063 to transmit (None: si4063 of __main__)
+# fwpm : Farnsworth overall speed (None: same as wpm)
+# dma : timed by pigpio DMA waves instead of sleep
+# return : underruns, next chunk was not ready at the end of the last one
+def stream_morse(chunks, wpm=10, radio=None, fwpm=None, dma=False):
+    if(radio is None):
+        radio = si4063
+    dot_time = calculate_unit_time(wpm)/1000
+    buffers = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    # put item, gives up when the consumer has stopped
+    # return : False if stopped
+    def put(item):
+        while(not stop.is_set()):
+            try:
+                buffers.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        end = None      # end of the text, or the error raised again by consume()
+        try:
+            for item in iter_morse(chunks, wpm, fwpm):
+                if(not put(item)):
+                    return
+        except BaseException as e:     # UnicodeDecodeError of the file ...
+            end = e
+        put(end)
+
+    # chunks, consume.end is set to the end of each chunk on air
+    def consume():
+        while(True):
+            waited = buffers.empty()
+            item = buffers.get()
+            if(item is None):
+                return
+            if(isinstance(item, BaseException)):
+                raise item
+            if(waited and consume.end is not None and time.perf_counter_ns() > consume.end):
+                consume.underruns += 1
+            consume.end = None      # until the chunk is on air
+            yield item
+    consume.underruns = 0
+    consume.end = None      # perf_counter_ns, None: the first chunk
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    radio.start_tx()
+    try:
+        schedules = consume()
+        if(dma):
+            # a chunk is queued as soon as it is ready, waves follow without gap
+            end = 0
+            for text, schedule in schedules:
+                print(text, end="", flush=True)
+                start = max(end, time.perf_counter_ns())
+                radio.tx_runs(schedule_to_runs(schedule, dot_time), wait=False)
+                end = consume.end = start + round(schedule_units(schedule) * dot_time * 1e9)
+            if(radio.wave is not None):
+                radio.wave.wait()
+        else:
+            # a chunk goes on at the end of the last one, or now after an underrun
+            for text, schedule in schedules:
+                runs = schedule_to_runs(schedule, dot_time)
+                level, duration = next(runs)
+                consume.end = radio.key_runs(itertools.chain([(level, duration, text)], runs), resume=True)
+    finally:
+        stop.set()
+        radio.tx_data(0)
+        radio.stop_tx()
+        print("")
+    return consume.underruns
 
 # Send morse code converted from text
 # text : text to send
 # wpm : words per minute(morse speed)
-def send_morse(text, wpm=10):
+# radio : Si4063 to transmit (None: si4063 of __main__)
+# fwpm : Farnsworth overall speed (None: same as wpm)
+# dma : timed by pigpio DMA waves instead of sleep
+def send_morse(text, wpm=10, radio=None, fwpm=None, dma=False):
     
-    morse_code = text_to_morse(text)
+    schedule = compile_morse(text, wpm, fwpm)
     unit_time = calculate_unit_time(wpm)/1000
     #print("wpm: ", wpm)
-    print("morse code: ", morse_code)
+    print("morse code: ", text_to_morse(text))
 
-    morse_code_to_ook(unit_time, morse_code)
+    if(dma):
+        key_schedule_dma(unit_time, schedule, radio)
+    else:
+        key_schedule(unit_time, schedule, radio)
     
 ### 
 if __name__ == "__main__":
     args = sys.argv
+    sim = "--sim" in args       # run on the simulator, no hat
+    if(sim):
+        args.remove("--sim")
+    warm = "--warm" in args     # skip bring-up if the chip is configured already
+    if(warm):
+        args.remove("--warm")
+    # text from a file or stdin(-)
+    path = None
+    if("--file" in args):
+        i = args.index("--file")
+        path = args[i + 1] if i + 1 < len(args) else "-"
+        del args[i:i + 2]
+    elif("-" in args):
+        path = "-"
+        args.remove("-")
+    # keying thread in SCHED_FIFO priority, pinned to a CPU
+    rt = {}
+    for option, key in (("--rt", "priority"), ("--cpu", "cpu")):
+        if(option in args):
+            i = args.index(option)
+            rt[key] = int(args[i + 1])
+            del args[i:i + 2]
     # morse speed is between 5 and 30 
     try:
         wpm = int(args[1])
@@ -92,40 +344,66 @@ if __name__ == "__main__":
             wpm = 5 
     except:
         wpm = 10
+    # Farnsworth overall speed
+    try:
+        fwpm = min(max(int(args[2]), 5), wpm)
+    except:
+        fwpm = None
         
     print("Radio Morse Starting  ver.", __version__)
     print("radio ver.", radio.__version__)
     print("wpm: ", wpm)
-    si4063 = radio.Si4063()    
-    si4063.reset()          # Shutdown and Wake-up
-    
-    # Check part info
-    count, chip_no = si4063.part_info()
-    dots_read = '.' * count
-    if(chip_no in radio.NAME_CHIPS):
-        print("Detected" + dots_read + " {:04x}".format(chip_no))
+    if(fwpm):
+        print("Farnsworth wpm: ", fwpm)
+    pi = None
+    if(sim):
+        import si4063sim     # no hat
+        pi = si4063sim.pi()
+    si4063 = radio.Si4063(pi=pi, keep_power=warm)
+    si4063.keyer = Keyer(si4063, **rt)
+    radio_frequency = 144050000
+    freq_offset = -4000
+    pwr_lvl = 0x7f      # up to 0x7f(max)
+    expected = si4063cfg.config_properties(si4063cfg.compile_config(
+        radio.MOD_TYPE_OOK, radio_frequency, freq_offset=freq_offset, pwr_lvl=pwr_lvl))
+    if(warm and si4063.warm_attach(expected)):
+        print("Warm attach, frequency(Hz): ", radio_frequency)
     else:
-        raise Exception(dots_read + "Error: wrong chip name {:04x}".format(chip_no))
-    
-    si4063.power_up()
+        si4063.reset()          # Shutdown and Wake-up
+        
+        # Check part info
+        count, chip_no = si4063.part_info()
+        dots_read = '.' * count
+        if(chip_no in radio.NAME_CHIPS):
+            print("Detected" + dots_read + " {:04x}".format(chip_no))
+        else:
+            raise Exception(dots_read + "Error: wrong chip name {:04x}".format(chip_no))
+        
+        si4063.power_up()
+        
+        # set frequency
+        si4063.set_radio_frequency(radio_frequency)
+        print("frequency(Hz): ", radio_frequency)
+        si4063.set_modem_freq_offset(freq_offset)
+        
+        # set RF power
+        si4063.set_pa_pwr_lvl(pwr_lvl)
+        ### OOK mode
+        si4063.setup(radio.MOD_TYPE_OOK)
     temperature, voltage = si4063.get_adc_reading()
     print("Temperature: {:.1f} °C".format(temperature))
     print("Voltage: {:.2f} volt".format(voltage))
     
-    # set frequency
-    radio_frequency = 144050000
-    si4063.set_radio_frequency(radio_frequency)
-    print("frequency(Hz): ", radio_frequency)
-    si4063.set_modem_freq_offset(-4000)
-    
-    # set RF power
-    pwr_lvl = 0x7f      # up to 0x7f(max)
-    si4063.set_pa_pwr_lvl(pwr_lvl)
-    ### OOK mode
-    si4063.setup(radio.MOD_TYPE_OOK)
-    
-    text = input("Input text to send: ")
-    send_morse(text, wpm)
+    if(path == "-"):
+        stream_morse(read_chunks(sys.stdin), wpm, fwpm=fwpm)
+    elif(path):
+        with open(path) as f:
+            stream_morse(read_chunks(f), wpm, fwpm=fwpm)
+    else:
+        text = input("Input text to send: ")
+        send_morse(text, wpm, fwpm=fwpm)
+    if(si4063.keyer.rt_error):
+        print("keyer: ", si4063.keyer.rt_error)
     del si4063
     ###
     # end or radio_morse.py
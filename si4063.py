@@ -14,188 +14,357 @@
 # https://www.silabs.com/documents/public/application-notes/EZRadioPRO_REVC2_API.zip
 #
 # CHIP DATA MODE : DIRECT ASYNCHRONOUS SOURCE MODE
-import pigpio
 import time
+import zlib
+import contextlib
+import threading
+import weakref
+from collections import deque
 from si4063const import *
+import si4063cmd
+from si4063wave import TxWave, bits_to_runs
+from si4063keyer import Keyer
+from si4063spi import open_spi
+from si4063chan import ChannelPlan, dividers, output_frequency
+from si4063metrics import Metrics
 
 __version__ = "2023.12.23"
 
+# pigpio gpio modes, pigpio itself is imported when pigpiod is connected
+INPUT = 0           # pigpio.INPUT
+OUTPUT = 1          # pigpio.OUTPUT
+PUD_DOWN = 1        # pigpio.PUD_DOWN
+PUD_UP = 2          # pigpio.PUD_UP
+RISING_EDGE = 0     # pigpio.RISING_EDGE
+FALLING_EDGE = 1    # pigpio.FALLING_EDGE
+
 # debug flag
 debug = False
 #debug flag primitive
 _debug = False
 
+# pigpio connections shared by radios, one per pigpiod
+# Hats on one raspi share the connection and take its bus lock for SPI.
+class PigpioPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conns = {}        # (host, port): [pi, number of users]
+        self._bus_locks = weakref.WeakKeyDictionary()    # pi: lock of SPI bus
+
+    # Connect to pigpiod or share the connection
+    # return : pigpio.pi
+    def acquire(self, host="localhost", port=8888):
+        with self._lock:
+            conn = self._conns.get((host, port))
+            if(conn is None):
+                import pigpio   # the simulator is given as pi=si4063sim.pi()
+                pi = pigpio.pi(host, port)
+                if(not pi.connected):
+                    return pi
+                conn = self._conns[(host, port)] = [pi, 0]
+            conn[1] += 1
+            return conn[0]
+
+    # Release a connection, stopped when the last user releases it
+    def release(self, pi):
+        with self._lock:
+            for key, conn in self._conns.items():
+                if(conn[0] is pi):
+                    conn[1] -= 1
+                    if(conn[1] == 0):
+                        del self._conns[key]
+                        pi.stop()
+                    return
+
+    # Lock of the SPI bus on a connection
+    def bus_lock(self, pi):
+        with self._lock:
+            lock = self._bus_locks.get(pi)
+            if(lock is None):
+                lock = self._bus_locks[pi] = threading.Lock()
+            return lock
+
+pool = PigpioPool()
+
+# GET_PROPERTY reads covering keys
+# Indexes of a group within 16 bytes(max reply) go in one read, gaps are read too.
+# keys : (group, index)
+# return : list of (group, index, count)
+def snapshot_reads(keys):
+    reads = []
+    for group, index in sorted(keys):
+        if(reads and reads[-1][0] == group and index - reads[-1][1] < 16):
+            reads[-1][2] = index - reads[-1][1] + 1
+        else:
+            reads.append([group, index, 1])
+    return [tuple(read) for read in reads]
+
+# Checksum of a register image
+# props : {(group, index): value}
+# return : crc32 of (group, index, value) in order
+def property_checksum(props):
+    return zlib.crc32(bytes(b for k in sorted(props) for b in (k[0], k[1], props[k])))
+
+# Difference of register images
+# image : {(group, index): value} read from the chip
+# expected : {(group, index): value}
+# return : {(group, index): (expected, actual)}, actual None if not in image
+def diff_image(image, expected):
+    return {k: (val, image.get(k)) for k, val in expected.items() if image.get(k) != val}
+
 class Si4063:
     # configure raspi pins
-    # I/O and SOFTWARE SPI
-    def __init__(self):
-        self.pi = pigpio.pi()
+    # I/O and SPI
+    # pi : pigpio.pi to use (None: connection to pigpiod at host:port from the pool)
+    # spi : SPI transport (si4063spi) or its name "soft"/"bb"/"pigpio"/"spidev"
+    #       None: "bb" if spi_baud is given, else "soft"
+    # spi_baud : SCLK(Hz) of SPI transport given by name
+    # cts_timeout : max wait for CTS (S)
+    # pins : PinMap of the hat (None: default pins)
+    # host, port : pigpiod of the raspi
+    # metrics : count commands, SPI bytes, CTS waits and TX time (si4063metrics)
+    # keep_power : SHDN Low, the chip keeps running for warm_attach()
+    def __init__(self, pi=None, spi=None, spi_baud=None, cts_timeout=1.0, pins=None,
+                 host="localhost", port=8888, metrics=False, keep_power=False):
+        self._pooled = pi is None   # connection from the pool, released at del
+        self.pi = pool.acquire(host, port) if pi is None else pi
+        self.pins = PinMap() if pins is None else pins
+        self.bus_lock = pool.bus_lock(self.pi)
+        self.cts_timeout = cts_timeout
+        self.cts_log = deque(maxlen=1000)   # CTS latency, (command, S)
+        self._cts_event = threading.Event() # set at CTS rising edge
+        self._cts_fall = threading.Event()  # set at CTS falling edge, POR and shutdown
+        self._cts_rise = 0.0    # perf_counter at CTS rising edge
+        self._cmd = None        # last command, (command, perf_counter at sent)
+        self.wave = None    # TxWave, created at first tx_bits()
+        self._cmds = si4063cmd.Commands()   # command buffers, packed under cmd_lock
+        self.keyer = None   # Keyer, created at first key_runs()
+        self._props = {}        # property shadow, (group, index): value on chip
+        self._pending = None    # properties to be written in batch()
+        # set_property/set_properties calls, SET_PROPERTY sent, values not sent(same as shadow)
+        self.prop_stats = {"requested": 0, "sent": 0, "elided": 0}
+        self.plan = None        # ChannelPlan of hop(), created at first use
+        self.metrics = Metrics() if metrics else None
+        self.cmd_lock = threading.RLock()   # command and its reply, from any thread
+        self.next_edge = None   # perf_counter of the next TX_DATA edge keyed by python, None: not keying
+        self.mod_source = MOD_SOURCE_DIRECT     # set by setup()
+        self.data_rate = None   # bps of packet/PN9 mode, set by setup()
+        self._irq_event = threading.Event() # set at nIRQ falling edge
         if not self.pi.connected:
             raise Exception("Error: pigpio NOT connected")
         
         # Shutdown pin
-        self.pi.set_mode(GPIO_SHDN, pigpio.OUTPUT)
-        self.pi.write(GPIO_SHDN, 1)  # PIN_SHDN = High
+        # chip left powered by an earlier run, before SHDN is driven
+        self._powered = keep_power and not self.pi.read(self.pins.SHDN)
+        self.pi.set_mode(self.pins.SHDN, OUTPUT)
+        self.pi.write(self.pins.SHDN, 0 if keep_power else 1)  # PIN_SHDN = High
 
         # GPIO_13 OUTPUT for TXDATA  
-        self.pi.set_mode(GPIO_TX_DATA, pigpio.OUTPUT)
-        self.pi.write(GPIO_TX_DATA, 0)  # TX_DATA = Low
+        self.pi.set_mode(self.pins.TX_DATA, OUTPUT)
+        self.pi.write(self.pins.TX_DATA, 0)  # TX_DATA = Low
 
         # GPIO_6 INPUT for CTS
-        self.pi.set_mode(GPIO_CTS, pigpio.INPUT)
-        self.pi.set_pull_up_down(GPIO_CTS, pigpio.PUD_DOWN)
-
-        # nSEL pin
-        self.pi.set_mode(GPIO_nSEL, pigpio.OUTPUT)
-        self.pi.write(GPIO_nSEL, 1)  # nSEL = 1
-        # SDI(MOSI) pin
-        self.pi.set_mode(GPIO_SDI, pigpio.OUTPUT)
-        self.pi.write(GPIO_SDI, 0)  # MOSI = 0
-        # SDO(MISO) pin
-        self.pi.set_mode(GPIO_SDO, pigpio.INPUT)
-        self.pi.set_pull_up_down(GPIO_SDO, pigpio.PUD_DOWN) # pull down
-        # SCLK pin
-        self.pi.set_mode(GPIO_SCLK, pigpio.OUTPUT)
-        self.pi.write(GPIO_SCLK, 0)  # SCLK = 0
-    
-    # Set nSEL pin Low
-    def _spi_select(self):
-        if(_debug):
-            print("\t_select")
-        self.pi.write(GPIO_nSEL, 0)
-    # Set nSEL pin High
-    def _spi_deselect(self):
-        if(_debug):
-            print("\t_deselect")
-        self.pi.write(GPIO_nSEL, 1)
-    # Set SCLK pin 1/0
-    def _spi_clk(self, bit):
-        self.pi.write(GPIO_SCLK, bit)
-    
-    # Write a byte
-    def _spi_wr(self, data):
-        if(_debug):
-            print("\t_wr: {:02x}".format(data))
-        for i in range(8):
-            self._spi_clk(0)
-            bit = 1 if((data<<(i) & 0x80)) else 0
-            self.pi.write(GPIO_SDI, bit)
-            self._spi_clk(1)
-            
-        self._spi_clk(0)
-        self.pi.write(GPIO_SDI, 0)  
-    
-    # Read a byte
-    # return : 1 byte read
-    def _spi_rd(self):
-        data = 0
-        for i in range(8):
-            self._spi_clk(0)
-            data = data<<1
-            self.pi.write(GPIO_SDI, 1)      # write 0xff in read
-            bit = self.pi.read(GPIO_SDO)
-            data += bit
-            self._spi_clk(1)
-        
-        self._spi_clk(0)
-        if(_debug):
-            print("\t_rd: {:02x}".format(data))
-        return data
+        self.pi.set_mode(self.pins.CTS, INPUT)
+        self.pi.set_pull_up_down(self.pins.CTS, PUD_DOWN)
+        self._cts_cb = self.pi.callback(self.pins.CTS, RISING_EDGE, self._on_cts)
+        self._cts_fall_cb = self.pi.callback(self.pins.CTS, FALLING_EDGE, lambda g, l, t: self._cts_fall.set())
+
+        # GPIO_5 INPUT for nIRQ, packet mode
+        self.pi.set_mode(self.pins.nIRQ, INPUT)
+        self.pi.set_pull_up_down(self.pins.nIRQ, PUD_UP)
+        self._irq_cb = self.pi.callback(self.pins.nIRQ, FALLING_EDGE, lambda g, l, t: self._irq_event.set())
+
+        # SPI transport
+        if(spi is None):
+            spi = "bb" if spi_baud else "soft"
+        self.spi = open_spi(spi, self.pi, spi_baud, self.pins) if isinstance(spi, str) else spi
+
+    # SPI transaction, select - write - read - deselect
+    # to_send : bytes to be written
+    # count : qty of bytes read after to_send
+    # return : byte(s) read (list)
+    def _xfer(self, to_send, count=0):
+        if(self.metrics is not None):
+            self.metrics.spi(len(to_send) + count, count)
+        with self.bus_lock:     # other hats on the bus wait
+            return self.spi.xfer(to_send, count)
         
-    # Check CTS pin
-    # return : cts(0xff or 0x00=timeout)
-    def _is_CTS(self):
-        timeout, cts = 1000, 0x00
+    # pigpio callback, CTS rising edge
+    def _on_cts(self, gpio, level, tick):
+        self._cts_rise = time.perf_counter()
+        self._cts_event.set()
 
-        while(timeout>=0):
-            bit_cts = self.pi.read(GPIO_CTS)
-            if(bit_cts==1):
-                cts = 0xff    
+    # Check CTS pin, wait for the rising edge if Low
+    # The pin is read again after an edge, a late callback of a former command may come.
+    # return : cts(0xff)
+    # raise : TimeoutError if CTS is not High in cts_timeout
+    def _is_CTS(self):
+        deadline = None
+        while(not self.pi.read(self.pins.CTS)):
+            if(deadline is None):
+                deadline = time.perf_counter() + self.cts_timeout
+            remain = deadline - time.perf_counter()
+            if(remain <= 0 or not self._cts_event.wait(remain)):
+                if(not self.pi.read(self.pins.CTS)):
+                    self._cts_timeout()
                 break
-            time.sleep(0.001)
-            timeout -=1
-        return cts
+            self._cts_event.clear()
+        if(self.metrics is not None):
+            # the wait started at deadline - cts_timeout
+            self.metrics.cts_wait(0.0 if deadline is None else time.perf_counter() - deadline + self.cts_timeout)
+        self._log_cts()
+        return 0xff
     
     # Check CTS over SPI
-    # rturn : CTS(0xff), Not deselect to continue
-    #         0x00,  deselect 
+    # rturn : CTS(0xff)
+    # raise : TimeoutError if CTS is not 0xff in cts_timeout
     def _is_CTS_spi(self):
-        timeout, cts = 10, 0x00
+        deadline = time.perf_counter() + self.cts_timeout
+        while(self._xfer(si4063cmd.READ_CMD_BUFF, 1)[0] != 0xff):
+            remain = deadline - time.perf_counter()
+            if(remain <= 0):
+                self._cts_timeout()
+            self._cts_event.wait(min(remain, 0.001))
+        self._log_cts()
+        return 0xff
 
-        while(timeout>=0):
-            self._spi_select()
-            self._spi_wr( CMD_READ_CMD_BUFF)
-            cts = self._spi_rd()
-            if(cts==0xff):
-                break
-            self._spi_deselect()
-            time.sleep(0.001)
-            timeout -=1
-        return cts      
+    def _cts_timeout(self):
+        if(self.metrics is not None):
+            self.metrics.cts_timeouts += 1
+        cmd = self._cmd[0] if self._cmd else None
+        self._cmd = None
+        name = "{:02x}".format(cmd) if isinstance(cmd, int) else str(cmd)
+        raise TimeoutError("Error: CTS timeout {}S, command {}".format(self.cts_timeout, name))
+
+    # Record CTS latency of the last command
+    def _log_cts(self):
+        if(self._cmd is not None):
+            cmd, sent = self._cmd
+            self._cmd = None
+            rise = self._cts_rise if self._cts_rise >= sent else time.perf_counter()
+            self.cts_log.append((cmd, rise - sent))
+
+    # CTS latency per command
+    # return : {command: (count, min, mean, max)} in S
+    def cts_latency(self):
+        table = {}
+        for cmd, latency in self.cts_log:
+            table.setdefault(cmd, []).append(latency)
+        return {cmd: (len(v), min(v), sum(v) / len(v), max(v)) for cmd, v in table.items()}
     
     # Write bytes after wait CTS
     # to_send : bytes to be written
-    def _write(self, to_send, desel=True):
+    def _write(self, to_send):
+        if(self._pending):
+            self.flush_properties()     # keep the order of commands
         if(_debug):
             print("\t_Write:")
-        
-        #self._wait_cts(read_reply=False)
-        self._is_CTS()
-        self._spi_select()
-        for b in to_send:
-            b_as_bytes = b.to_bytes(1,byteorder="big")
-            #self._wait_cts(False)
-            self._spi_wr(b)
-        if(desel):
-            self._spi_deselect()
-
-    # Read count size bytes after select and check CTS
+        with self.cmd_lock:     # not between a command and its reply of another thread
+            self._is_CTS()
+            self._cts_event.clear()         # CTS falls at the end of command
+            self._xfer(to_send)
+            self._cmd = (to_send[0], time.perf_counter())
+            if(self.metrics is not None):
+                self.metrics.command(to_send)
+
+    # Pack a command into its buffer and write it
+    # The buffer is reused by the next command of the kind, then both under cmd_lock,
+    # also the debug print. The view is not returned, it is not valid after the lock.
+    # command : si4063cmd.Command of self._cmds
+    # name : printed with the bytes if debug
+    def _send(self, command, *args, name="to_send"):
+        with self.cmd_lock:
+            to_send = command.pack(*args)
+            if(debug):
+                print(name + ": ", ' '.join('{:02x}'.format(x) for x in to_send))
+            self._write(to_send)
+
+    # Read count size bytes after check CTS
     # 
     # count : qty of read data
-    # desel :  deselect after read data
     # return : byte(s) read (list)
-    def _read(self, count, desel=True):
+    def _read(self, count):
         if(_debug):
             print("\t_Read:")
         self._is_CTS()
-        self._spi_select()
-        reply = []
-        self._spi_wr(CMD_READ_CMD_BUFF)       
-        for i in range(count):
-            #self._wait_cts(read_reply=False)
-            reply.append( self._spi_rd())           
-        if(desel):
-            self._spi_deselect()
-        return reply
+        return self._xfer(si4063cmd.READ_CMD_BUFF, count)
     
     # Enter Shutdown State
+    # Waits for the fall of CTS (chip off), max 1mS. If CTS is Low already,
+    # the next pigpio write is later than SHDN High min 10μS.
     def shutdown(self):
-        self.pi.write(GPIO_SHDN, 1)     # PIN_SHDN = High
-        time.sleep(0.001)              # Wait 100μS
+        self.invalidate_properties()    # chip forgets the properties
+        if(self.metrics is not None):
+            self.metrics.tx_end()
+        self._cts_fall.clear()
+        cts = self.pi.read(self.pins.CTS)
+        self.pi.write(self.pins.SHDN, 1)     # PIN_SHDN = High
+        if(cts):
+            self._cts_fall.wait(0.001)
 
     # Exit Shutdown State
     def wakeup(self):
-        self.pi.write(GPIO_SHDN, 0)     # PIN_SHDN = Low
-        time.sleep(0.02)                # Wait 20mS
+        self._cts_event.clear()
+        self._cts_fall.clear()
+        self._cmd = ("por", time.perf_counter())
+        self.pi.write(self.pins.SHDN, 0)     # PIN_SHDN = Low
         #self._wait_cts(read_reply=0)
-        self._is_CTS()
+        self._wait_por(self._cmd[1])
 
     # Reset chip, shutdown and wake-up
+    # SHDN High pulse of 10μS by pigpiod, then wait for CTS of POR
     def reset(self):
-        self.shutdown()
-        self.wakeup()
+        self.invalidate_properties()    # chip forgets the properties
+        if(self.metrics is not None):
+            self.metrics.tx_end()
+        self._cts_event.clear()
+        self._cts_fall.clear()
+        self._cmd = ("por", time.perf_counter())
+        if(self.pi.read(self.pins.SHDN)):
+            self.pi.write(self.pins.SHDN, 0)    # in shutdown, wake-up
+        else:
+            self.pi.gpio_trigger(self.pins.SHDN, 10, 1)
+        self._wait_por(self._cmd[1])
+
+    # Wait for the end of POR
+    # CTS of the last command can be still High just after the SHDN pulse,
+    # the wait for CTS starts at its falling edge, or after POR_TIME if the
+    # fall is not seen. The pin is read again after an edge, as _is_CTS().
+    # start : perf_counter at SHDN Low
+    def _wait_por(self, start):
+        end = start + POR_TIME
+        while(self.pi.read(self.pins.CTS)):
+            remain = end - time.perf_counter()
+            if(remain <= 0 or not self._cts_fall.wait(remain)):
+                break
+            self._cts_fall.clear()
+        self._cts_event.clear()     # rising edges before the fall
+        self._is_CTS()          # CTS rises at the end of POR
+
+    # Attach to a chip powered and configured by an earlier run
+    # Needs Si4063(keep_power=True). The chip is checked by REQUEST_DEVICE_STATE and
+    # a checksum of the properties, then reset, power_up and setup can be skipped.
+    # expected : {(group, index): value}, e.g. si4063cfg.config_properties(blob)
+    # return : True if attached(the shadow has expected), False if a cold start is needed
+    def warm_attach(self, expected):
+        if(self._powered and not self.pi.read(self.pins.SHDN) and self.pi.read(self.pins.CTS)):
+            state = self.request_device_state()
+            if(state in (STATE_READY, STATE_SPI_ACTIVE, STATE_TX_TUNE, STATE_TX)):
+                image = self.snapshot(set(expected))    # and neighbours in the same reads
+                if(property_checksum({k: image[k] for k in expected}) == property_checksum(expected)):
+                    self._props = image
+                    if(state != STATE_READY):
+                        self.stop_tx()      # left on by the earlier run
+                    return True
+        return False
     
     # NOP,ensure communication established
     # return : CTS(0xff or 0x00)
     def nop(self):
         self._is_CTS()
-        self._spi_select()
-        self._spi_wr(CMD_NOP)
-        ret = self._spi_rd()
+        ret = self._xfer(si4063cmd.NOP, 1)[0]
         if(debug):
             print("Nop: {:02x}".format(ret))
-        self._spi_deselect()
-        #self._wait_cts(False)
         return ret
         
     # power-up(boot) and set XTAL freq
@@ -204,17 +373,18 @@ class Si4063:
             print("power_up")
         #self._wait_cts(read_reply=False)
         self._is_CTS()
-        FUNC = 1    # EZRadio PRO
-        TCXO = 0    # 0=XTAL, 1=ext TCXO
-        
-        to_send = [CMD_POWER_UP, FUNC, TCXO, 0xff & (FREQ_XTAL >> 24), 0xff & (FREQ_XTAL >> 16), 0xff & (FREQ_XTAL >> 8), 0xff & FREQ_XTAL]
+        to_send = self._power_up_command()
         if(debug):
             print("to_send: ", ' '.join('{:02x}'.format(x) for x in to_send))
         self._write(to_send)
 
-        time.sleep(0.01)
         #self._wait_cts(read_reply=False)
-        self._is_CTS()
+        self._is_CTS()          # CTS rises when booted
+
+    # POWER_UP command
+    @staticmethod
+    def _power_up_command():
+        return si4063cmd.POWER_UP     # EZRadio PRO, XTAL, FREQ_XTAL
 
      # Get device info(Chip No)
      # return : count: number of times tried to read, chip_no: chip number(0x4063)
@@ -223,25 +393,23 @@ class Si4063:
             print("part_info")
         chip_no = None
         
-        self._is_CTS()
-        time.sleep(0.01)
+        with self.cmd_lock:
+            self._write(si4063cmd.PART_INFO)
         
-        self._spi_select()
-        self._spi_wr(CMD_PART_INFO)
-        self._spi_deselect()
-        
-        count = 1
-        while(count<10):
-            part_info = self._read(1+8, desel=True)
-            if(part_info[0]==0xff):
-                chip_no = (part_info[2]<<8) + part_info[3]
-                if(debug):
-                    print("Part_info: ", ' '.join('{:02x}'.format(x) for x in part_info))
-                    print("Chip No : {:04x}".format(chip_no))
-                break  
-            else:
-                time.sleep(0.1)
-                count += 1
+            count = 1
+            while(count<10):
+                part_info = si4063cmd.parse_part_info(self._read(1+8))
+                if(part_info is not None):
+                    chip_no = part_info[1]
+                    if(debug):
+                        print("Part_info: ", part_info)
+                        print("Chip No : {:04x}".format(chip_no))
+                    break  
+                else:
+                    time.sleep(0.001)
+                    count += 1
+        if(self.metrics is not None):
+            self.metrics.part_info_retries += count - 1
        
         return count, chip_no
 
@@ -251,32 +419,27 @@ class Si4063:
         if(debug):
             print("get_adc_reading")
         #self._wait_cts(read_reply=False)
-        cmd = CMD_GET_ADC_READING
-        adc_en = (1<<4) | (1<<3) | (0<<2) | 0 # temperature, battery voltage, adc_gpio, adc_pin
-        adc_cfg = 0x00  # Use defaults
-        to_send = [cmd, adc_en, adc_cfg]
-        self._write( to_send, desel=True)
-        time.sleep(0.02)     # wait conversion
-
-        reply = self._read(1+6, desel=True)
+        with self.cmd_lock:
+            self._write(self._adc_command())
+            # CTS rises at the end of conversion, _read waits it
+            reply = self._read(1+6)
         #if(debug):
         #    print("ADC Reply: ", ' '.join('{:02x}'.format(x) for x in reply))
+        return self._adc_values(reply)
 
-        if(reply[0]==0xff):
-            # battery voltage
-            battery_adc = (reply[3]<<8) + reply[4]        
-            battery_voltage = 3*battery_adc / 1280
-            if(debug):
-                #print("Batt adc : {:04x}".format(battery_adc ))
-                print("Battery Voltage: ", battery_voltage)
-            # temprature
-            temp_adc = (reply[5]<<8) + reply[6]        
-            temp = (899 / 4096) * temp_adc - 293
-            if(debug):
-                #print("Temp adc : {:04x}".format(temp_adc ))
-                print("Temprature: ", temp)
-        else:
-            temp, battery_voltage = None, None
+    # GET_ADC_READING command
+    @staticmethod
+    def _adc_command():
+        return si4063cmd.GET_ADC_READING     # temperature, battery voltage, adc_cfg default
+
+    # Convert ADC reply
+    # return : temprature, battery voltage (None, None if not CTS)
+    @staticmethod
+    def _adc_values(reply):
+        temp, battery_voltage = si4063cmd.parse_adc_reading(reply)
+        if(debug):
+            print("Battery Voltage: ", battery_voltage)
+            print("Temprature: ", temp)
         return temp, battery_voltage
     
     # Request Device State
@@ -285,189 +448,313 @@ class Si4063:
         if(debug):
             print("request_device_state")
         #self._wait_cts(read_reply=False)
-        self._is_CTS()
-        time.sleep(0.01)
-        self._spi_select()
-        self._spi_wr(CMD_REQUEST_DEVICE_STATE)
-        self._spi_deselect()
+        with self.cmd_lock:
+            self._write(si4063cmd.REQUEST_DEVICE_STATE)
         
-        #self._wait_cts(read_reply=True)
-        dev_state = self._read(1+2, desel=True)
-        if(dev_state[0]==0xff):
             #self._wait_cts(read_reply=True)
-            cur_state = dev_state[1]
-        else:
-            cur_state = None
+            dev_state = si4063cmd.parse_device_state(self._read(1+2))
+        cur_state = None if dev_state is None else dev_state[0]
         if(debug):
-            print("Main State: ", ' '.join('{:02x}'.format(x) for x in dev_state))
+            print("Main State: ", dev_state)
         return cur_state
     
     # Change State in State Machine
     # next_state : next state to be
     def change_state(self, next_state):
-        cmd = CMD_CHANGE_STATE
-        to_send = [cmd, next_state]
-        self._write(to_send)
-        if(debug):
-            print("to_send: ", ' '.join('{:02x}'.format(x) for x in to_send))
+        self._send(self._cmds.change_state, next_state)
     
     # Set a value of property
     # group : group number of property
     # index : proterty index
     # val : value to be set
     def set_property(self, group, index, val):
-        command = CMD_SET_PROPERTY
-        to_send = [command, group, 1, index, val]
-        if(debug):
-            print("Set_prop TO_SEND: ", ' '.join('{:02x}'.format(x) for x in to_send))
-        self._write(to_send)
+        self.set_properties(group, index, (val,))
+
+    # Set a property by its descriptor
+    # prop : Prop of si4063const
+    # value : int, in prop.size bytes
+    def set_prop(self, prop, value):
+        self.set_properties(prop.group, prop.index, prop.encode(value))
     
     # Set  values of property
+    # Values same as the shadow are not sent, in batch() they are held until flush
     # group : group number of property
     # index : proterty index
-    # vals : values to be set (list)
+    # vals : values to be set (list or bytes)
     def set_properties(self, group, index, vals):
-        command = CMD_SET_PROPERTY
-        length = len(vals)
-        to_send = [command, group, length] + [index] + vals
-        if(debug):
-            print("Set_prop TO_SEND: ", ' '.join('{:02x}'.format(x) for x in to_send))
-        #self._wait_cts(reply=False)
-        self._write(to_send)
-        #self._wait_cts(read_reply=False)     
+        with self.cmd_lock:     # not into a batch being flushed
+            self.prop_stats["requested"] += 1
+            if(self._pending is not None):
+                for i, val in enumerate(vals):
+                    self._pending[(group, index + i)] = val
+                return
+        props = self._props
+        first, last, changed = None, 0, 0
+        for i, val in enumerate(vals):
+            if(props.get((group, index + i)) != val):
+                if(first is None):
+                    first = i
+                last = i
+                changed += 1
+        self.prop_stats["elided"] += len(vals) - changed
+        if(first is not None):
+            self._send_properties(group, index + first, vals[first:last + 1])
+
+    # Send SET_PROPERTY and update the shadow
+    def _send_properties(self, group, index, vals):
+        self._send(self._cmds.set_property, group, index, vals, name="Set_prop TO_SEND")
+        self.prop_stats["sent"] += 1
+        for i, val in enumerate(vals):
+            self._props[(group, index + i)] = val
+
+    # Hold property writes and send them at the end of block
+    # Changed values of adjacent indexes in a group go in one SET_PROPERTY(up to 12)
+    #   with radio.batch():
+    #       radio.set_pa_mode() ...
+    @contextlib.contextmanager
+    def batch(self):
+        with self.cmd_lock:
+            nested = self._pending is not None
+            if(not nested):
+                self._pending = {}
+        if(nested):
+            yield
+            return
+        try:
+            yield
+        except BaseException:
+            with self.cmd_lock:
+                self._pending = None
+            raise
+        self._flush(None)
+
+    # Send properties held in batch()
+    def flush_properties(self):
+        self._flush({})
+
+    # Send properties held, under cmd_lock then a set_property of another
+    # thread goes in the next flush or waits for this one
+    # after : properties held after this flush ({}: in batch, None: end of batch)
+    def _flush(self, after):
+        with self.cmd_lock:
+            pending, self._pending = self._pending, after
+            if(pending):
+                self._send_pending(pending)
+
+    def _send_pending(self, pending):
+        changed = sorted(k for k, val in pending.items() if self._props.get(k) != val)
+        self.prop_stats["elided"] += len(pending) - len(changed)
+        run = []
+        for group, index in changed:
+            if(run):
+                run_group, run_index = run[0]
+                gap = [(group, i) for i in range(run_index + len(run), index)]
+                # fill a gap with values in the shadow, it costs bytes not a transaction
+                if(group == run_group and index - run_index < 12 and all(k in self._props for k in gap)):
+                    run.extend(gap)
+                    run.append((group, index))
+                    continue
+                self._send_run(run, pending)
+            run = [(group, index)]
+        if(run):
+            self._send_run(run, pending)
+
+    def _send_run(self, run, pending):
+        group, index = run[0]
+        self._send_properties(group, index, [pending.get(k, self._props.get(k)) for k in run])
+
+    # Send a SET_PROPERTY as it is (a command of a config blob)
+    # Skipped if all values are in the shadow
+    # group : group number of property
+    # index : proterty index
+    # vals : values to be set (list or bytes)
+    def apply_properties(self, group, index, vals):
+        with self.cmd_lock:
+            self.prop_stats["requested"] += 1
+            if(all(self._props.get((group, index + i)) == val for i, val in enumerate(vals))):
+                self.prop_stats["elided"] += len(vals)
+                return
+            self._send_properties(group, index, vals)
+
+    # Send command bytes as they are (a command of a config blob)
+    # cmd : command bytes, opcode first
+    def send_command(self, cmd):
+        self._write(cmd)
+
+    # Forget the shadow (chip reset)
+    def invalidate_properties(self):
+        self._props = {}
+
+    # Metrics of the driver
+    # return : Metrics.stats() and property_stats(), None if metrics are off
+    def stats(self):
+        if(self.metrics is None):
+            return None
+        stats = self.metrics.stats()
+        stats["properties"] = self.property_stats()
+        return stats
+
+    # Statistics of property writes
+    # return : prop_stats and transactions saved
+    def property_stats(self):
+        stats = dict(self.prop_stats)
+        stats["saved"] = stats["requested"] - stats["sent"]
+        return stats
     
     # Get a value of property(s)
     # prop : list, [group, index, num of property]
     # return : value(s) of property (list)
     def get_property(self, prop):
-        to_send = [CMD_GET_PROPERTY, prop[0], prop[2], prop[1]]
-        if(debug):
-            print("Get_prop TO_SEND: ", ' '.join('{:02x}'.format(x) for x in to_send))
-        self._write(to_send)
-        time.sleep(0.01)
-        reply = self._read( 1 + prop[2])
+        with self.cmd_lock:
+            self._send(self._cmds.get_property, prop[0], prop[2], prop[1], name="Get_prop TO_SEND")
+            reply = self._read( 1 + prop[2])     # _read waits CTS, the reply is ready
         if(debug):
             print("prop(s): ", ' ', ' '.join('{:02x}'.format(x) for x in reply))
         return reply[1:]
+
+    # Get a value of property by its descriptor
+    # prop : Prop of si4063const
+    # return : int of prop.size bytes
+    def get_prop(self, prop):
+        return prop.decode(self.get_property(prop))
+
+    # Read properties in as few GET_PROPERTY as possible
+    # keys : (group, index) to read (None: PROPERTIES and the shadow)
+    # return : register image {(group, index): value}
+    def snapshot(self, keys=None):
+        if(keys is None):
+            keys = set(self._props)
+            for group, index, size in PROPERTIES:
+                keys.update((group, index + i) for i in range(size))
+        image = {}
+        for group, index, count in snapshot_reads(keys):
+            for i, val in enumerate(self.get_property([group, index, count])):
+                image[(group, index + i)] = val
+        return image
+
+    # Check the properties of the chip
+    # The shadow has the values written since power_up, a difference means
+    # a silent reset of the chip or a write lost.
+    # expected : {(group, index): value} (None: the shadow)
+    # return : {(group, index): (expected, actual)}, empty if the chip is as expected
+    def verify(self, expected=None):
+        if(expected is None):
+            expected = self._props
+        return diff_image(self.snapshot(set(expected)), expected)
     
     # Set Xtal frequency tuning 
     def set_global_xo_tune(self):
-        group, index = GLOBAL_XO_TUNE[0], GLOBAL_XO_TUNE[1]
         tune_value = 0x40       # High=7f, Low=0
         global_xo_tune = 0x7f & tune_value  # 7bits
-        self.set_property(group, index, global_xo_tune)
+        self.set_prop(GLOBAL_XO_TUNE, global_xo_tune)
 
     # Chip Operation mode setting
     def set_global_config(self):
-        group, index = GLOBAL_CONFIG[0], GLOBAL_CONFIG[1]
         reserved = 0x01
         fast = 1    # quick start_tx
         fifo = 0    # split
         generic = 0 # generic protocol
         high_perf = 0  # 0=high performance TX and RX, 1=Low power mode TX and RX
         global_cfg = 0xff & ((reserved << 6) | (fast << 5) | (fifo << 4) | (generic <<1) | high_perf)
-        self.set_property(group, index, global_cfg)
+        self.set_prop(GLOBAL_CONFIG, global_cfg)
 
     # Interrupt setting
-    def set_int_ctl_enable(self):
-        group, index = INT_CTL_ENABLE[0], INT_CTL_ENABLE[1]
+    # ph_int : packet handler interrupts on nIRQ, 0=DISABLED, 1=ENABLED
+    def set_int_ctl_enable(self, ph_int=0):
         chip_int = 0    # 0=DISABLED, 1=ENABLED
-        ph_int = 0
         int_ctrl = chip_int<<2 | ph_int
-        self.set_property(group, index, int_ctrl)
+        self.set_prop(INT_CTL_ENABLE, int_ctrl)
+
+    # Packet handler interrupts, FIFO almost empty and packet sent
+    def set_int_ctl_ph_enable(self):
+        self.set_prop(INT_CTL_PH_ENABLE, PH_PACKET_SENT | PH_TX_FIFO_ALMOST_EMPTY)
+
+    # TX FIFO almost empty when threshold bytes are free
+    def set_pkt_tx_threshold(self, threshold=TX_THRESHOLD):
+        self.set_prop(PKT_TX_THRESHOLD, threshold)
         
     # disable tx preamble
     def set_preamble_tx_length(self):
-        group, index = PREAMBLE_TX_LENGTH[0], PREAMBLE_TX_LENGTH[1]
         tx_length = 0
-        self.set_property(group, index, tx_length)
+        self.set_prop(PREAMBLE_TX_LENGTH, tx_length)
 
     # No transmit sync word
     def set_sync_config(self):
-        group, index = SYNC_CONFIG[0], SYNC_CONFIG[1]
         sync_cfg = 0xff & (1 << 7 )  # NO_SYNC_XMIT
-        self.set_property(group, index, sync_cfg)
+        self.set_prop(SYNC_CONFIG, sync_cfg)
 
     # Select modulation type and source (CW/OOK/FSK, ASYNC Direct mode)
     def set_modem_mod_type_direct(self, type_mod):
-        group, index = MODEM_MOD_TYPE[0], MODEM_MOD_TYPE[1]
+        self.set_modem_mod_type(type_mod, MOD_SOURCE_DIRECT)
+
+    # Select modulation type and source
+    # source : MOD_SOURCE_DIRECT(GPIO0), MOD_SOURCE_PACKET(TX FIFO), MOD_SOURCE_PSEUDO
+    def set_modem_mod_type(self, type_mod, source=MOD_SOURCE_DIRECT):
         tx_direct_mod_type = (DIRECT_MOD_TYPE_ASYNC<<7)     # 1=ASYNC, 0=SYNC
         tx_direct_mod_gpio = (0<<5)     # 0=GPIO0
-        mod_source = (MOD_SOURCE_DIRECT <<3)            # 1=DIRECT, 2=PSEUDO, 0=PACKET
+        mod_source = (source <<3)            # 1=DIRECT, 2=PSEUDO, 0=PACKET
         if(type_mod<MOD_TYPE_CW or type_mod>MOD_TYPE_FSK):
             raise Exception("Error: MOD_TYPE")
         mod_type = 0xff & (tx_direct_mod_type | tx_direct_mod_gpio | mod_source | type_mod)
-        self.set_property(group, index, mod_type)
+        self.set_prop(MODEM_MOD_TYPE, mod_type)
     
     # Set Data Rate
     def set_modem_data_rate(self, data_rate):
-        group, index = MODEM_DATA_RATE[0], MODEM_DATA_RATE[1]
-        props = [0xff & (data_rate>>16), 0xff & (data_rate>>8), 0xff & data_rate]
-        self.set_properties(group, index, props)
+        self.set_prop(MODEM_DATA_RATE, data_rate)
         
     # Setup NCO modulo and oversampling mode
     def set_modem_tx_nco_mode(self):
-        group, index = MODEM_TX_NCO_MODE[0], MODEM_TX_NCO_MODE[1]   # 0x06..0x09
         txosr = 0    # 0=ENUM_0 10x
         #
         # MODEM_TX_NCO_MODE = MODEM_DATA_RATE x FREQ_XTAL / (TX_DATA_RATE x TXOSR)
         # Here, Define MODEM_DATA_RATE = TX_DATA_RATE, TXOSR = 10
         ncomod = int(FREQ_XTAL / 10)
-        props = [0xff & ((txosr <<2) | (ncomod>>24)), 0xff & (ncomod >>16), 0xff & (ncomod >>8), 0xff & ncomod]
-        self.set_properties(group, index, props)
+        self.set_prop(MODEM_TX_NCO_MODE, (txosr << 26) | ncomod)
     
     # Set FSK Deviation
     def set_modem_freq_dev(self, freq_dev=8333):
-        group, index = MODEM_FREQ_DEV[0], MODEM_FREQ_DEV[1]   # 0x0a..0x0c
         # MODEM_FREQ_DEV = 2^19 * outdiv * desired_dev_Hz / ( Npresc * freq_xo)
         # Here, outdiv = OUTDIV_2M, Npresc = 2,
         modem_freq_dev = round( 2**19 * OUT_DIV_2M * freq_dev / (2 * FREQ_XTAL))   # 2=High performance
         if(debug):
             print(freq_dev, modem_freq_dev)
-        props = [0xff & (modem_freq_dev>>16), 0xff & modem_freq_dev>>8, 0xff & modem_freq_dev]
-        self.set_properties(group, index, props)
+        self.set_prop(MODEM_FREQ_DEV, modem_freq_dev)
 
     # Set offset frequency
     def set_modem_freq_offset(self, freq_offset):
-        group, index = MODEM_FREQ_OFFSET[0], MODEM_FREQ_OFFSET[1]   # 0x0d..0x0e
         # MODEM_FREQ_OFFSET = 2^19 * outdiv * desired_offset_Hz / ( Npresc * freq_xo)
         # Here, outdiv = OUTDIV_2M, Npresc = 2,
         modem_freq_offset = round( 2**19 * OUT_DIV_2M * freq_offset / (2 * FREQ_XTAL))   # 2=High performance
-        props = [0xff & modem_freq_offset>>8, 0xff & modem_freq_offset]
-        self.set_properties(group, index, props)
+        self.set_prop(MODEM_FREQ_OFFSET, modem_freq_offset)     # two's complement
 
     # Set chip High performance and 2m band
     def set_modem_clkgen_band(self):
-        group, index = MODEM_CLKGEN_BAND[0], MODEM_CLKGEN_BAND[1]
         sy_recal = 1<<4         # SKIP FORCE_SY_RECAL
         sy_sel = DIV_BY_2<<3      # 1=Div-by-2,High performance
         #band = FVCO_DIV_8    # 2=FVCO_DIV_8(3.6GHz/8=450MHz)
         band = FVCO_DIV_24    # 5=FVCO_DIV_24(3.6GHz/24=150MHz)
         modem_clkgen_band = sy_recal | sy_sel | band
-        self.set_property(group, index, modem_clkgen_band)
+        self.set_prop(MODEM_CLKGEN_BAND, modem_clkgen_band)
         
     # Enable TX Ramp Signal and Set pa_mode HP_COARSE/SQW
     def set_pa_mode(self):
-        group, index = PA_MODE[0], PA_MODE[1]
         ext_pa_ramp = EXT_TX_RAMP_EN<<7     # 1=Enable, 0=Disable tx ramp signal
         pa_sel = HP_COARSE<<2           # 2=HP_COARSE, 1=HP_FINE, 6=LowPower(Si4460), 8=MidPower(Si4461)
         #pa_sel = HP_FINE<<2           # 2=HP_COARSE, 1=HP_FINE, 6=LowPower(Si4460), 8=MidPower(Si4461)
         pa_mode = ext_pa_ramp | pa_sel  # bit0 0=Class-E/Square Wave match, 1=Switched Current Mode
-        self.set_property(group, index, pa_mode)  # SQW
+        self.set_prop(PA_MODE, pa_mode)  # SQW
     
     # Configure PA output level (ddac = 0x0:min - 0x7f:max)
     def set_pa_pwr_lvl(self, ddac):
-        group, index = PA_PWR_LVL[0], PA_PWR_LVL[1]
         pwr_lvl = 0x7f & ddac
-        self.set_property(group, index, pwr_lvl)
+        self.set_prop(PA_PWR_LVL, pwr_lvl)
         
     # Set PA duty cycle and bias current
     def set_pa_bias_clkduty(self, ob=0x0):
-        group, index = PA_BIAS_CLKDUTY[0], PA_BIAS_CLKDUTY[1]
         clk_duty = CLKDUTY_DIFF_50 << 6    # 3=SINGLE_25, 0=DIFF_50
         #ob = 0x3f           # When Switched Current Mode
         bias_clkduty = 0xff & (clk_duty | ob)
-        self.set_property(group, index, bias_clkduty)
+        self.set_prop(PA_BIAS_CLKDUTY, bias_clkduty)
     
     # Set frequency (now 2m band only)
     def set_radio_frequency(self, freq):
@@ -477,30 +764,37 @@ class Si4063:
             print("set_radio_frequency")
         if (freq < 144e6) or (freq > 146e6):
             raise Exception("Error: ", sys._getframe().f_code.co_name)
-        ### Set Integer Divider
-        group, index = FREQ_CONTROL_INTE[0], FREQ_CONTROL_INTE[1]
-        outdiv = OUT_DIV_2M     # 145MHz band
-        f_int_2m = 2 * FREQ_XTAL / outdiv
-        f_int = int(freq / f_int_2m) - 1       # f_frac must be between 1 and 2
-        self.set_property(group, index, f_int)
-        ### Set Fractinal Divider
-        group, index = FREQ_CONTROL_FRAC[0], FREQ_CONTROL_FRAC[1]
-        f_frac = round((freq / f_int_2m - f_int) * 2**19)        
-        frac19 = 0xff & (f_frac >>16)
-        frac15 = 0xff & (f_frac >>8)
-        frac7 = 0xff & (f_frac)
-        props = [frac19, frac15, frac7]
-        self.set_properties(group, index, props)
-
-        f_out = (f_int + f_frac/2**19) * 2 * FREQ_XTAL / outdiv
+        ### Set Integer and Fractinal Divider, 145MHz band
+        f_int, f_frac = dividers(freq)      # f_frac/2**19 must be between 1 and 2
+        # INTE and FRAC are adjacent, changed bytes in one SET_PROPERTY
+        self.set_prop(FREQ_CONTROL, (f_int << 24) | f_frac)
+
+        f_out = output_frequency(f_int, f_frac)
         if(debug):
             print("int: {}, frac: {}".format(f_int, f_frac))
-            print("props:", ' '.join('{:02x}'.format(x) for x in props))
+            print("props:", FREQ_CONTROL.encode((f_int << 24) | f_frac).hex(' '))
             print("ratio(1<2): ", f_frac/2**19)
             print("freq: {}, fout: {}".format(freq, f_out))
             self.get_property(FREQ_CONTROL_INTE)
             self.get_property(FREQ_CONTROL_FRAC)
 
+    # Channel plan of hop()
+    # return : self.plan, 144-146MHz by 12.5kHz if not set
+    def channel_plan(self):
+        if(self.plan is None):
+            self.plan = ChannelPlan()
+        return self.plan
+
+    # Set frequency of a channel, precomputed in the plan
+    # Only the bytes different from the shadow are written, one SET_PROPERTY.
+    # channel : channel number of channel_plan(), 0 <= channel < len(plan)
+    # retune : START_TX again to apply the frequency while transmitting
+    def hop(self, channel, retune=False):
+        plan = self.channel_plan()
+        self.set_properties(FREQ_CONTROL.group, FREQ_CONTROL.index, plan.props[plan.check(channel)])
+        if(retune):
+            self.start_tx()
+
     # Set OOK / Direct mode
     def set_mod_ook(self):
         self.set_modem_mod_type_direct(MOD_TYPE_OOK)
@@ -511,81 +805,192 @@ class Si4063:
     
     # Select feed forward charge pump current
     def set_synth_pfdcp_cpff(self):
-        group, index = SYNTH_PFDCP_CPFF[0], SYNTH_PFDCP_CPFF[1]
         cp_ff_cur = 0x0
         pfdcp_cpff = cp_ff_cur 
-        self.set_property(group, index, pfdcp_cpff)
+        self.set_prop(SYNTH_PFDCP_CPFF, pfdcp_cpff)
         
     #
     # Select integration charge pump current
     def set_synth_pfdcp_cpint(self):
-        group, index = SYNTH_PFDCP_CPINT[0], SYNTH_PFDCP_CPINT[1]
         cp_int_cur = 0x0    # 40
         pfdcp_cpint = cp_int_cur 
-        self.set_property(group, index, pfdcp_cpint)
+        self.set_prop(SYNTH_PFDCP_CPINT, pfdcp_cpint)
     
     # Set gain scaling factors(Kv)
     def set_synth_vco_kv(self):
-        group, index = SYNTH_VCO_KV[0], SYNTH_VCO_KV[1]
         ### [1,1] works well ###
         kv_dir = 0x1    # 1=half, 2=max
         kv_int = 0x1    # 1=33percent, 2=66percent 3=max
         vco_kv = kv_dir<<2 + kv_int 
-        self.set_property(group, index, vco_kv)        
+        self.set_prop(SYNTH_VCO_KV, vco_kv)        
         
     # Initialize si4063 registers. Called After Power-up
     # type_mod : modulation type, CW/OOK/FSK
     # freq_dev : FSK frequency deviation Hz
-    def setup(self, type_mod, freq_dev=8333):
+    # source : MOD_SOURCE_DIRECT(TX_DATA pin), MOD_SOURCE_PACKET(send_packet())
+    #          or MOD_SOURCE_PSEUDO(PN9 by the chip from start_tx() to stop_tx())
+    # data_rate : bps of packet/PN9 mode, DATA_RATE_MIN-DATA_RATE_MAX
+    def setup(self, type_mod, freq_dev=8333, source=MOD_SOURCE_DIRECT, data_rate=None):
         if(debug):
             print("Modulation : {}".format(type_mod))
-        data_rate = 64000   # DUMMY in Direct Async mode
-        self.set_global_config()
-        self.set_global_xo_tune()
+        if(source == MOD_SOURCE_DIRECT):
+            data_rate = 64000   # DUMMY in Direct Async mode
+        elif(data_rate is None or data_rate < DATA_RATE_MIN or data_rate > DATA_RATE_MAX):
+            raise Exception("Error: data rate {}".format(data_rate))
+        with self.batch():     # changed properties only, adjacent ones in one command
+            self.set_global_config()
+            self.set_global_xo_tune()
         
-        self.set_int_ctl_enable()
+            packet = source == MOD_SOURCE_PACKET
+            self.set_int_ctl_enable(1 if packet else 0)
+            if(packet):
+                self.set_int_ctl_ph_enable()
+                self.set_pkt_tx_threshold()
         
-        self.set_preamble_tx_length()
-        self.set_sync_config()
+            self.set_preamble_tx_length()
+            self.set_sync_config()
         
-        self.set_modem_tx_nco_mode()
-        self.set_modem_data_rate(data_rate)
-        self.set_modem_mod_type_direct(type_mod)
-        if(type_mod == MOD_TYPE_FSK):
-            self.set_modem_freq_dev(freq_dev)
-        self.set_modem_clkgen_band()    # Set 2m band 
-        #
-        bias = 0x0
-        self.set_pa_bias_clkduty(bias)
-        self.set_pa_mode()
-        #ddac = 0x7f
-        #self.set_pa_pwr_lvl(ddac)
+            self.set_modem_tx_nco_mode()
+            self.set_modem_data_rate(data_rate)     # = bps, NCO_MODE and TXOSR of set_modem_tx_nco_mode()
+            self.set_modem_mod_type(type_mod, source)
+            if(type_mod == MOD_TYPE_FSK):
+                self.set_modem_freq_dev(freq_dev)
+            self.set_modem_clkgen_band()    # Set 2m band 
+            #
+            bias = 0x0
+            self.set_pa_bias_clkduty(bias)
+            self.set_pa_mode()
+            #ddac = 0x7f
+            #self.set_pa_pwr_lvl(ddac)
         
-        #self.set_synth_pfdcp_cpff()
-        #self.set_synth_pfdcp_cpint()
-        # uncomment the following if the frequency is unstable
-        #self.set_synth_vco_kv()
+            #self.set_synth_pfdcp_cpff()
+            #self.set_synth_pfdcp_cpint()
+            # uncomment the following if the frequency is unstable
+            #self.set_synth_vco_kv()
+        self.mod_source = source
+        self.data_rate = data_rate if source != MOD_SOURCE_DIRECT else None
     
     # set tx bit in direct mode
     def tx_data(self, bit):
-        self.pi.write(GPIO_TX_DATA, bit & 0x01)  # TX_DATA
+        self.pi.write(self.pins.TX_DATA, bit & 0x01)  # TX_DATA
             
     # set tx bit toggled
     def tx_data_toggle(self):
-        self.pi.write(GPIO_TX_DATA, not self.pi.read(GPIO_TX_DATA))  # TX_DATA
+        self.pi.write(self.pins.TX_DATA, not self.pi.read(self.pins.TX_DATA))  # TX_DATA
     
+    # send bits in direct mode, timed by pigpio DMA waves
+    # bits : iterable of 0/1
+    # baud : bits per second
+    # wait : wait for end of bits
+    def tx_bits(self, bits, baud, wait=True):
+        if(self.wave is None):
+            self.wave = TxWave(self.pi, self.pins.TX_DATA)
+        self.wave.send_bits(bits, baud, wait)
+
+    # send runs in direct mode, timed by pigpio DMA waves
+    # runs : iterable of (level, duration_us)
+    # wait : wait for end of runs
+    def tx_runs(self, runs, wait=True):
+        if(self.wave is None):
+            self.wave = TxWave(self.pi, self.pins.TX_DATA)
+        self.wave.send_runs(runs, wait)
+
+    # send runs in direct mode, timed by python on absolute deadlines
+    # runs : iterable of (level, duration_us) or (level, duration_us, progress mark)
+    # resume : start at the end of the last runs if it is not passed yet
+    def key_runs(self, runs, resume=False):
+        if(self.keyer is None):
+            self.keyer = Keyer(self)
+        return self.keyer.run(runs, resume)
+
     # start transmit
-    def start_tx(self):
-        cmd = CMD_START_TX
+    # tx_len : bytes from the TX FIFO in packet mode, 0 in direct mode
+    def start_tx(self, tx_len=0):
         txcomplete_state = STATE_READY<<4   # 1=SLEEP, 2=SPI_ACTIVE, 3=READY
         start_timing = 0   # 0=immediate, 1=upon WUT
         condition = txcomplete_state + start_timing
         channel = 0
-        tx_len = [0, 0]  # 0=Direct mode??
-        to_send = [cmd, channel, condition, tx_len[1], tx_len[0], 0, 0]
-        self._write(to_send)
-        if(debug):
-            print("to_send: ", ' '.join('{:02x}'.format(x) for x in to_send))        
+        self._send(self._cmds.start_tx, channel, condition, 0x1fff & tx_len, 0, 0)
+
+    ### packet mode
+    # TX FIFO status
+    # reset_tx : empty the TX FIFO
+    # return : rx_fifo_count, tx_fifo_space
+    def fifo_info(self, reset_tx=False):
+        with self.cmd_lock:
+            self._send(self._cmds.fifo_info, FIFO_RESET_TX if reset_tx else 0)
+            reply = self._read(1+2)
+        return reply[1], reply[2]
+
+    # Read and clear the packet handler interrupts
+    # return : pending interrupts, PH_PACKET_SENT | PH_TX_FIFO_ALMOST_EMPTY
+    def get_ph_status(self):
+        with self.cmd_lock:
+            self._send(self._cmds.get_ph_status, 0)     # 0: clear all
+            reply = self._read(1+2)
+        return reply[1]
+
+    # Write bytes into the TX FIFO
+    # The FIFO is not the command buffer, no wait for CTS.
+    # data : up to the free space of the FIFO
+    def write_tx_fifo(self, data):
+        with self.cmd_lock:
+            to_send = self._cmds.write_tx_fifo.pack(data)
+            if(self.metrics is not None):
+                self.metrics.command(to_send)
+            self._xfer(to_send)
+
+    # Wait for nIRQ Low
+    # raise : TimeoutError if nIRQ is not Low in timeout
+    def _wait_irq(self, timeout):
+        deadline = time.perf_counter() + timeout
+        while(self.pi.read(self.pins.nIRQ)):
+            remain = deadline - time.perf_counter()
+            if(remain <= 0 or not self._irq_event.wait(remain)):
+                if(self.pi.read(self.pins.nIRQ)):
+                    raise TimeoutError("Error: nIRQ timeout {:.3f}S".format(timeout))
+                break
+            self._irq_event.clear()
+
+    # Send a packet in packet mode, after setup(source=MOD_SOURCE_PACKET)
+    # The chip clocks the bytes out of the TX FIFO at data_rate, the FIFO is
+    # filled up again at each almost empty interrupt on nIRQ(TX_THRESHOLD bytes free).
+    # No preamble, no sync word:
+    # the bytes are sent as they are (e.g. AX.25 frames with their flags).
+    # data : bytes, up to TX_LEN_MAX
+    # return : refills of the FIFO
+    def send_packet(self, data):
+        if(self.mod_source != MOD_SOURCE_PACKET):
+            raise Exception("Error: not in packet mode")
+        if(len(data) < 1 or len(data) > TX_LEN_MAX):
+            raise Exception("Error: packet length {}".format(len(data)))
+        # a FIFO of bytes on air + margin
+        timeout = self.cts_timeout + TX_FIFO_SIZE * 8 / self.data_rate
+        with self.cmd_lock:
+            self.fifo_info(reset_tx=True)
+            self.get_ph_status()
+            pos = min(len(data), TX_FIFO_SIZE)
+            self.write_tx_fifo(data[:pos])
+            self._irq_event.clear()
+            self.start_tx(len(data))
+        refills = 0
+        pend = 0
+        while(not pend & PH_PACKET_SENT):
+            try:
+                self._wait_irq(timeout)
+            except TimeoutError:
+                self.stop_tx()      # e.g. FIFO underflow, refills too slow for data_rate
+                raise
+            with self.cmd_lock:
+                pend = self.get_ph_status()     # cleared before the refill, the next one is not lost
+                if(pos < len(data)):   # nIRQ of almost empty, the packet is not sent yet
+                    chunk = data[pos:pos + self.fifo_info()[1]]
+                    self.write_tx_fifo(chunk)
+                    pos += len(chunk)
+                    refills += 1
+        if(self.metrics is not None):
+            self.metrics.tx_end()   # READY after the packet
+        return refills
 
     # stop transmit and set state READY
     def stop_tx(self):
@@ -597,18 +1002,29 @@ class Si4063:
             print(sys._getframe().f_code.co_name)
         self.change_state(STATE_TX)    
     
-    # destructor
+    # destructor, also of a radio whose __init__ failed on the way
     def __del__(self):
-        self.pi.stop()          # Stop handling pin       
+        for name in ("_cts_cb", "_cts_fall_cb", "_irq_cb"):
+            cb = getattr(self, name, None)
+            if(cb is not None):
+                cb.cancel()
+        spi = getattr(self, "spi", None)
+        if(spi is not None):
+            spi.close()
+        if(getattr(self, "_pooled", False) and getattr(self, "pi", None) is not None):
+            pool.release(self.pi)   # Stop handling pin by the last radio
 
 # TEST
 # help message 
 def show_help():
     print("options: -f/-o/-c/-h")
     print("-c duration(seconds) : Transmit Continuous wave for duration" )
-    print("-f : transmit fsk signal")
-    print("-o : transmit ook signal")
+    print("-f (baud) : transmit fsk signal")
+    print("-o (baud) : transmit ook signal")
+    print("-p (bps) : transmit fsk packets from the TX FIFO")
+    print("--pn9 : with -f/-o (bps), PN9 data generated by the chip")
     print("-h : Show this help")
+    print("--sim : run on the simulator(si4063sim.py), no hat")
 
 ##### TEST #####
 import sys
@@ -616,6 +1032,12 @@ import sys
 if __name__ == '__main__':
     print("si4063.py ver.", __version__ )
     args = sys.argv
+    sim = "--sim" in args
+    if(sim):
+        args.remove("--sim")
+    pn9 = "--pn9" in args
+    if(pn9):
+        args.remove("--pn9")
     try:
         cmd = args[1]
     except:
@@ -626,7 +1048,12 @@ if __name__ == '__main__':
         show_help()
         exit()
         
-    si4063 = Si4063()    
+    # packet mode refills the FIFO in time by bb_spi
+    pi = None
+    if(sim):
+        import si4063sim     # no hat
+        pi = si4063sim.pi()
+    si4063 = Si4063(pi=pi, spi="bb" if cmd == "-p" else None)
     si4063.reset()          # Shutdown and Wake-up
     
     # Check part info
@@ -656,11 +1083,29 @@ if __name__ == '__main__':
 
     # setup symbol rate
     baud = 1000
-    interval = 1/baud
     duration = 10
+    # -f/-o baud : 1010... timed by DMA waves
+    try:
+        wave_baud = int(args[2]) if cmd in ("-f", "-o") else None
+    except:
+        wave_baud = None
     
     # Parse command line
-    if(cmd == "-f"):
+    if(pn9 and cmd in ("-f", "-o")):
+        ### PN9 by the chip, nothing to do during the transmission
+        data_rate = wave_baud or 10000
+        print("PN9 {}, bps: {}".format("FSK" if cmd == "-f" else "OOK", data_rate))
+        if(cmd == "-f"):
+            si4063.setup(MOD_TYPE_FSK, 8000, MOD_SOURCE_PSEUDO, data_rate)
+            si4063.set_modem_freq_offset(3000)
+        else:
+            si4063.setup(MOD_TYPE_OOK, source=MOD_SOURCE_PSEUDO, data_rate=data_rate)
+            si4063.set_modem_freq_offset(-5000)
+        si4063.start_tx()
+        time.sleep(duration)
+        si4063.stop_tx()
+        
+    elif(cmd == "-f"):
         ### FSK
         print("FSK mode")
         freq_dev = 8000
@@ -668,9 +1113,13 @@ if __name__ == '__main__':
         freq_offset = 3000
         si4063.set_modem_freq_offset(freq_offset)
         si4063.start_tx()    
-        for i in range(baud*duration):
-            si4063.tx_data_toggle()
-            time.sleep(interval)
+        if(wave_baud):
+            print("Baud(DMA): ", wave_baud)
+            si4063.tx_bits((i & 1 ^ 1 for i in range(wave_baud*duration)), wave_baud)
+            si4063.tx_data(0)
+        else:
+            si4063.key_runs(bits_to_runs((i & 1 ^ 1 for i in range(baud*duration)), baud))
+            si4063.tx_data(0)
         si4063.stop_tx()
         
     elif(cmd=="-o"):
@@ -680,11 +1129,30 @@ if __name__ == '__main__':
         freq_offset = -5000
         si4063.set_modem_freq_offset(freq_offset)
         si4063.start_tx()
-        for i in range(baud*duration):
-            si4063.tx_data_toggle()
-            time.sleep(interval)
+        if(wave_baud):
+            print("Baud(DMA): ", wave_baud)
+            si4063.tx_bits((i & 1 ^ 1 for i in range(wave_baud*duration)), wave_baud)
+            si4063.tx_data(0)
+        else:
+            si4063.key_runs(bits_to_runs((i & 1 ^ 1 for i in range(baud*duration)), baud))
+            si4063.tx_data(0)
         si4063.stop_tx()
         
+    elif(cmd=="-p"):
+        ### FSK packet mode, timed by the chip
+        try:
+            data_rate = int(args[2])
+        except:
+            data_rate = 9600
+        print("Packet mode, bps: ", data_rate)
+        si4063.setup(MOD_TYPE_FSK, 8000, MOD_SOURCE_PACKET, data_rate)
+        si4063.set_modem_freq_offset(3000)
+        packet = bytes(range(256)) * 4
+        count = max(1, data_rate * duration // (8 * len(packet)))
+        t = time.perf_counter()
+        refills = sum(si4063.send_packet(packet) for i in range(count))
+        print("{} bytes in {:.3f} S, {} refills".format(count * len(packet), time.perf_counter() - t, refills))
+        
     elif(cmd=="-c"):
         ### CW for radio test
         print("CW mode")
@@ -0,0 +1,204 @@
+# si4063async.py
+# asyncio API for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# SPI transactions run in a thread of each radio, waits are asyncio.sleep,
+# then the event loop is never blocked and several radios share one loop.
+# TX_DATA is keyed in another thread, a command does not delay the keying.
+#
+# usage:
+#   radio = AsyncSi4063(si4063.Si4063())
+#   await radio.reset()
+#   await radio.power_up()
+#   await radio.send_morse("CQ", 20)
+#
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from si4063const import *
+import si4063cmd
+import radio_morse
+
+class AsyncSi4063:
+    # radio : Si4063
+    def __init__(self, radio):
+        self.radio = radio
+        self.lock = asyncio.Lock()      # one command sequence at a time
+        self._spi = ThreadPoolExecutor(max_workers=1, thread_name_prefix="si4063_spi")
+        self._tx = ThreadPoolExecutor(max_workers=1, thread_name_prefix="si4063_tx")
+
+    # Run func in the SPI thread
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._spi, func, *args)
+
+    # Run func in the TX thread
+    async def _call_tx(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._tx, func, *args)
+
+    # Run a method of Si4063 as one command sequence
+    async def _command(self, func, *args):
+        async with self.lock:
+            return await self._call(func, *args)
+
+    def close(self):
+        self._spi.shutdown()
+        self._tx.shutdown()
+
+    ### commands with waits
+    # Reset chip, shutdown and wake-up
+    async def reset(self):
+        await self._command(self.radio.reset)     # waits CTS of POR, no sleep
+
+    # power-up(boot) and set XTAL freq
+    async def power_up(self):
+        async with self.lock:
+            await self._call(self.radio._write, self.radio._power_up_command())
+            await self._call(self.radio._is_CTS)    # CTS rises when booted
+
+    # Get device info(Chip No)
+    # return : count: number of times tried to read, chip_no: chip number(0x4063)
+    async def part_info(self):
+        async with self.lock:
+            await self._call(self.radio._write, si4063cmd.PART_INFO)
+            count = 1
+            while(count<10):
+                part_info = si4063cmd.parse_part_info(await self._call(self.radio._read, 1+8))
+                if(part_info is not None):
+                    if(self.radio.metrics is not None):
+                        self.radio.metrics.part_info_retries += count - 1
+                    return count, part_info[1]
+                await asyncio.sleep(0.001)
+                count += 1
+            if(self.radio.metrics is not None):
+                self.radio.metrics.part_info_retries += count - 1
+            return count, None
+
+    # Read and Convert temperature and battery voltage
+    # return : temprature, battery voltage
+    async def get_adc_reading(self):
+        return await self._command(self.radio.get_adc_reading)     # no sleep, CTS ends the conversion
+
+    # Request Device State
+    # return : current state
+    async def request_device_state(self):
+        dev_state = si4063cmd.parse_device_state(await self._command(self._device_state))
+        return None if dev_state is None else dev_state[0]
+
+    # REQUEST_DEVICE_STATE and reply, in the SPI thread
+    def _device_state(self):
+        with self.radio.cmd_lock:
+            self.radio._write(si4063cmd.REQUEST_DEVICE_STATE)
+            return self.radio._read(1+2)
+
+    # Get a value of property(s)
+    # prop : list, [group, index, num of property]
+    # return : value(s) of property (list)
+    async def get_property(self, prop):
+        return await self._command(self.radio.get_property, prop)
+
+    ### commands without waits
+    async def setup(self, type_mod, freq_dev=8333, source=MOD_SOURCE_DIRECT, data_rate=None):
+        await self._command(self.radio.setup, type_mod, freq_dev, source, data_rate)
+
+    async def set_radio_frequency(self, freq):
+        await self._command(self.radio.set_radio_frequency, freq)
+
+    async def set_modem_freq_offset(self, freq_offset):
+        await self._command(self.radio.set_modem_freq_offset, freq_offset)
+
+    async def set_pa_pwr_lvl(self, ddac):
+        await self._command(self.radio.set_pa_pwr_lvl, ddac)
+
+    async def set_property(self, group, index, val):
+        await self._command(self.radio.set_property, group, index, val)
+
+    async def set_properties(self, group, index, vals):
+        await self._command(self.radio.set_properties, group, index, vals)
+
+    async def change_state(self, next_state):
+        await self._command(self.radio.change_state, next_state)
+
+    async def start_tx(self):
+        await self._command(self.radio.start_tx)
+
+    async def stop_tx(self):
+        await self._command(self.radio.stop_tx)
+
+    async def tx_data(self, bit):
+        await self._call_tx(self.radio.tx_data, bit)
+
+    ### transmission
+    # Send a packet from the TX FIFO, refilled in the TX thread at nIRQ
+    # return : refills of the FIFO
+    async def send_packet(self, data):
+        return await self._call_tx(self.radio.send_packet, data)
+
+    # Stop the DMA waves at once and TX_DATA Low
+    # Called in the SPI thread, the TX thread may be busy queuing waves.
+    def _halt(self):
+        self.radio.pi.wave_tx_stop()
+        self.radio.tx_data(0)
+
+    # Runs until stop is set, then no more waves are queued
+    @staticmethod
+    def _runs_until(runs, stop):
+        for run in runs:
+            if(stop.is_set()):
+                raise Exception("Error: keying stopped")
+            yield run
+
+    # Stop the waves, then release them when the TX thread has stopped queuing
+    # queued : future of tx_runs in the TX thread
+    async def _stop_waves(self, queued):
+        await self._call(self._halt)
+        await asyncio.wait([queued])
+        queued.exception()      # "keying stopped" after a cancel, raised by send_morse otherwise
+        if(self.radio.wave is not None):
+            await self._call_tx(self.radio.wave.stop)
+
+    # TX_DATA Low and stop_tx, also when cancelled
+    async def _end_tx(self):
+        await self._call_tx(self.radio.tx_data, 0)
+        await self._command(self.radio.stop_tx)
+
+    # Send morse code converted from text
+    # Cancelling the task stops the keying, it always ends in stop_tx().
+    # With dma the waves on air are stopped from the SPI thread, not after
+    # the TX thread has queued the rest of the text.
+    # text : text to send
+    # wpm : words per minute(morse speed)
+    # fwpm : Farnsworth overall speed (None: same as wpm)
+    # dma : timed by pigpio DMA waves instead of asyncio.sleep
+    async def send_morse(self, text, wpm=10, fwpm=None, dma=False):
+        schedule = radio_morse.compile_morse(text, wpm, fwpm)
+        dot_time = radio_morse.calculate_unit_time(wpm)/1000
+        loop = asyncio.get_running_loop()
+        await self.start_tx()
+        try:
+            if(dma):
+                stop = threading.Event()
+                runs = self._runs_until(radio_morse.schedule_to_runs(schedule, dot_time), stop)
+                end = loop.time() + radio_morse.schedule_units(schedule) * dot_time
+                queued = asyncio.ensure_future(self._call_tx(self.radio.tx_runs, runs, False))
+                try:
+                    await asyncio.shield(queued)     # returns when the last wave is queued
+                    while(await self._call_tx(self.radio.pi.wave_tx_busy)):
+                        await asyncio.sleep(max(end - loop.time(), 0.001))
+                finally:
+                    stop.set()
+                    await asyncio.shield(self._stop_waves(queued))
+            else:
+                deadline = loop.time()
+                for level, units in schedule:
+                    await self._call_tx(self.radio.tx_data, level)
+                    deadline += units * dot_time
+                    self.radio.next_edge = time.perf_counter() + deadline - loop.time()
+                    await asyncio.sleep(deadline - loop.time())
+        finally:
+            self.radio.next_edge = None
+            await asyncio.shield(self._end_tx())
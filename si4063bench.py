@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+#
+# si4063bench.py
+# benchmark of the driver for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# Measures on the hat or on the simulator(--sim):
+#   spi      : SPI bytes/sec of the transport
+#   bring_up : reset() - power_up() - setup()
+#   retune   : set_radio_frequency()
+#   adc      : get_adc_reading()
+#   morse_*  : edges of morse_code_to_ook()/key_schedule_dma() at wpm
+#   toggle_* : edges of -f/-o toggle loop and tx_bits() at baud
+# The edges of TX_DATA are taken by a pigpio callback (ticks of pigpiod) and
+# analyzed by si4063edges.analyze(), drift/errors/jitter are defined there.
+# Without NumPy only edges, drift and max errors are given, same definitions.
+#
+# usage:
+#   python si4063bench.py [--sim] [--spi bb] [--quick] [--out result.json]
+#                         [--baseline base.json] [--save-baseline base.json] [--tolerance 0.25]
+#   exit status 1 if a result is worse than the baseline
+#
+import sys
+import io
+import json
+import time
+import platform
+import contextlib
+import statistics
+import si4063
+import radio_morse
+import si4063edges
+from si4063const import *
+from si4063wave import bits_to_runs
+
+# results better when higher, others are better when lower (by magnitude)
+HIGHER_IS_BETTER = {"bytes_per_s"}
+# results not compared, counts and the rate(better when nominal)
+NOT_COMPARED = {"count", "edges", "intended_edges", "transactions", "effective_rate"}
+# differences smaller than these are noise, by unit of the result
+NOISE_FLOOR = {"_ms": 0.05, "_us": 100}
+
+# min/mean/max of samples (S) in ms
+def _summary_ms(samples):
+    return {"count": len(samples),
+            "min_ms": min(samples) * 1e3,
+            "mean_ms": statistics.mean(samples) * 1e3,
+            "max_ms": max(samples) * 1e3}
+
+# Time func repeat times
+# return : list of S
+def _timeit(func, repeat):
+    samples = []
+    for i in range(repeat):
+        t = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t)
+    return samples
+
+### command latency
+def bench_spi(radio, repeat):
+    count = 15      # READ_CMD_BUFF + 15 bytes read
+    t = time.perf_counter()
+    for i in range(repeat):
+        radio._xfer([CMD_READ_CMD_BUFF], count)
+    elapsed = time.perf_counter() - t
+    return {"transactions": repeat, "bytes_per_s": repeat * (1 + count) / elapsed}
+
+def _bring_up(radio):
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_OOK)
+
+def bench_bring_up(radio, repeat):
+    return _summary_ms(_timeit(lambda: _bring_up(radio), repeat))
+
+def bench_retune(radio, repeat):
+    freqs = [144050000, 145950000]
+    i = iter(range(repeat))
+    return _summary_ms(_timeit(lambda: radio.set_radio_frequency(freqs[next(i) & 1]), repeat))
+
+def bench_adc(radio, repeat):
+    return _summary_ms(_timeit(radio.get_adc_reading, repeat))
+
+### TX timing
+# Record the edges of TX_DATA while func runs
+# return : list of (tick, level)
+def _capture(radio, func):
+    with si4063edges.EdgeRecorder(radio.pi, radio.pins.TX_DATA) as rec:
+        with contextlib.redirect_stdout(io.StringIO()):    # morse_code_to_ook prints
+            func()
+        time.sleep(0.1)     # callbacks on the way
+    return rec.edges()
+
+# Error of measured edges against ideal runs
+# edges : list of (tick, level)
+# runs : list of (level, duration_us)
+# rate : nominal wpm or baud, for the effective rate
+# return : summary of si4063edges.analyze() (μS)
+def edge_errors(edges, runs, rate=None):
+    ticks = [tick for tick, level in edges]
+    levels = [level for tick, level in edges]
+    if(si4063edges.np is None):
+        return _edge_errors(ticks, runs)
+    return si4063edges.summary(si4063edges.analyze(ticks, levels, runs, rate))
+
+# edge_errors() without NumPy, the metrics of analyze() without percentiles
+def _edge_errors(ticks, runs):
+    ideal, t, last = [], 0.0, 0     # Low before the runs
+    for level, duration in runs:
+        if(level != last):
+            ideal.append(t)
+            last = level
+        t += duration
+    result = {"edges": len(ticks), "intended_edges": len(ideal)}
+    n = min(len(ticks), len(ideal))
+    if(n < 2):
+        return result
+    errors = [((ticks[k] - ticks[0]) & 0xffffffff) - (ideal[k] - ideal[0]) for k in range(n)]
+    result.update({
+        "drift_us": errors[-1],
+        "max_error_us": max(abs(e) for e in errors),
+        "jitter_max_us": max(abs(errors[k] - errors[k - 1]) for k in range(1, n)),
+    })
+    return result
+
+def bench_morse(radio, wpm, text, dma=False):
+    dot_time = radio_morse.calculate_unit_time(wpm) / 1000
+    if(dma):
+        schedule = radio_morse.compile_morse(text, wpm)
+        runs = si4063edges.morse_runs(text, wpm)
+        func = lambda: radio_morse.key_schedule_dma(dot_time, schedule, radio)
+    else:
+        morse_code = radio_morse.text_to_morse(text)
+        runs = si4063edges.ook_runs(text, wpm)
+        func = lambda: radio_morse.morse_code_to_ook(dot_time, morse_code, radio)
+    return edge_errors(_capture(radio, func), runs, wpm)
+
+# toggle loop of si4063.py -f/-o
+def _toggle(radio, baud, count):
+    radio.start_tx()
+    radio.key_runs(bits_to_runs((i & 1 ^ 1 for i in range(count)), baud))
+    radio.tx_data(0)
+    radio.stop_tx()
+
+# tx_bits of si4063.py -f/-o baud
+def _toggle_dma(radio, baud, count):
+    radio.start_tx()
+    radio.tx_bits((i & 1 ^ 1 for i in range(count)), baud)
+    radio.tx_data(0)
+    radio.stop_tx()
+
+def bench_toggle(radio, baud, duration, dma=False):
+    count = int(baud * duration)
+    runs = si4063edges.toggle_runs(baud, count)
+    func = _toggle_dma if dma else _toggle
+    return edge_errors(_capture(radio, lambda: func(radio, baud, count)), runs, baud)
+
+# Run all benchmarks
+# quick : fewer repeats and shorter transmissions
+# return : {name: {metric: value}}
+def run(radio, quick=False):
+    repeat = 10 if quick else 100
+    results = {}
+    results["spi"] = bench_spi(radio, repeat * 10)
+    results["bring_up"] = bench_bring_up(radio, max(repeat // 10, 3))
+    results["retune"] = bench_retune(radio, repeat)
+    results["adc"] = bench_adc(radio, repeat)
+    text = "EE" if quick else "PARIS"
+    for wpm in (20, 30):
+        results["morse_{}wpm".format(wpm)] = bench_morse(radio, wpm, text)
+        results["morse_dma_{}wpm".format(wpm)] = bench_morse(radio, wpm, text, dma=True)
+    duration = 0.2 if quick else 1.0
+    for baud in (100, 1000):
+        results["toggle_{}baud".format(baud)] = bench_toggle(radio, baud, duration)
+        results["toggle_dma_{}baud".format(baud)] = bench_toggle(radio, baud, duration, dma=True)
+    return results
+
+# Compare results with a baseline
+# tolerance : relative change allowed
+# return : list of (name, metric, baseline, result) worse than the baseline
+def compare(results, baseline, tolerance=0.25):
+    worse = []
+    for name, metrics in baseline.items():
+        for metric, base in metrics.items():
+            value = results.get(name, {}).get(metric)
+            if(value is None or metric in NOT_COMPARED):
+                continue
+            if(metric in HIGHER_IS_BETTER):
+                bad = value < base * (1 - tolerance)
+            else:
+                value, base = abs(value), abs(base)     # drift and mean error are signed
+                floor = next((f for unit, f in NOISE_FLOOR.items() if metric.endswith(unit)), 0)
+                bad = value > base * (1 + tolerance) and value - base > floor
+            if(bad):
+                worse.append((name, metric, base, value))
+    return worse
+
+def save(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+##### main #####
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    def option(name, default=None):
+        if(name in args):
+            i = args.index(name)
+            value = args[i + 1]
+            del args[i:i + 2]
+            return value
+        return default
+    sim = "--sim" in args
+    quick = "--quick" in args
+    spi = option("--spi", "bb")
+    out = option("--out")
+    baseline = option("--baseline")
+    save_baseline = option("--save-baseline")
+    tolerance = float(option("--tolerance", 0.25))
+
+    pi = None
+    if(sim):
+        import si4063sim     # no hat
+        pi = si4063sim.pi()
+    radio = si4063.Si4063(pi=pi, spi=spi)
+    _bring_up(radio)
+    data = {"meta": {"version": si4063.__version__, "sim": sim, "spi": spi, "quick": quick,
+                     "host": platform.node(), "python": platform.python_version(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": run(radio, quick)}
+    for name, metrics in data["results"].items():
+        print("{:18s}".format(name), ", ".join("{}={:.6g}".format(k, v) for k, v in metrics.items()))
+    if(out):
+        save(out, data)
+    if(save_baseline):
+        save(save_baseline, data)
+    if(baseline):
+        worse = compare(data["results"], load(baseline)["results"], tolerance)
+        for name, metric, base, value in worse:
+            print("REGRESSION {} {}: {:.6g} -> {:.6g}".format(name, metric, base, value))
+        if(worse):
+            sys.exit(1)
+        print("no regression against", baseline)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+#
+# si4063cfg.py
+# precompiled configuration for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# A configuration (modulation, deviation, frequency, offset, power) is compiled
+# once into a blob of commands, like radio_config.h arrays of WDS.
+# blob : MAGIC, (length, command bytes) ..., 0x00
+#
+import os
+import sys
+import si4063
+from si4063const import *
+
+MAGIC = b"SI4063CFG\x01"
+
+# profile library, compiled into profiles/<name>.bin
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+PROFILES = {
+    "cw": dict(type_mod=MOD_TYPE_CW, freq=144050000, freq_offset=4000, pwr_lvl=0x3f),
+    "ook": dict(type_mod=MOD_TYPE_OOK, freq=144050000, freq_offset=-5000, pwr_lvl=0x3f),
+    "fsk": dict(type_mod=MOD_TYPE_FSK, freq=144050000, freq_dev=8000, freq_offset=3000, pwr_lvl=0x3f),
+}
+
+# Si4063 recording the commands instead of sending them
+class ConfigCompiler(si4063.Si4063):
+    def __init__(self):
+        import si4063sim    # pins for the driver only, nothing is sent
+        super().__init__(pi=si4063sim.pi())
+        self.commands = []
+
+    def _is_CTS(self):
+        return 0xff
+
+    def _xfer(self, to_send, count=0):
+        self.commands.append(bytes(to_send))
+        return [0xff] * count
+
+# Compile a configuration
+# type_mod : modulation type, CW/OOK/FSK
+# freq : frequency Hz
+# freq_dev : FSK frequency deviation Hz
+# freq_offset : offset frequency Hz
+# pwr_lvl : PA output level 0x0-0x7f
+# return : blob
+def compile_config(type_mod, freq, freq_dev=8333, freq_offset=0, pwr_lvl=0x7f):
+    compiler = ConfigCompiler()
+    with compiler.batch():
+        compiler.set_radio_frequency(freq)
+        compiler.set_pa_pwr_lvl(pwr_lvl)
+        compiler.setup(type_mod, freq_dev)
+        compiler.set_modem_freq_offset(freq_offset)
+    blob = bytearray(MAGIC)
+    for cmd in compiler.commands:
+        blob.append(len(cmd))
+        blob += cmd
+    blob.append(0)
+    return bytes(blob)
+
+# Commands in a blob
+# return : list of command bytes
+def config_commands(blob):
+    if(not blob.startswith(MAGIC)):
+        raise Exception("Error: not a si4063 config")
+    commands = []
+    pos = len(MAGIC)
+    while(blob[pos]):
+        length = blob[pos]
+        commands.append(blob[pos + 1:pos + 1 + length])
+        pos += 1 + length
+    return commands
+
+# Properties set by a blob
+# return : {(group, index): value}
+def config_properties(blob):
+    props = {}
+    for cmd in config_commands(blob):
+        if(cmd[0] == CMD_SET_PROPERTY):
+            group, num, index = cmd[1], cmd[2], cmd[3]
+            for i in range(num):
+                props[(group, index + i)] = cmd[4 + i]
+    return props
+
+def save_config(path, blob):
+    with open(path, "wb") as f:
+        f.write(blob)
+
+def read_config(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+# Send all commands of a blob, no arithmetic on the way
+# Commands already in the property shadow are skipped.
+# radio : Si4063 after power_up()
+def apply_config(radio, blob):
+    radio.flush_properties()
+    for cmd in config_commands(blob):
+        if(cmd[0] == CMD_SET_PROPERTY):
+            group, num, index = cmd[1], cmd[2], cmd[3]
+            radio.apply_properties(group, index, list(cmd[4:4 + num]))
+        else:
+            radio.send_command(cmd)
+
+# Bring up a radio with a blob
+# The chip left configured by an earlier run is attached without reset.
+# radio : Si4063, keep_power=True for a warm start
+# return : True if warm attached, False after reset - power_up - blob
+def bring_up(radio, blob):
+    if(radio.warm_attach(config_properties(blob))):
+        return True
+    radio.reset()
+    radio.power_up()
+    apply_config(radio, blob)
+    return False
+
+# Send a profile of the library
+# name : "cw", "ook", "fsk" or path of a blob
+def load_profile(radio, name):
+    path = os.path.join(PROFILE_DIR, name + ".bin") if name in PROFILES else name
+    apply_config(radio, read_config(path))
+
+##### compile profiles #####
+# python si4063cfg.py : compile PROFILES into profiles/
+# python si4063cfg.py out.bin type_mod freq [freq_dev freq_offset pwr_lvl]
+if __name__ == "__main__":
+    args = sys.argv
+    if(len(args) >= 4):
+        keys = ["type_mod", "freq", "freq_dev", "freq_offset", "pwr_lvl"]
+        kw = {k: int(v, 0) for k, v in zip(keys, args[2:])}
+        blob = compile_config(**kw)
+        save_config(args[1], blob)
+        print(args[1], len(blob), "bytes")
+    else:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        for name, kw in PROFILES.items():
+            blob = compile_config(**kw)
+            path = os.path.join(PROFILE_DIR, name + ".bin")
+            save_config(path, blob)
+            print(path, len(config_commands(blob)), "commands", len(blob), "bytes")
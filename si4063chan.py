@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# si4063chan.py
+# channel plan and frequency hopping for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# f_out = (INTE + FRAC/2^19) * 2 * FREQ_XTAL / OUT_DIV_2M
+# INTE and FRAC are computed in integers, the plan holds the 4 bytes of
+# FREQ_CONTROL_INTE/FRAC of every channel, then a hop is one SET_PROPERTY
+# of the bytes changed (the property shadow of Si4063).
+#
+import sys
+import time
+from si4063const import *
+
+FRAC_ONE = 1 << 19
+
+# Dividers of a frequency, integer arithmetic
+# freq : frequency Hz
+# return : inte, frac (FRAC_ONE <= frac < 2*FRAC_ONE)
+def dividers(freq):
+    num = int(freq) * OUT_DIV_2M
+    den = 2 * FREQ_XTAL     # Npresc(2) * freq_xo
+    inte = num // den - 1   # f_frac must be between 1 and 2
+    total = (2 * num * FRAC_ONE + den) // (2 * den)     # rounded
+    return inte, total - inte * FRAC_ONE
+
+# Output frequency of dividers
+# return : Hz
+def output_frequency(inte, frac):
+    return (inte * FRAC_ONE + frac) * 2 * FREQ_XTAL / (OUT_DIV_2M * FRAC_ONE)
+
+# Values of FREQ_CONTROL_INTE and FREQ_CONTROL_FRAC
+# freq : frequency Hz
+# return : [inte, frac19, frac15, frac7]
+def frequency_props(freq):
+    inte, frac = dividers(freq)
+    return [inte, 0xff & (frac >> 16), 0xff & (frac >> 8), 0xff & frac]
+
+# Channels on a grid
+# start, stop : Hz, both included, rounded to 1Hz (144.05e6 ...)
+# step : channel spacing Hz, rounded to 1Hz
+class ChannelPlan:
+    def __init__(self, start=144000000, stop=146000000, step=12500):
+        start, stop, step = round(start), round(stop), round(step)
+        if(start < 144e6 or stop > 146e6 or start > stop or step <= 0):
+            raise Exception("Error: channel plan {}-{} step {}".format(start, stop, step))
+        self.start = start
+        self.step = step
+        self.freqs = list(range(start, stop + 1, step))
+        self.props = []     # [inte, frac19, frac15, frac7] of each channel
+        self.errors = []    # real output frequency - channel frequency, Hz
+        for freq in self.freqs:
+            inte, frac = dividers(freq)
+            self.props.append([inte, 0xff & (frac >> 16), 0xff & (frac >> 8), 0xff & frac])
+            self.errors.append(output_frequency(inte, frac) - freq)
+
+    def __len__(self):
+        return len(self.freqs)
+
+    # Check a channel number
+    # raise : Exception if not 0 <= ch < len(plan)
+    def check(self, ch):
+        if(not 0 <= ch < len(self.freqs)):
+            raise Exception("Error: channel {} not in channel plan 0-{}".format(ch, len(self.freqs) - 1))
+        return ch
+
+    # Channel number of a frequency
+    def channel(self, freq):
+        ch, rest = divmod(freq - self.start, self.step)
+        if(rest or not 0 <= ch < len(self.freqs)):
+            raise Exception("Error: {}Hz not in channel plan".format(freq))
+        return int(ch)
+
+    # Max absolute frequency error of the plan
+    def max_error(self):
+        return max(abs(e) for e in self.errors)
+
+# Step through channels, for spurious and harmonic measurements
+# radio : Si4063 after setup(), the plan is radio.plan
+# dwell : time on a channel (S)
+# channels : channel numbers (None: all channels of the plan)
+# on_channel : called with (channel, freq) after each hop
+# return : list of hop times (S)
+def sweep(radio, dwell, channels=None, on_channel=None):
+    plan = radio.channel_plan()
+    if(channels is None):
+        channels = range(len(plan))
+    hops = []
+    radio.start_tx()
+    try:
+        deadline = time.perf_counter()
+        for ch in channels:
+            t = time.perf_counter()
+            radio.hop(ch, retune=True)
+            hops.append(time.perf_counter() - t)
+            if(on_channel):
+                on_channel(ch, plan.freqs[ch])
+            deadline += dwell
+            time.sleep(max(deadline - time.perf_counter(), 0))
+    finally:
+        radio.stop_tx()
+    return hops
+
+##### TEST #####
+# python si4063chan.py [--sim] [step dwell] : sweep 144-146MHz in CW
+if __name__ == "__main__":
+    import si4063
+    args = sys.argv
+    sim = "--sim" in args
+    if(sim):
+        args.remove("--sim")
+    try:
+        step = int(args[1])
+        dwell = float(args[2])
+    except:
+        step, dwell = 25000, 0.01
+    plan = ChannelPlan(step=step)
+    print("channels: {}, max error: {:.3f} Hz".format(len(plan), plan.max_error()))
+    pi = None
+    if(sim):
+        import si4063sim     # no hat
+        pi = si4063sim.pi()
+    radio = si4063.Si4063(pi=pi, spi="bb")
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_CW)
+    radio.plan = plan
+    hops = sweep(radio, dwell)
+    print("hop: mean {:.0f} μS, max {:.0f} μS".format(sum(hops) / len(hops) * 1e6, max(hops) * 1e6))
+    print("properties:", radio.property_stats())
@@ -0,0 +1,131 @@
+# si4063cmd.py
+# command encoding for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# Commands are packed by struct into buffers made once per radio, pack()
+# returns a memoryview of the buffer, then no list is built per command.
+# A buffer is reused by the next command of the same kind: pack and write
+# it under radio.cmd_lock (Si4063._send), the view is not kept after that.
+# Commands without arguments are constant bytes.
+# Replies (READ_CMD_BUFF, CTS byte first) are parsed by struct too.
+#
+import struct
+from si4063const import *
+
+# constant commands
+NOP = bytes([CMD_NOP])
+PART_INFO = bytes([CMD_PART_INFO])
+REQUEST_DEVICE_STATE = bytes([CMD_REQUEST_DEVICE_STATE])
+READ_CMD_BUFF = bytes([CMD_READ_CMD_BUFF])
+# POWER_UP : EZRadio PRO(1), XTAL(0), FREQ_XTAL
+POWER_UP = struct.pack(">BBBI", CMD_POWER_UP, 1, 0, FREQ_XTAL)
+# GET_ADC_READING : temperature and battery voltage, adc_cfg default
+GET_ADC_READING = bytes([CMD_GET_ADC_READING, (1<<4) | (1<<3), 0x00])
+
+SET_PROPERTY_MAX = 12   # values in a SET_PROPERTY
+
+# Command of fixed length
+# opcode : CMD_*
+# fmt : struct format of the arguments after the opcode
+class Command:
+    __slots__ = ("opcode", "_struct", "buf", "view")
+
+    def __init__(self, opcode, fmt=""):
+        self.opcode = opcode
+        self._struct = struct.Struct(">B" + fmt)
+        self.buf = bytearray(self._struct.size)
+        self.view = memoryview(self.buf)
+        self.buf[0] = opcode
+
+    # return : memoryview of the command bytes
+    def pack(self, *args):
+        self._struct.pack_into(self.buf, 0, self.opcode, *args)
+        return self.view
+
+    def __repr__(self):
+        return "Command({:02x}, {})".format(self.opcode, self._struct.format[2:])
+
+# SET_PROPERTY, group - num - index - values
+class SetProperty(Command):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(CMD_SET_PROPERTY, "BBB{}s".format(SET_PROPERTY_MAX))
+
+    # vals : bytes or list of values, up to SET_PROPERTY_MAX
+    def pack(self, group, index, vals):
+        num = len(vals)
+        if(num < 1 or num > SET_PROPERTY_MAX):
+            raise Exception("Error: SET_PROPERTY of {} values".format(num))
+        buf = self.buf
+        buf[1] = group
+        buf[2] = num
+        buf[3] = index
+        buf[4:4 + num] = vals
+        return self.view[:4 + num]
+
+# WRITE_TX_FIFO, opcode - data
+class WriteTxFifo(Command):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(CMD_WRITE_TX_FIFO, "{}s".format(TX_FIFO_SIZE))
+
+    # data : bytes, up to TX_FIFO_SIZE
+    def pack(self, data):
+        n = len(data)
+        if(n > TX_FIFO_SIZE):
+            raise Exception("Error: {} bytes over the TX FIFO".format(n))
+        self.buf[1:1 + n] = data
+        return self.view[:1 + n]
+
+# Command buffers of a radio
+class Commands:
+    __slots__ = ("set_property", "get_property", "start_tx", "change_state",
+                 "fifo_info", "get_ph_status", "write_tx_fifo")
+
+    def __init__(self):
+        self.set_property = SetProperty()
+        self.get_property = Command(CMD_GET_PROPERTY, "BBB")    # group, num, index
+        self.start_tx = Command(CMD_START_TX, "BBHBB")          # channel, condition, tx_len, delay, repeat
+        self.change_state = Command(CMD_CHANGE_STATE, "B")      # next state
+        self.fifo_info = Command(CMD_FIFO_INFO, "B")            # FIFO_RESET_TX
+        self.get_ph_status = Command(CMD_GET_PH_STATUS, "B")    # interrupts kept, 0: clear all
+        self.write_tx_fifo = WriteTxFifo()
+
+### replies, CTS(0xff) first
+# CTS, CHIPREV, PART, PBUILD, ID, CUSTOMER, ROMID
+PART_INFO_REPLY = struct.Struct(">BBHBHBB")
+# CTS, GPIO_ADC, BATTERY_ADC, TEMP_ADC
+ADC_READING_REPLY = struct.Struct(">BHHH")
+# CTS, CURR_STATE, CURRENT_CHANNEL
+DEVICE_STATE_REPLY = struct.Struct(">BBB")
+
+# return : fields after CTS, None if not CTS
+def _parse(reply_struct, reply):
+    if(reply[0] != 0xff):
+        return None
+    return reply_struct.unpack_from(bytes(reply[:reply_struct.size]))[1:]
+
+# PART_INFO reply
+# return : chip_rev, part(0x4063), pbuild, id, customer, rom_id (None if not CTS)
+def parse_part_info(reply):
+    return _parse(PART_INFO_REPLY, reply)
+
+# GET_ADC_READING reply
+# return : temperature(°C), battery voltage(V) (None, None if not CTS)
+def parse_adc_reading(reply):
+    fields = _parse(ADC_READING_REPLY, reply)
+    if(fields is None):
+        return None, None
+    gpio_adc, battery_adc, temp_adc = fields
+    return (899 / 4096) * temp_adc - 293, 3 * battery_adc / 1280
+
+# REQUEST_DEVICE_STATE reply
+# return : state, channel (None if not CTS)
+def parse_device_state(reply):
+    return _parse(DEVICE_STATE_REPLY, reply)
@@ -24,6 +24,29 @@ GPIO_TX_DATA = GPIO0
 GPIO_CTS = GPIO1
 GPIO_SHDN = GPIOSDN
 
+# Hardware SPI0 chip enables, CE0 = GPIO_nSEL
+GPIO_CE1 = 7    # GPIO7 = pin26
+SPI0_CE = (GPIO_nSEL, GPIO_CE1)
+
+# Pins of a hat, the default is the pins above
+# Another hat on the same raspi shares SDI/SDO/SCLK and has its own
+# nSEL(GPIO_CE1 for hardware SPI), TX_DATA, CTS and SHDN.
+class PinMap:
+    def __init__(self, nSEL=GPIO_nSEL, SDI=GPIO_SDI, SDO=GPIO_SDO, SCLK=GPIO_SCLK,
+                 TX_DATA=GPIO_TX_DATA, CTS=GPIO_CTS, SHDN=GPIO_SHDN, nIRQ=GPIOnIRQ):
+        self.nSEL = nSEL
+        self.SDI = SDI
+        self.SDO = SDO
+        self.SCLK = SCLK
+        self.TX_DATA = TX_DATA
+        self.CTS = CTS
+        self.SHDN = SHDN
+        self.nIRQ = nIRQ
+
+    def __repr__(self):
+        return "PinMap(nSEL={}, SDI={}, SDO={}, SCLK={}, TX_DATA={}, CTS={}, SHDN={}, nIRQ={})".format(
+            self.nSEL, self.SDI, self.SDO, self.SCLK, self.TX_DATA, self.CTS, self.SHDN, self.nIRQ)
+
 # Commands
 CMD_NOP = 0x00
 CMD_PART_INFO = 0x01
@@ -36,6 +59,9 @@ CMD_CHANGE_STATE = 0x34
 CMD_READ_CMD_BUFF = 0x44
 CMD_START_TX = 0x31
 CMD_GET_ADC_READING = 0x14
+CMD_FIFO_INFO = 0x15
+CMD_GET_PH_STATUS = 0x21
+CMD_WRITE_TX_FIFO = 0x66
 
 # States
 STATE_NOCHANGE = 0
@@ -47,6 +73,7 @@ STATE_TX = 7
 
 # API
 FREQ_XTAL = 30000000  # 30MHz
+POR_TIME = 0.006      # S, power on reset after SHDN Low, CTS Low meanwhile
 
 OUT_DIV_2M = 24     # 142-175MHz
 OUT_DIV_70CM = 8    # 420-525MHz
@@ -72,6 +99,18 @@ MOD_SOURCE_DIRECT = 1
 MOD_SOURCE_PSEUDO = 2
 MOD_SOURCE_PACKET = 0
 
+# Packet mode
+TX_FIFO_SIZE = 64       # bytes, split FIFO
+TX_LEN_MAX = 0x1fff     # bytes of a START_TX
+DATA_RATE_MIN = 100     # bps
+DATA_RATE_MAX = 1000000
+FIFO_RESET_TX = 0x01    # FIFO_INFO argument
+TX_THRESHOLD = 32       # TX FIFO almost empty when these bytes are free, half
+
+# Packet handler interrupts (INT_CTL_PH_ENABLE, GET_PH_STATUS)
+PH_PACKET_SENT = 1<<5
+PH_TX_FIFO_ALMOST_EMPTY = 1<<1
+
 # Modulation types
 MOD_TYPE_CW = 0
 MOD_TYPE_OOK = 1
@@ -96,34 +135,91 @@ GPIO_MODE_IN_SPEEP = 28
 GPIO_MODE_TX_STATE = 32
 GPIO_MODE_LOW_BATT = 36
 
-# Properties
-#  Name = [Group, Index, Size]
-GLOBAL_XO_TUNE = [0x00, 0x00, 1]
-GLOBAL_CLK_CFG = [0x00, 0x01, 1]
-GLOBAL_CONFIG = [0x00, 0x03, 1]
+# Property descriptor
+#  group, index : address of the first byte
+#  size : bytes, big endian
+#  signed : value in two's complement (decode)
+# prop[0], prop[1], prop[2] and "group, index, size = prop" work as [Group, Index, Size]
+class Prop:
+    __slots__ = ("group", "index", "size", "signed", "mask", "_fields")
 
-INT_CTL_ENABLE = [0x01, 0x00, 1]
+    def __init__(self, group, index, size=1, signed=False):
+        self.group = group
+        self.index = index
+        self.size = size
+        self.signed = signed
+        self.mask = (1 << 8 * size) - 1
+        self._fields = (group, index, size)
 
-PREAMBLE_TX_LENGTH = [0x10, 0x00, 1]
+    def __getitem__(self, i):
+        return self._fields[i]
 
-SYNC_CONFIG = [0x11, 0x00, 1]
+    def __iter__(self):
+        return iter(self._fields)
 
-MODEM_MOD_TYPE = [0x20, 0x00, 1]
-MODEM_DATA_RATE = [0x20, 0x03, 3]
-MODEM_TX_NCO_MODE = [0x20, 0x06, 4]
-MODEM_FREQ_DEV = [0x20, 0x0a, 3]
-MODEM_FREQ_OFFSET = [0x20, 0x0d, 2]
-MODEM_CLKGEN_BAND = [0x20, 0x51, 1]
+    def __len__(self):
+        return 3
 
-PA_MODE = [0x22, 0x00, 1]
-PA_PWR_LVL = [0x22, 0x01, 1]
-PA_BIAS_CLKDUTY = [0x22, 0x02, 1]
+    def __repr__(self):
+        return "Prop(0x{:02x}, 0x{:02x}, {})".format(self.group, self.index, self.size)
 
-SYNTH_PFDCP_CPFF = [0x23, 0x00, 1]
-SYNTH_PFDCP_CPINT = [0x23, 0x01, 1]
-SYNTH_VCO_KV = [0x23, 0x02, 1]
+    # Bytes of a value, bits over size are cut
+    def encode(self, value):
+        return (value & self.mask).to_bytes(self.size, "big")
 
-FREQ_CONTROL_INTE = [0x40, 0x00, 1]
-FREQ_CONTROL_FRAC = [0x40, 0x01, 3]
+    # Value of bytes read (GET_PROPERTY)
+    def decode(self, vals):
+        return int.from_bytes(bytes(vals[:self.size]), "big", signed=self.signed)
+
+    # (group, index) of each byte
+    def keys(self):
+        return [(self.group, self.index + i) for i in range(self.size)]
+
+# Properties
+#  Name = Prop(Group, Index, Size)
+GLOBAL_XO_TUNE = Prop(0x00, 0x00, 1)
+GLOBAL_CLK_CFG = Prop(0x00, 0x01, 1)
+GLOBAL_CONFIG = Prop(0x00, 0x03, 1)
+
+INT_CTL_ENABLE = Prop(0x01, 0x00, 1)
+INT_CTL_PH_ENABLE = Prop(0x01, 0x01, 1)
+
+PREAMBLE_TX_LENGTH = Prop(0x10, 0x00, 1)
+
+SYNC_CONFIG = Prop(0x11, 0x00, 1)
+
+PKT_TX_THRESHOLD = Prop(0x12, 0x0b, 1)
+
+MODEM_MOD_TYPE = Prop(0x20, 0x00, 1)
+MODEM_DATA_RATE = Prop(0x20, 0x03, 3)
+MODEM_TX_NCO_MODE = Prop(0x20, 0x06, 4)
+MODEM_FREQ_DEV = Prop(0x20, 0x0a, 3)
+MODEM_FREQ_OFFSET = Prop(0x20, 0x0d, 2, signed=True)
+MODEM_CLKGEN_BAND = Prop(0x20, 0x51, 1)
+
+PA_MODE = Prop(0x22, 0x00, 1)
+PA_PWR_LVL = Prop(0x22, 0x01, 1)
+PA_BIAS_CLKDUTY = Prop(0x22, 0x02, 1)
+
+SYNTH_PFDCP_CPFF = Prop(0x23, 0x00, 1)
+SYNTH_PFDCP_CPINT = Prop(0x23, 0x01, 1)
+SYNTH_VCO_KV = Prop(0x23, 0x02, 1)
+
+FREQ_CONTROL_INTE = Prop(0x40, 0x00, 1)
+FREQ_CONTROL_FRAC = Prop(0x40, 0x01, 3)
+FREQ_CONTROL = Prop(0x40, 0x00, 4)     # INTE and FRAC in one
+
+# Properties used by the driver, read by Si4063.snapshot()
+PROPERTIES = (
+    GLOBAL_XO_TUNE, GLOBAL_CLK_CFG, GLOBAL_CONFIG,
+    INT_CTL_ENABLE, INT_CTL_PH_ENABLE,
+    PREAMBLE_TX_LENGTH,
+    SYNC_CONFIG,
+    PKT_TX_THRESHOLD,
+    MODEM_MOD_TYPE, MODEM_DATA_RATE, MODEM_TX_NCO_MODE, MODEM_FREQ_DEV, MODEM_FREQ_OFFSET, MODEM_CLKGEN_BAND,
+    PA_MODE, PA_PWR_LVL, PA_BIAS_CLKDUTY,
+    SYNTH_PFDCP_CPFF, SYNTH_PFDCP_CPINT, SYNTH_VCO_KV,
+    FREQ_CONTROL_INTE, FREQ_CONTROL_FRAC,
+)
 
 ###
\ No newline at end of file
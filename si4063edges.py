@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+#
+# si4063edges.py
+# TX_DATA edge capture and timing analysis for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# EdgeRecorder takes the edges of TX_DATA by a pigpio callback, the ticks are
+# μS of pigpiod (32 bits, wrap in 72 minutes). analyze() compares them with
+# the intended runs by NumPy arrays:
+#   per element error : measured duration - intended duration (μS)
+#   edge error        : time of an edge from the first one - intended (μS)
+#   drift             : edge error of the last edge
+#   jitter p50/p99    : percentiles of |element error|
+#   effective rate    : wpm/baud from the measured length of the whole signal
+# NumPy is needed by analyze() only.
+#
+# usage:
+#   with EdgeRecorder(radio.pi, radio.pins.TX_DATA) as rec:
+#       radio_morse.send_morse("PARIS", 20, radio)
+#   print(analyze(rec.ticks, rec.levels, morse_runs("PARIS", 20), rate=20))
+#
+import sys
+import radio_morse
+from si4063const import *
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EITHER_EDGE = 2     # pigpio.EITHER_EDGE
+
+class EdgeRecorder:
+    # pi : pigpio.pi
+    # gpio : pin recorded
+    def __init__(self, pi, gpio=GPIO_TX_DATA):
+        self.pi = pi
+        self.gpio = gpio
+        self.ticks = []
+        self.levels = []
+        self._cb = None
+
+    def start(self):
+        self.ticks, self.levels = [], []
+        tick, level = self.ticks.append, self.levels.append
+        def edge(gpio, lvl, t):
+            tick(t)
+            level(lvl)
+        self._cb = self.pi.callback(self.gpio, EITHER_EDGE, edge)
+        return self
+
+    def stop(self):
+        if(self._cb is not None):
+            self._cb.cancel()
+            self._cb = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __len__(self):
+        return len(self.ticks)
+
+    # Edges as (tick, level)
+    def edges(self):
+        return list(zip(self.ticks, self.levels))
+
+    # Save the capture, numpy .npz
+    def save(self, path):
+        _need_numpy()
+        np.savez_compressed(path, ticks=np.asarray(self.ticks, dtype=np.uint32),
+                            levels=np.asarray(self.levels, dtype=np.uint8))
+
+# Load a capture saved by EdgeRecorder.save()
+# return : ticks, levels
+def load(path):
+    _need_numpy()
+    data = np.load(path)
+    return data["ticks"], data["levels"]
+
+def _need_numpy():
+    if(np is None):
+        raise Exception("Error: numpy NOT installed")
+
+### intended timing
+# runs of send_morse()/key_schedule()/key_schedule_dma()
+# return : list of (level, duration_us)
+def morse_runs(text, wpm, fwpm=None):
+    dot_time = radio_morse.calculate_unit_time(wpm)/1000
+    return list(radio_morse.schedule_to_runs(radio_morse.compile_morse(text, wpm, fwpm), dot_time))
+
+# runs of morse_code_to_ook()
+def ook_runs(text, wpm):
+    dot_us = radio_morse.calculate_unit_time(wpm) * 1000
+    runs = []
+    for symbol in radio_morse.text_to_morse(text):
+        if symbol == '.':
+            runs += [(1, dot_us), (0, dot_us)]
+        elif symbol == '-':
+            runs += [(1, 3 * dot_us), (0, dot_us)]
+        elif symbol == ' ':
+            runs.append((0, 3 * dot_us))
+    return runs
+
+# runs of 1010... at baud, -f/-o of si4063.py
+def toggle_runs(baud, count):
+    return [(i & 1 ^ 1, 1e6 / baud) for i in range(count)]
+
+# Edges of runs, level changes only
+# level : level before the runs
+# return : times (μS from start), levels
+def ideal_edges(runs, level=0):
+    runs = np.asarray(runs, dtype=np.float64).reshape(-1, 2)
+    levels = runs[:, 0].astype(np.int8)
+    starts = np.concatenate(([0.0], np.cumsum(runs[:-1, 1])))
+    change = levels != np.concatenate(([level], levels[:-1]))
+    return starts[change], levels[change]
+
+### analysis
+# ticks to μS from the first edge, 32 bit wrap removed
+def unwrap(ticks):
+    ticks = np.asarray(ticks, dtype=np.int64)
+    return np.concatenate(([0], np.cumsum(np.diff(ticks) & 0xffffffff)))
+
+# Compare a capture with the intended runs
+# ticks, levels : capture (EdgeRecorder.ticks/levels)
+# runs : intended list of (level, duration_us)
+# rate : nominal wpm or baud of runs, for the effective rate
+# return : dict, arrays "edge_error_us" and "element_error_us" and the summary
+def analyze(ticks, levels, runs, rate=None):
+    _need_numpy()
+    ideal, ideal_levels = ideal_edges(runs)
+    measured = unwrap(ticks)
+    n = min(len(measured), len(ideal))
+    result = {"edges": len(measured), "intended_edges": len(ideal)}
+    if(n < 2):
+        return result
+    measured = measured[:n]
+    ideal = ideal[:n] - ideal[0]
+    edge_error = measured - ideal
+    element_error = np.diff(edge_error)
+    jitter = np.abs(element_error)
+    result.update({
+        "level_errors": int(np.count_nonzero(np.asarray(levels[:n]) != ideal_levels[:n])),
+        "edge_error_us": edge_error,
+        "element_error_us": element_error,
+        "drift_us": float(edge_error[-1]),
+        "max_error_us": float(np.max(np.abs(edge_error))),
+        "mean_element_error_us": float(np.mean(element_error)),
+        "jitter_p50_us": float(np.percentile(jitter, 50)),
+        "jitter_p99_us": float(np.percentile(jitter, 99)),
+        "jitter_max_us": float(np.max(jitter)),
+    })
+    if(rate):
+        result["effective_rate"] = rate * float(ideal[-1]) / float(measured[-1])
+    return result
+
+# Summary of analyze() without the arrays
+def summary(result):
+    return {k: v for k, v in result.items() if not isinstance(v, np.ndarray)}
+
+##### TEST #####
+# python si4063edges.py [--sim] [--dma] morse wpm text : send_morse
+# python si4063edges.py [--sim] [--dma] ook wpm text   : morse_code_to_ook (sleep only)
+# python si4063edges.py [--sim] [--dma] toggle baud [count] : -f/-o loop or tx_bits
+if __name__ == "__main__":
+    import time
+    import si4063
+    args = sys.argv
+    sim = "--sim" in args
+    if(sim):
+        args.remove("--sim")
+    dma = "--dma" in args
+    if(dma):
+        args.remove("--dma")
+    try:
+        mode, rate = args[1], int(args[2])
+    except:
+        print("usage: python si4063edges.py [--sim] [--dma] morse|ook|toggle wpm|baud [text|count]")
+        exit()
+    pi = None
+    if(sim):
+        import si4063sim     # no hat
+        pi = si4063sim.pi()
+    radio = si4063.Si4063(pi=pi, spi="bb")
+    radio.reset()
+    radio.power_up()
+    radio.set_radio_frequency(144050000)
+    radio.setup(MOD_TYPE_OOK)
+    with EdgeRecorder(radio.pi, radio.pins.TX_DATA) as rec:
+        if(mode == "toggle"):
+            count = int(args[3]) if len(args) > 3 else rate
+            runs = toggle_runs(rate, count)
+            radio.start_tx()
+            if(dma):
+                radio.tx_bits((i & 1 ^ 1 for i in range(count)), rate)
+            else:
+                radio.key_runs(si4063.bits_to_runs((i & 1 ^ 1 for i in range(count)), rate))
+            radio.tx_data(0)
+            radio.stop_tx()
+        elif(mode == "ook"):
+            text = " ".join(args[3:]) or "PARIS"
+            runs = ook_runs(text, rate)
+            radio_morse.morse_code_to_ook(radio_morse.calculate_unit_time(rate)/1000,
+                                          radio_morse.text_to_morse(text), radio)
+        else:
+            text = " ".join(args[3:]) or "PARIS"
+            runs = morse_runs(text, rate)
+            radio_morse.send_morse(text, rate, radio, dma=dma)
+        time.sleep(0.1)     # callbacks on the way
+    for k, v in summary(analyze(rec.ticks, rec.levels, runs, rate)).items():
+        print("{:22s} {}".format(k, round(v, 3) if isinstance(v, float) else v))
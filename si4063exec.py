@@ -0,0 +1,164 @@
+# si4063exec.py
+# command executor for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# One worker thread owns the radio and runs the commands submitted by any
+# thread, a concurrent.futures.Future is returned for each command.
+# Commands wait in a bounded priority queue, TX control goes first:
+#   LANE_TX          : start_tx, stop_tx, change_state, hop
+#   LANE_CONFIG      : frequency, properties, setup ...
+#   LANE_HOUSEKEEPING: ADC, device state, property reads
+# Commands of one lane run in the order submitted. submit() blocks while the
+# queue is full(backpressure), or raises queue.Full after timeout.
+# After close() submit() raises, the commands left in the queue when the
+# worker has stopped get an exception, no Future is left pending.
+#
+# usage:
+#   executor = CommandExecutor(radio)
+#   executor.start_tx().result()
+#   temp, voltage = executor.get_adc_reading().result()
+#   executor.close()
+#
+import queue
+import itertools
+import threading
+from concurrent.futures import Future
+from si4063const import MOD_SOURCE_DIRECT
+
+LANE_TX = 0
+LANE_CONFIG = 1
+LANE_HOUSEKEEPING = 2
+_LANE_CLOSE = 9     # after all commands
+
+class CommandExecutor:
+    # radio : Si4063
+    # maxsize : commands waiting in the queue
+    def __init__(self, radio, maxsize=64):
+        self.radio = radio
+        self._queue = queue.PriorityQueue(maxsize)
+        self._seq = itertools.count()   # order in a lane
+        self._lock = threading.Lock()   # closed and stopped
+        self._closed = False    # no more submit
+        self._stopped = False   # worker stopped, nothing takes the queue
+        self._thread = threading.Thread(target=self._run, name="si4063_exec", daemon=True)
+        self._thread.start()
+
+    # Submit a command
+    # func : func(*args) runs in the worker thread
+    # lane : LANE_TX, LANE_CONFIG or LANE_HOUSEKEEPING
+    # timeout : S to wait while the queue is full (None: wait)
+    # return : Future of the result
+    # raise : queue.Full after timeout, Exception after close()
+    def submit(self, func, *args, lane=LANE_CONFIG, timeout=None):
+        with self._lock:
+            if(self._closed):
+                raise Exception("Error: executor closed")
+        future = Future()
+        self._queue.put((lane, next(self._seq), future, func, args), timeout=timeout)
+        with self._lock:
+            if(self._stopped):      # closed while waiting for the queue
+                self._fail_queued()
+        return future
+
+    def _run(self):
+        while(True):
+            lane, seq, future, func, args = self._queue.get()
+            if(lane == _LANE_CLOSE):
+                return
+            if(not future.set_running_or_notify_cancel()):
+                continue
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    # Stop the worker after the commands in the queue
+    # cancel : cancel the commands not started
+    def close(self, cancel=False):
+        with self._lock:
+            if(self._closed):
+                return
+            self._closed = True
+        if(cancel):
+            while(True):
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                item[2].cancel()
+        self._queue.put((_LANE_CLOSE, next(self._seq), None, None, ()))
+        self._thread.join()
+        with self._lock:
+            self._stopped = True
+            self._fail_queued()     # submitted after the close command
+
+    # Fail the commands in the queue, the worker has stopped
+    def _fail_queued(self):
+        while(True):
+            try:
+                lane, seq, future, func, args = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if(future is not None and future.set_running_or_notify_cancel()):
+                future.set_exception(Exception("Error: executor closed"))
+
+    ### TX control
+    def start_tx(self):
+        return self.submit(self.radio.start_tx, lane=LANE_TX)
+
+    def stop_tx(self):
+        return self.submit(self.radio.stop_tx, lane=LANE_TX)
+
+    def change_state(self, next_state):
+        return self.submit(self.radio.change_state, next_state, lane=LANE_TX)
+
+    def hop(self, channel, retune=False):
+        return self.submit(self.radio.hop, channel, retune, lane=LANE_TX)
+
+    def send_packet(self, data):
+        return self.submit(self.radio.send_packet, data, lane=LANE_TX)
+
+    ### configuration
+    def reset(self):
+        return self.submit(self.radio.reset)
+
+    def power_up(self):
+        return self.submit(self.radio.power_up)
+
+    def setup(self, type_mod, freq_dev=8333, source=MOD_SOURCE_DIRECT, data_rate=None):
+        return self.submit(self.radio.setup, type_mod, freq_dev, source, data_rate)
+
+    def set_radio_frequency(self, freq):
+        return self.submit(self.radio.set_radio_frequency, freq)
+
+    def set_modem_freq_offset(self, freq_offset):
+        return self.submit(self.radio.set_modem_freq_offset, freq_offset)
+
+    def set_pa_pwr_lvl(self, ddac):
+        return self.submit(self.radio.set_pa_pwr_lvl, ddac)
+
+    def set_property(self, group, index, val):
+        return self.submit(self.radio.set_property, group, index, val)
+
+    def set_properties(self, group, index, vals):
+        return self.submit(self.radio.set_properties, group, index, vals)
+
+    ### housekeeping
+    def part_info(self):
+        return self.submit(self.radio.part_info, lane=LANE_HOUSEKEEPING)
+
+    def get_adc_reading(self):
+        return self.submit(self.radio.get_adc_reading, lane=LANE_HOUSEKEEPING)
+
+    def request_device_state(self):
+        return self.submit(self.radio.request_device_state, lane=LANE_HOUSEKEEPING)
+
+    def get_property(self, prop):
+        return self.submit(self.radio.get_property, prop, lane=LANE_HOUSEKEEPING)
+
+    def verify(self, expected=None):
+        return self.submit(self.radio.verify, expected, lane=LANE_HOUSEKEEPING)
@@ -0,0 +1,182 @@
+# si4063keyer.py
+# deadline keyer of transmit data for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# Keys TX_DATA by python where DMA waves are not available.
+# Each edge is placed on an absolute perf_counter_ns deadline (start + sum of
+# the runs before it), a late edge is not carried over to the next ones, then
+# no drift is accumulated. Wait for a deadline is time.sleep() until spin
+# before it, then a busy wait. spin is calibrated from the overshoot of sleep
+# when the Keyer is made(about 20mS), not on the first run().
+# Progress marks are printed(or passed to on_progress) by a consumer thread
+# of low priority, not by the keying thread.
+# Options for the keying thread, while run() (Linux, root or CAP_SYS_NICE):
+#   priority : SCHED_FIFO priority (1-99)
+#   cpu      : CPU the thread is pinned to
+#
+# usage:
+#   keyer = Keyer(radio, priority=50, cpu=3)
+#   radio.start_tx()
+#   keyer.run([(1, 60000, "."), (0, 60000), (1, 180000, "-"), (0, 60000)])
+#   radio.stop_tx()
+#
+import os
+import time
+import queue
+import threading
+
+SPIN_MIN = 50000        # nS, spin before a deadline
+SPIN_MAX = 5000000
+SPIN_MARGIN = 100000    # nS added to the calibrated overshoot
+CALIBRATE_SLEEP = 0.001 # S
+CALIBRATE_COUNT = 20
+PROGRESS_NICE = 10      # nice of the progress thread
+
+# Overshoot of time.sleep()
+# return : max overshoot (nS)
+def sleep_overshoot(count=CALIBRATE_COUNT, sleep=CALIBRATE_SLEEP):
+    worst = 0
+    for i in range(count):
+        t = time.perf_counter_ns()
+        time.sleep(sleep)
+        worst = max(worst, time.perf_counter_ns() - t - int(sleep * 1e9))
+    return worst
+
+# Wait until deadline
+# deadline : perf_counter_ns()
+# spin : nS before deadline spent in a busy wait
+# return : nS late (0 or more)
+def wait_until(deadline, spin):
+    remain = deadline - time.perf_counter_ns()
+    if(remain > spin):
+        time.sleep((remain - spin) / 1e9)
+    while(True):
+        now = time.perf_counter_ns()
+        if(now >= deadline):
+            return now - deadline
+
+class Keyer:
+    # radio : Si4063 (tx_data(), next_edge)
+    # spin : nS of busy wait before a deadline (None: calibrated here)
+    # priority : SCHED_FIFO priority of the keying thread (None: not changed)
+    # cpu : CPU the keying thread is pinned to (None: not changed)
+    # on_progress : called with each mark in the progress thread (None: printed)
+    def __init__(self, radio, spin=None, priority=None, cpu=None, on_progress=None):
+        self.radio = radio
+        self.spin = spin
+        self.priority = priority
+        self.cpu = cpu
+        self.on_progress = on_progress
+        self.deadline = None    # end of the last run (perf_counter_ns)
+        self.edges = 0
+        self.late = 0           # edges later than spin
+        self.max_late = 0       # nS
+        self.rt_error = None    # error of priority/cpu
+        self._marks = None
+        self._thread = None
+        if(spin is None):
+            self.calibrate()
+
+    def calibrate(self):
+        self.spin = min(max(sleep_overshoot() + SPIN_MARGIN, SPIN_MIN), SPIN_MAX)
+        return self.spin
+
+    # Key runs on TX_DATA, returns at the end of the last run
+    # runs : iterable of (level, duration_us) or (level, duration_us, mark)
+    #   mark : passed to the progress thread when the run starts
+    # resume : start at the end of the last run if it is not passed yet
+    # return : end of the runs (perf_counter_ns)
+    def run(self, runs, resume=False):
+        saved = self._realtime()
+        radio, spin = self.radio, self.spin
+        tx_data = radio.tx_data
+        deadline = self.deadline
+        if(not resume or deadline is None or deadline < time.perf_counter_ns()):
+            deadline = time.perf_counter_ns()
+        last = None
+        try:
+            for run in runs:
+                late = wait_until(deadline, spin)
+                level = run[0]
+                if(level != last):
+                    tx_data(level)
+                    last = level
+                    self.edges += 1
+                    if(late > spin):
+                        self.late += 1
+                    if(late > self.max_late):
+                        self.max_late = late
+                deadline += round(run[1] * 1000)
+                radio.next_edge = deadline / 1e9    # for the telemetry sampler
+                if(len(run) > 2):
+                    self._progress(run[2])
+            wait_until(deadline, spin)
+        finally:
+            radio.next_edge = None
+            self.deadline = deadline
+            self._restore(saved)
+        self.flush()
+        return deadline
+
+    # Counts of the edges
+    # return : {"edges": n, "late": n, "max_late_us": μS, "spin_us": μS}
+    def stats(self):
+        return {"edges": self.edges, "late": self.late,
+                "max_late_us": self.max_late / 1000, "spin_us": self.spin / 1000}
+
+    ### realtime options
+    # return : (scheduler, affinity) before, to be restored
+    def _realtime(self):
+        saved = (None, None)
+        try:
+            if(self.cpu is not None):
+                saved = (saved[0], os.sched_getaffinity(0))
+                os.sched_setaffinity(0, {self.cpu})
+            if(self.priority is not None):
+                saved = ((os.sched_getscheduler(0), os.sched_getparam(0)), saved[1])
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+        except (OSError, AttributeError) as e:     # no permission, not Linux
+            self.rt_error = e
+        return saved
+
+    def _restore(self, saved):
+        scheduler, affinity = saved
+        try:
+            if(scheduler is not None):
+                os.sched_setscheduler(0, scheduler[0], scheduler[1])
+            if(affinity is not None):
+                os.sched_setaffinity(0, affinity)
+        except (OSError, AttributeError) as e:
+            self.rt_error = e
+
+    ### progress
+    def _progress(self, mark):
+        if(self._thread is None):
+            self._marks = queue.Queue()
+            self._thread = threading.Thread(target=self._show, name="si4063_progress", daemon=True)
+            self._thread.start()
+        self._marks.put_nowait(mark)
+
+    def _show(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PROGRESS_NICE)
+        except (OSError, AttributeError):
+            pass
+        while(True):
+            mark = self._marks.get()
+            try:
+                if(self.on_progress):
+                    self.on_progress(mark)
+                else:
+                    print(mark, end="", flush=True)
+            finally:
+                self._marks.task_done()
+
+    # Wait until the marks are shown
+    def flush(self):
+        if(self._marks is not None):
+            self._marks.join()
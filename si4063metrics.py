@@ -0,0 +1,167 @@
+# si4063metrics.py
+# metrics of the driver for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# Counters and a histogram updated by Si4063 when radio.metrics is a Metrics.
+# radio.metrics is None by default, then the driver does one "is None" test per hook.
+# No print, no lock: the counters are ints and floats updated in the caller thread.
+#
+# usage:
+#   radio = si4063.Si4063(metrics=True)
+#   ...
+#   print(radio.stats())
+#   TextfileExporter({"hat0": radio}, "/var/lib/node_exporter/si4063.prom").start()
+#
+import os
+import time
+import threading
+import si4063const
+from si4063const import *
+
+# command names by opcode
+COMMAND_NAMES = {v: k[4:] for k, v in vars(si4063const).items() if k.startswith("CMD_")}
+
+# upper bounds (S) of the CTS wait histogram
+CTS_BUCKETS = (0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+class Metrics:
+    def __init__(self):
+        self.commands = {}          # opcode: count
+        self.spi_transactions = 0
+        self.spi_bytes_out = 0      # bytes clocked out(commands and 0xff in read)
+        self.spi_bytes_in = 0       # bytes of replies
+        self.cts_waits = 0
+        self.cts_wait_sum = 0.0     # S
+        self.cts_buckets = [0] * (len(CTS_BUCKETS) + 1)     # last one: +Inf
+        self.cts_timeouts = 0
+        self.part_info_retries = 0
+        self.tx_starts = 0
+        self.tx_time = 0.0          # S on air, finished transmissions
+        self._tx_start = None       # perf_counter of START_TX
+
+    ### hooks of Si4063
+    # A command written, opcode is to_send[0]
+    def command(self, to_send):
+        cmd = to_send[0]
+        self.commands[cmd] = self.commands.get(cmd, 0) + 1
+        if(cmd == CMD_START_TX):
+            if(self._tx_start is None):
+                self.tx_starts += 1
+                self._tx_start = time.perf_counter()
+        elif(cmd == CMD_CHANGE_STATE and to_send[1] != STATE_TX):
+            self.tx_end()
+
+    # TX ended, by CHANGE_STATE or shutdown
+    def tx_end(self):
+        if(self._tx_start is not None):
+            self.tx_time += time.perf_counter() - self._tx_start
+            self._tx_start = None
+
+    def spi(self, bytes_out, bytes_in):
+        self.spi_transactions += 1
+        self.spi_bytes_out += bytes_out
+        self.spi_bytes_in += bytes_in
+
+    # wait : S from the first read of CTS to High
+    def cts_wait(self, wait):
+        self.cts_waits += 1
+        self.cts_wait_sum += wait
+        for i, bound in enumerate(CTS_BUCKETS):
+            if(wait <= bound):
+                self.cts_buckets[i] += 1
+                return
+        self.cts_buckets[-1] += 1
+
+    # Snapshot of the metrics
+    # return : dict, tx_time includes the transmission on air
+    def stats(self):
+        tx_time = self.tx_time
+        if(self._tx_start is not None):
+            tx_time += time.perf_counter() - self._tx_start
+        return {
+            "commands": {COMMAND_NAMES.get(cmd, "{:02x}".format(cmd)): n for cmd, n in self.commands.items()},
+            "spi_transactions": self.spi_transactions,
+            "spi_bytes_out": self.spi_bytes_out,
+            "spi_bytes_in": self.spi_bytes_in,
+            "cts_waits": self.cts_waits,
+            "cts_wait_sum": self.cts_wait_sum,
+            "cts_wait_buckets": dict(zip(CTS_BUCKETS + (float("inf"),), self.cts_buckets)),
+            "cts_timeouts": self.cts_timeouts,
+            "part_info_retries": self.part_info_retries,
+            "tx_starts": self.tx_starts,
+            "tx_time": tx_time,
+            "on_air": self._tx_start is not None,
+        }
+
+# Prometheus text format of radios
+# radios : {name: Si4063 with metrics}
+# return : text
+def prometheus_text(radios):
+    lines = []
+    # samples : list of (suffix, labels, value)
+    def metric(name, kind, help_text, samples):
+        lines.append("# HELP si4063_{} {}".format(name, help_text))
+        lines.append("# TYPE si4063_{} {}".format(name, kind))
+        for suffix, labels, value in samples:
+            label = ",".join('{}="{}"'.format(k, v) for k, v in labels)
+            lines.append("si4063_{}{}{{{}}} {}".format(name, suffix, label, value))
+    stats = {name: radio.stats() for name, radio in radios.items() if radio.metrics is not None}
+    metric("commands_total", "counter", "Commands written by opcode",
+           [("", (("radio", r), ("command", c)), n) for r, s in stats.items() for c, n in s["commands"].items()])
+    for key, help_text in (("spi_transactions", "SPI transactions"),
+                           ("spi_bytes_out", "SPI bytes clocked out"),
+                           ("spi_bytes_in", "SPI bytes of replies"),
+                           ("cts_timeouts", "CTS timeouts"),
+                           ("part_info_retries", "PART_INFO reads retried"),
+                           ("tx_starts", "Transmissions started")):
+        metric(key + "_total", "counter", help_text, [("", (("radio", r),), s[key]) for r, s in stats.items()])
+    metric("tx_seconds_total", "counter", "Time on air",
+           [("", (("radio", r),), s["tx_time"]) for r, s in stats.items()])
+    metric("on_air", "gauge", "Transmitting now",
+           [("", (("radio", r),), int(s["on_air"])) for r, s in stats.items()])
+    samples = []
+    for r, s in stats.items():
+        count = 0
+        for bound, n in s["cts_wait_buckets"].items():
+            count += n      # buckets are cumulative
+            le = "+Inf" if bound == float("inf") else bound
+            samples.append(("_bucket", (("radio", r), ("le", le)), count))
+        samples.append(("_sum", (("radio", r),), s["cts_wait_sum"]))
+        samples.append(("_count", (("radio", r),), s["cts_waits"]))
+    metric("cts_wait_seconds", "histogram", "Wait for CTS", samples)
+    return "\n".join(lines) + "\n"
+
+# Write the text file of node_exporter textfile collector
+# The file is replaced at once, the collector never reads a half written file.
+def write_textfile(path, radios):
+    text = prometheus_text(radios)      # no tmp file left if it fails
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# Write the text file every interval(S) in a thread
+class TextfileExporter:
+    def __init__(self, radios, path, interval=15.0):
+        self.radios = radios
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="si4063_exporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        write_textfile(self.path, self.radios)
+
+    def _run(self):
+        while(not self._stop.wait(self.interval)):
+            write_textfile(self.path, self.radios)
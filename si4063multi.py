@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# si4063multi.py
+# several raspi si4063 2m radio hats(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# Hats on one raspi share the pigpiod connection(si4063.pool). A SPI transaction
+# takes the bus lock of the connection, and TX_DATA of the hats are clocked out
+# together in one DMA wave, pigpiod has only one wave engine.
+# Hats on other raspis(remote pigpiod) run in their own threads at the same time.
+#
+# usage:
+#   radio1 = si4063.Si4063()
+#   radio2 = si4063.Si4063(pins=PinMap(nSEL=GPIO_CE1, TX_DATA=12, CTS=16, SHDN=26))
+#   radio3 = si4063.Si4063(host="raspi2")
+#   for_each([radio1, radio2, radio3], bring_up, 144050000)
+#   send_morse([(radio1, "CQ", 20), (radio2, "TEST", 15), (radio3, "DE", 20)])
+#
+import sys
+import threading
+import si4063
+import radio_morse
+from si4063const import *
+from si4063wave import TxWave
+
+# Run func(radio, *args) on radios in threads
+# Radios on one raspi are serialized only by the SPI bus lock.
+# return : list of results in the order of radios
+# raise : the first error, after all threads have ended
+def for_each(radios, func, *args):
+    results = [None] * len(radios)
+    errors = []
+    def run(i, radio):
+        try:
+            results[i] = func(radio, *args)
+        except BaseException as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(i, radio), name="si4063_{}".format(i))
+               for i, radio in enumerate(radios)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if(errors):
+        raise errors[0]
+    return results
+
+# Bring up a radio, reset - power_up - frequency - power - setup
+# freq : frequency Hz
+# type_mod : modulation type, CW/OOK/FSK
+# pwr_lvl : PA output level 0x0-0x7f
+def bring_up(radio, freq, type_mod=MOD_TYPE_OOK, pwr_lvl=0x3f):
+    radio.reset()
+    count, chip_no = radio.part_info()
+    if(chip_no not in NAME_CHIPS):
+        raise Exception("Error: wrong chip name {} at {}".format(chip_no, radio.pins))
+    radio.power_up()
+    with radio.batch():
+        radio.set_radio_frequency(freq)
+        radio.set_pa_pwr_lvl(pwr_lvl)
+        radio.setup(type_mod)
+
+# Transmit runs of radios on one raspi, in one wave
+# group : list of (radio, runs)
+def _transmit_group(group):
+    for radio, runs in group:
+        radio.start_tx()
+    try:
+        if(len(group) == 1):
+            radio, runs = group[0]
+            radio.tx_runs(runs)
+        else:
+            wave = TxWave(group[0][0].pi, group[0][0].pins.TX_DATA)
+            wave.send_streams({radio.pins.TX_DATA: runs for radio, runs in group})
+    finally:
+        for radio, runs in group:
+            radio.tx_data(0)
+            radio.stop_tx()
+
+# Transmit on several radios at the same time
+# jobs : list of (radio, runs)
+#   radio : Si4063 after setup(), TX_DATA pins differ on one raspi
+#   runs : iterable of (level, duration_us)
+# raise : the first error, after all transmissions have ended
+def transmit(jobs):
+    groups = {}     # id(pi): [(radio, runs)]
+    for radio, runs in jobs:
+        groups.setdefault(id(radio.pi), []).append((radio, runs))
+    for group in groups.values():
+        gpios = [radio.pins.TX_DATA for radio, runs in group]
+        if(len(set(gpios)) != len(gpios)):
+            raise Exception("Error: TX_DATA pins {} on one raspi".format(gpios))
+    for_each(list(groups.values()), _transmit_group)
+
+# Send morse code on several radios at the same time
+# jobs : list of (radio, text, wpm)
+# fwpm : Farnsworth overall speed (None: same as wpm)
+def send_morse(jobs, fwpm=None):
+    runs = []
+    for radio, text, wpm in jobs:
+        schedule = radio_morse.compile_morse(text, wpm, fwpm)
+        dot_time = radio_morse.calculate_unit_time(wpm) / 1000
+        runs.append((radio, radio_morse.schedule_to_runs(schedule, dot_time)))
+    transmit(runs)
+
+##### TEST #####
+# python si4063multi.py --sim [wpm] : two hats on one simulated raspi and one on another
+if __name__ == "__main__":
+    args = sys.argv
+    if("--sim" not in args):
+        print("usage: si4063multi.py --sim [wpm]")
+        exit()
+    args.remove("--sim")
+    import si4063sim     # no hat
+    try:
+        wpm = int(args[1])
+    except:
+        wpm = 20
+    pins2 = PinMap(nSEL=GPIO_CE1, TX_DATA=12, CTS=16, SHDN=26)
+    pi1, pi2 = si4063sim.pi(), si4063sim.pi()
+    pi1.attach(pins=pins2)
+    radios = [si4063.Si4063(pi=pi1, spi="bb"),
+              si4063.Si4063(pi=pi1, spi="bb", pins=pins2),
+              si4063.Si4063(pi=pi2, spi="bb")]
+    freqs = [144050000, 144060000, 144070000]
+    for_each(list(zip(radios, freqs)), lambda job: bring_up(*job))
+    texts = ["CQ CQ", "TEST", "DE JA1"]
+    send_morse([(radio, text, wpm) for radio, text in zip(radios, texts)])
+    for pi, name in ((pi1, "raspi1"), (pi2, "raspi2")):
+        for pins, chip in pi.hats:
+            edges = [e for e in pi.timeline if e[1] == pins.TX_DATA]
+            print("{} TX_DATA GPIO{}: {} edges, {} commands, {} errors".format(
+                name, pins.TX_DATA, len(edges), len(chip.commands), chip.errors))
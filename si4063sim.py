@@ -0,0 +1,591 @@
+# si4063sim.py
+# stand-in for pigpio to run si4063 software without the hat
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# Only the part of the pigpio API used by si4063 software is implemented.
+# Waves are not clocked out, the edges are written to the timeline at once
+# with the ticks they would have on the hat. wave_tx_stop() takes back the
+# edges after now (levels and timeline, callbacks have been called already).
+# wave_tx_busy()/wave_tx_at() follow the real time of the waves. As pigpiod,
+# one wave can wait for the wave on air(WAVE_MODE_ONE_SHOT_SYNC), a wave sent
+# while one is waiting is counted in pi.wave_overflows.
+#
+# Si4063Chip decodes the SPI (soft SPI pins, bb_spi and spi_xfer) and
+# answers the commands in si4063const.py. CTS goes Low for a latency
+# after each command.
+# In packet mode the TX FIFO is emptied at the data rate by a timer, the
+# almost empty and packet sent interrupts drive nIRQ. Packets sent are in
+# chip.packets, FIFO underflows in chip.underflows.
+# The FIFO runs in chip time from START_TX, a byte written after the chip
+# needed it is an underflow even if the timer thread is late. The max delay
+# of the timer (interrupts raised late) is in chip.timer_late.
+#
+# usage:
+#   import si4063, si4063sim
+#   radio = si4063.Si4063(pi=si4063sim.pi())
+# two hats on one raspi:
+#   pi = si4063sim.pi()
+#   pins = PinMap(nSEL=GPIO_CE1, TX_DATA=12, CTS=16, SHDN=26)
+#   pi.attach(pins=pins)
+#   radio2 = si4063.Si4063(pi=pi, pins=pins)
+#
+import time
+import threading
+from si4063const import *
+
+# pigpio constants
+INPUT = 0
+OUTPUT = 1
+PUD_OFF = 0
+PUD_DOWN = 1
+PUD_UP = 2
+RISING_EDGE = 0
+FALLING_EDGE = 1
+EITHER_EDGE = 2
+WAVE_MODE_ONE_SHOT = 0
+WAVE_MODE_REPEAT = 1
+WAVE_MODE_ONE_SHOT_SYNC = 2
+WAVE_MODE_REPEAT_SYNC = 3
+WAVE_NOT_FOUND = 9998
+NO_TX_WAVE = 9999
+
+# Current tick (μS, wraps at 32 bits like pigpio)
+def _tick():
+    return int(time.perf_counter() * 1e6) & 0xffffffff
+
+# Simulated si4063
+# latency : CTS latency (S) per command, overrides CTS_LATENCY
+# temperature : °C, voltage : V read by GET_ADC_READING
+class Si4063Chip:
+    # CTS latency (S)
+    CTS_LATENCY = {
+        "por": 0.006,
+        CMD_POWER_UP: 0.015,
+        CMD_GET_ADC_READING: 0.0008,
+        CMD_START_TX: 0.0001,
+        CMD_CHANGE_STATE: 0.0001,
+    }
+    CTS_LATENCY_DEFAULT = 0.00002
+    PART_INFO = [0x11, 0x40, 0x63, 0x00, 0x00, 0x00, 0x00, 0x06]  # CHIPREV, PART, PBUILD, ID, CUSTOMER, ROMID
+
+    def __init__(self, latency=None, temperature=25.0, voltage=3.3):
+        self.latency = dict(self.CTS_LATENCY)
+        if(latency):
+            self.latency.update(latency)
+        self.temperature = temperature
+        self.voltage = voltage
+        self.powered = False
+        self.booted = False
+        self.state = STATE_SLEEP
+        self.props = {}         # (group, index): value
+        self.reply = []
+        self.errors = 0         # commands sent while CTS Low or unknown
+        self.commands = []      # commands executed, (tick, bytes)
+        self.events = []        # state changes, (tick, state)
+        self._cts_at = None     # CTS High at (perf_counter), None=Low
+        self.on_busy = None     # called with the CTS latency when CTS goes Low
+        self.fifo = bytearray() # bytes written into the TX FIFO since reset
+        self.packets = []       # payloads sent in packet mode
+        self.underflows = 0
+        self.timer_late = 0.0   # S, max delay of the packet timer
+        self.ph_pend = 0        # packet handler interrupts pending
+        self.nirq = 1
+        self.on_irq = None      # called with the level when nIRQ changes
+        self._pkt = None        # packet on air, [start(perf_counter), bps, length, almost empty armed]
+        self._timer = None
+        self._lock = threading.RLock()  # SPI and the packet timer
+        self._rx = None         # bytes of current transaction
+        self._bit = 0
+        self._byte = 0
+        self._out = 0
+
+    ### pins
+    # SHDN pin, High=shutdown, Low=power on reset
+    def shdn(self, level):
+        if(level):
+            with self._lock:
+                self.powered = False
+                self.booted = False
+                self.props = {}
+                self.reply = []
+                self._cts_at = None
+                self._end_packet()
+                self.ph_pend = 0
+                self._set_irq()
+                self._set_state(STATE_SLEEP)
+        elif(not self.powered):
+            self.powered = True
+            self._busy("por")
+
+    # CTS pin
+    def cts(self):
+        return 1 if(self._cts_at is not None and time.perf_counter() >= self._cts_at) else 0
+
+    # nSEL pin
+    def nsel(self, level):
+        if(level == 0):
+            self._rx = bytearray()
+            self._bit, self._byte = 0, 0
+            self._out = self._out_byte(0)
+        elif(self._rx is not None):
+            rx, self._rx = self._rx, None
+            self._execute(rx)
+
+    # SCLK rising edge, sdi : SDI pin
+    def sclk(self, sdi):
+        if(self._rx is None):
+            return
+        self._byte = (self._byte << 1) | sdi
+        self._bit += 1
+        if(self._bit == 8):
+            self._rx.append(self._byte)
+            self._bit, self._byte = 0, 0
+            self._out = self._out_byte(len(self._rx))
+
+    # SDO pin
+    def sdo(self):
+        return (self._out >> (7 - self._bit)) & 1
+
+    # Whole SPI transaction (bb_spi/spi_xfer)
+    # return : bytes shifted out
+    def transfer(self, data):
+        self.nsel(0)
+        out = bytearray()
+        for b in data:
+            out.append(self._out)
+            self._rx.append(b)
+            self._out = self._out_byte(len(self._rx))
+        self.nsel(1)
+        return out
+
+    ### command processor
+    # byte shifted out at position k of the transaction
+    def _out_byte(self, k):
+        if(k == 0 or not self.powered):
+            return 0x00
+        if(self._rx[0] in (CMD_READ_CMD_BUFF, CMD_NOP)):
+            cts = self.cts()
+            if(k == 1):
+                return 0xff if cts else 0x00
+            if(cts and k - 2 < len(self.reply)):
+                return self.reply[k - 2]
+        return 0x00
+
+    # CTS Low for the latency of cmd
+    def _busy(self, cmd):
+        latency = self.latency.get(cmd, self.CTS_LATENCY_DEFAULT)
+        self._cts_at = time.perf_counter() + latency
+        if(self.on_busy):
+            self.on_busy(latency)
+
+    def _set_state(self, state):
+        if(state != self.state):
+            self.state = state
+            self.events.append((_tick(), state))
+
+    ### packet mode
+    # Bytes taken out of the FIFO by now, FIFO events
+    def _update(self):
+        if(self._pkt is None):
+            return
+        start, bps, length, armed = self._pkt
+        due = min(length, int((time.perf_counter() - start) * bps / 8))
+        if(due > len(self.fifo)):
+            self.underflows += 1    # no PACKET_SENT, the host times out
+            self._end_packet()
+            return
+        if(armed and TX_FIFO_SIZE - (len(self.fifo) - due) >= self.props.get(tuple(PKT_TX_THRESHOLD[:2]), 0x30)):
+            self.ph_pend |= PH_TX_FIFO_ALMOST_EMPTY
+            self._pkt[3] = False
+        if(due == length):
+            self.ph_pend |= PH_PACKET_SENT
+            self.packets.append(bytes(self.fifo[:length]))
+            self._end_packet()
+        self._set_irq()
+
+    # Timer at the next FIFO event
+    def _schedule(self):
+        if(self._timer):
+            self._timer.cancel()
+            self._timer = None
+        if(self._pkt is None):
+            return
+        start, bps, length, armed = self._pkt
+        events = [min(length, len(self.fifo) + 1)]  # end or underflow
+        if(armed):
+            events.append(len(self.fifo) - TX_FIFO_SIZE + self.props.get(tuple(PKT_TX_THRESHOLD[:2]), 0x30))
+        at = max(start + min(events) * 8 / bps, time.perf_counter())
+        self._timer = threading.Timer(at - time.perf_counter() + 0.00001, self._on_timer, (at,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    # at : chip time of the event, or of the schedule if the event has passed
+    def _on_timer(self, at):
+        with self._lock:
+            self.timer_late = max(self.timer_late, time.perf_counter() - at)
+            self._update()
+            self._schedule()
+
+    def _end_packet(self):
+        if(self._pkt is not None):
+            start, bps, length, armed = self._pkt
+            del self.fifo[:min(length, int((time.perf_counter() - start) * bps / 8))]   # sent
+            self._pkt = None
+            self._set_state(STATE_READY)    # txcomplete_state of START_TX
+        if(self._timer):
+            self._timer.cancel()
+            self._timer = None
+
+    def _set_irq(self):
+        enabled = self.props.get(tuple(INT_CTL_ENABLE[:2]), 0) & 1 and self.props.get(tuple(INT_CTL_PH_ENABLE[:2]), 0)
+        level = 0 if self.ph_pend & enabled else 1
+        if(level != self.nirq):
+            self.nirq = level
+            if(self.on_irq):
+                self.on_irq(level)
+
+    def _fifo_count(self):
+        if(self._pkt is None):
+            return len(self.fifo)
+        start, bps, length, armed = self._pkt
+        return len(self.fifo) - min(length, int((time.perf_counter() - start) * bps / 8))
+
+    # WRITE_TX_FIFO, no CTS
+    def _write_fifo(self, data):
+        space = TX_FIFO_SIZE - self._fifo_count()
+        if(len(data) > space):
+            self.errors += 1    # overflow
+            data = data[:space]
+        self.fifo += data
+        if(self._pkt is not None):
+            self._pkt[3] = True
+            self._schedule()
+
+    # Execute a command at nSEL High
+    def _execute(self, rx):
+        if(not rx or not self.powered or rx[0] in (CMD_READ_CMD_BUFF, CMD_NOP)):
+            return
+        with self._lock:
+            self._update()
+            if(rx[0] == CMD_WRITE_TX_FIFO and self.booted):
+                self._write_fifo(rx[1:])
+            else:
+                self._command(rx)
+
+    def _command(self, rx):
+        cmd = rx[0]
+        if(not self.cts()):
+            self.errors += 1
+            return
+        self.commands.append((_tick(), bytes(rx)))
+        reply = []
+        if(cmd == CMD_POWER_UP):
+            self.booted = True
+            self._set_state(STATE_READY)
+        elif(cmd == CMD_PART_INFO):
+            reply = list(self.PART_INFO)
+        elif(not self.booted):
+            self.errors += 1
+        elif(cmd == CMD_SET_PROPERTY):
+            group, num, index = rx[1], rx[2], rx[3]
+            for i, val in enumerate(rx[4:4 + num]):
+                self.props[(group, index + i)] = val
+        elif(cmd == CMD_GET_PROPERTY):
+            group, num, index = rx[1], rx[2], rx[3]
+            reply = [self.props.get((group, index + i), 0) for i in range(min(num, 16))]
+        elif(cmd == CMD_GET_ADC_READING):
+            battery_adc = round(self.voltage * 1280 / 3)
+            temp_adc = round((self.temperature + 293) * 4096 / 899)
+            reply = [0, 0, battery_adc >> 8, battery_adc & 0xff, temp_adc >> 8, temp_adc & 0xff, 0, 0]
+        elif(cmd == CMD_REQUEST_DEVICE_STATE):
+            reply = [self.state, 0]
+        elif(cmd == CMD_START_TX):
+            self._set_state(STATE_TX)
+            tx_len = ((rx[3] & 0x1f) << 8) | rx[4]
+            if(tx_len and (self.props.get(tuple(MODEM_MOD_TYPE[:2]), 0) >> 3) & 3 == MOD_SOURCE_PACKET):
+                rate = self.props.get((0x20, 0x03), 0) << 16 | self.props.get((0x20, 0x04), 0) << 8 | self.props.get((0x20, 0x05), 0)
+                self._pkt = [time.perf_counter(), rate, tx_len, True]
+                self._update()
+                self._schedule()
+        elif(cmd == CMD_CHANGE_STATE):
+            self._end_packet()
+            self._set_state(rx[1])
+        elif(cmd == CMD_FIFO_INFO):
+            if(rx[1] & FIFO_RESET_TX and self._pkt is None):
+                self.fifo = bytearray()
+            reply = [0, TX_FIFO_SIZE - self._fifo_count()]
+        elif(cmd == CMD_GET_PH_STATUS):
+            reply = [self.ph_pend, self.ph_pend]
+            self.ph_pend &= rx[1] if len(rx) > 1 else 0
+            self._set_irq()
+        else:
+            self.errors += 1
+        self.reply = reply
+        self._busy(cmd)
+
+# callback of pi.callback()
+class _callback:
+    def __init__(self, pi, gpio, edge, func):
+        self.pi = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func if func else self._tally
+        self.count = 0
+        self.pi._callbacks.append(self)
+
+    def _tally(self, gpio, level, tick):
+        self.count += 1
+
+    def tally(self):
+        return self.count
+
+    def reset_tally(self):
+        self.count = 0
+
+    def cancel(self):
+        if(self in self.pi._callbacks):
+            self.pi._callbacks.remove(self)
+
+# pulse for wave_add_generic()
+class pulse:
+    def __init__(self, gpio_on, gpio_off, delay):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delay = delay
+
+# stand-in for pigpio.pi
+# trace : gpios recorded in timeline (None: TX_DATA of the hats)
+# chip : Si4063Chip on the pins (None: a new one)
+# pins : PinMap of the chip (None: default pins)
+class pi:
+    def __init__(self, host="localhost", port=8888, trace=None, chip=None, pins=None):
+        self.connected = True
+        self._callbacks = []
+        self._cts_timers = {}   # CTS gpio: threading.Timer
+        self.levels = [0] * 54
+        self.modes = [INPUT] * 54
+        self._trace_tx = trace is None
+        self.trace = set() if trace is None else set(trace)
+        self.timeline = []      # edges, (tick, gpio, level)
+        self._new_wave = []
+        self._waves = {}
+        self._next_wid = 0
+        self._tx = []           # waves on air, [wid, start, end, edges] (perf_counter)
+        self.wave_overflows = 0 # SYNC waves sent while a wave was waiting
+        self.hats = []          # (pins, chip)
+        self.chip = self.attach(chip, pins)
+
+    # Put a hat on the raspi
+    # chip : Si4063Chip (None: a new one)
+    # pins : PinMap of the hat (None: default pins)
+    # return : the chip
+    def attach(self, chip=None, pins=None):
+        chip = Si4063Chip() if chip is None else chip
+        pins = PinMap() if pins is None else pins
+        chip.on_busy = lambda latency: self._cts_busy(chip, pins.CTS, latency)
+        chip.on_irq = lambda level: self._set_level(pins.nIRQ, level, _tick())
+        self.hats.append((pins, chip))
+        if(self._trace_tx):
+            self.trace.add(pins.TX_DATA)
+        return chip
+
+    # Chip selected by nSEL pin
+    def _chip_at(self, nsel):
+        for pins, chip in self.hats:
+            if(pins.nSEL == nsel):
+                return chip
+        return None
+
+    def stop(self):
+        self.connected = False
+
+    # Pulse of pulse_len μS at level, then back
+    def gpio_trigger(self, user_gpio, pulse_len=10, level=1):
+        self.write(user_gpio, level)
+        self.write(user_gpio, 1 - level)
+        return 0
+
+    def get_current_tick(self):
+        return _tick()
+
+    def set_mode(self, gpio, mode):
+        self.modes[gpio] = mode
+        return 0
+
+    def set_pull_up_down(self, gpio, pud):
+        if(self.modes[gpio] == INPUT and pud != PUD_OFF):
+            self._set_level(gpio, 1 if pud == PUD_UP else 0, _tick())
+        return 0
+
+    def read(self, gpio):
+        for pins, chip in self.hats:
+            if(gpio == pins.CTS):
+                return chip.cts()
+            elif(gpio == pins.SDO and self.levels[pins.nSEL] == 0):
+                return chip.sdo()
+        return self.levels[gpio]
+
+    def write(self, gpio, level):
+        level = 1 if level else 0
+        changed = self.levels[gpio] != level
+        self._set_level(gpio, level, _tick())
+        for pins, chip in self.hats:
+            if(gpio == pins.SHDN):
+                cts = chip.cts()
+                chip.shdn(level)
+                if(cts and not chip.cts()):     # chip off
+                    self._fire(pins.CTS, 0, _tick())
+            elif(not changed):
+                pass
+            elif(gpio == pins.nSEL):
+                chip.nsel(level)
+            elif(gpio == pins.SCLK and level):
+                chip.sclk(self.levels[pins.SDI])
+        return 0
+
+    ### SPI
+    def bb_spi_open(self, CS, MISO, MOSI, SCLK, baud, spi_flags):
+        return 0
+
+    def bb_spi_close(self, CS):
+        return 0
+
+    def bb_spi_xfer(self, CS, data):
+        return self._transfer(self._chip_at(CS), data)
+
+    # handle is the channel
+    def spi_open(self, spi_channel, baud, spi_flags=0):
+        return spi_channel
+
+    def spi_close(self, handle):
+        return 0
+
+    def spi_xfer(self, handle, data):
+        return self._transfer(self._chip_at(SPI0_CE[handle]), data)
+
+    # no chip at CS, MISO is pulled down
+    def _transfer(self, chip, data):
+        out = chip.transfer(data) if chip else bytearray(len(data))
+        return len(out), out
+
+    # Set gpio level and record the edge
+    def _set_level(self, gpio, level, tick):
+        if(self.levels[gpio] != level):
+            self.levels[gpio] = level
+            if(gpio in self.trace):
+                self.timeline.append((tick, gpio, level))
+            if(self._callbacks):
+                self._fire(gpio, level, tick)
+
+    ### callbacks
+    def callback(self, user_gpio, edge=RISING_EDGE, func=None):
+        return _callback(self, user_gpio, edge, func)
+
+    # Call callbacks of an edge
+    def _fire(self, gpio, level, tick):
+        for cb in list(self._callbacks):
+            if(cb.gpio == gpio and (cb.edge == EITHER_EDGE or cb.edge == 1 - level)):
+                cb.func(gpio, level, tick)
+
+    # CTS of chip falls now and rises after latency
+    def _cts_busy(self, chip, gpio, latency):
+        timer = self._cts_timers.get(gpio)
+        if(timer):
+            timer.cancel()
+        self._fire(gpio, 0, _tick())
+        timer = self._cts_timers[gpio] = threading.Timer(latency, self._cts_ready, (chip, gpio))
+        timer.daemon = True
+        timer.start()
+
+    def _cts_ready(self, chip, gpio):
+        if(chip.cts()):
+            self._fire(gpio, 1, _tick())
+
+    ### waves
+    def wave_clear(self):
+        self._new_wave = []
+        self._waves = {}
+        self._tx = []
+        return 0
+
+    def wave_add_new(self):
+        self._new_wave = []
+        return 0
+
+    def wave_add_generic(self, pulses):
+        self._new_wave.extend((p.gpio_on, p.gpio_off, p.delay) for p in pulses)
+        return len(self._new_wave)
+
+    def wave_create(self):
+        wid = self._next_wid
+        self._next_wid += 1
+        self._waves[wid] = self._new_wave
+        self._new_wave = []
+        return wid
+
+    def wave_delete(self, wid):
+        self._waves.pop(wid, None)
+        return 0
+
+    def wave_get_max_pulses(self):
+        return 12000
+
+    def wave_send_once(self, wid):
+        return self.wave_send_using_mode(wid, WAVE_MODE_ONE_SHOT)
+
+    # Play the wave into the timeline
+    def wave_send_using_mode(self, wid, mode):
+        now = time.perf_counter()
+        self._tx = [w for w in self._tx if w[2] > now]
+        if(mode == WAVE_MODE_ONE_SHOT_SYNC and self._tx):
+            if(self._tx[-1][1] > now):      # not on air yet
+                self.wave_overflows += 1
+            start = self._tx[-1][2]
+        else:
+            self._tx = []
+            start = now
+        t = 0
+        edges = []      # (tick, gpio, level, level before)
+        for gpio_on, gpio_off, delay in self._waves[wid]:
+            tick = (int(start * 1e6) + t) & 0xffffffff
+            self._play(gpio_on, 1, tick, edges)
+            self._play(gpio_off, 0, tick, edges)
+            t += delay
+        self._tx.append([wid, start, start + t / 1e6, edges])
+        return t
+
+    # Set levels of gpios in mask by a wave, edges are kept for wave_tx_stop()
+    def _play(self, mask, level, tick, edges):
+        while(mask):
+            bit = mask & -mask
+            gpio = bit.bit_length() - 1
+            if(self.levels[gpio] != level):
+                edges.append((tick, gpio, level, self.levels[gpio]))
+                self._set_level(gpio, level, tick)
+            mask ^= bit
+
+    def wave_tx_busy(self):
+        now = time.perf_counter()
+        return 1 if any(w[2] > now for w in self._tx) else 0
+
+    def wave_tx_at(self):
+        now = time.perf_counter()
+        for wid, start, end, edges in self._tx:
+            if(start <= now < end):
+                return wid
+        return NO_TX_WAVE
+
+    # Edges after now are taken back, the gpios stay at the levels of now
+    def wave_tx_stop(self):
+        now = _tick()
+        future = [e for w in self._tx for e in w[3] if 0 < (e[0] - now) & 0xffffffff < 0x80000000]
+        for tick, gpio, level, before in reversed(future):
+            self.levels[gpio] = before
+        future = set(e[:3] for e in future)
+        self.timeline[:] = [e for e in self.timeline if e not in future]
+        self._tx = []
+        return 0
@@ -0,0 +1,206 @@
+# si4063spi.py
+# SPI transports for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# A transport does one SPI transaction per xfer() call,
+#   nSEL Low - write to_send - read count bytes(0xff sent) - nSEL High
+# SoftSPI pins GPIO8-11 are the pins of SPI0(CE0, MISO, MOSI, SCLK),
+# then the same hat can be driven by hardware SPI.
+# pins : PinMap of the hat (None: default pins), hats on one bus differ in nSEL.
+#
+from si4063const import *
+
+# pigpio gpio modes
+INPUT = 0       # pigpio.INPUT
+OUTPUT = 1      # pigpio.OUTPUT
+ALT0 = 4        # pigpio.ALT0, SPI0 function of GPIO8-11
+PUD_DOWN = 1    # pigpio.PUD_DOWN
+
+# debug flag primitive
+_debug = False
+
+# SPI by python, one pigpio call per pin change
+# pi : pigpio.pi
+# pins : PinMap
+class SoftSpi:
+    def __init__(self, pi, pins=None):
+        self.pi = pi
+        self.pins = PinMap() if pins is None else pins
+        # nSEL pin
+        self.pi.set_mode(self.pins.nSEL, OUTPUT)
+        self.pi.write(self.pins.nSEL, 1)  # nSEL = 1
+        # SDI(MOSI) pin
+        self.pi.set_mode(self.pins.SDI, OUTPUT)
+        self.pi.write(self.pins.SDI, 0)  # MOSI = 0
+        # SDO(MISO) pin
+        self.pi.set_mode(self.pins.SDO, INPUT)
+        self.pi.set_pull_up_down(self.pins.SDO, PUD_DOWN) # pull down
+        # SCLK pin
+        self.pi.set_mode(self.pins.SCLK, OUTPUT)
+        self.pi.write(self.pins.SCLK, 0)  # SCLK = 0
+
+    # Set nSEL pin Low
+    def _spi_select(self):
+        if(_debug):
+            print("\t_select")
+        self.pi.write(self.pins.nSEL, 0)
+    # Set nSEL pin High
+    def _spi_deselect(self):
+        if(_debug):
+            print("\t_deselect")
+        self.pi.write(self.pins.nSEL, 1)
+    # Set SCLK pin 1/0
+    def _spi_clk(self, bit):
+        self.pi.write(self.pins.SCLK, bit)
+
+    # Write a byte
+    def _spi_wr(self, data):
+        if(_debug):
+            print("\t_wr: {:02x}".format(data))
+        for i in range(8):
+            self._spi_clk(0)
+            bit = 1 if((data<<(i) & 0x80)) else 0
+            self.pi.write(self.pins.SDI, bit)
+            self._spi_clk(1)
+
+        self._spi_clk(0)
+        self.pi.write(self.pins.SDI, 0)
+
+    # Read a byte
+    # return : 1 byte read
+    def _spi_rd(self):
+        data = 0
+        for i in range(8):
+            self._spi_clk(0)
+            data = data<<1
+            self.pi.write(self.pins.SDI, 1)      # write 0xff in read
+            bit = self.pi.read(self.pins.SDO)
+            data += bit
+            self._spi_clk(1)
+
+        self._spi_clk(0)
+        if(_debug):
+            print("\t_rd: {:02x}".format(data))
+        return data
+
+    # SPI transaction
+    # to_send : bytes to be written
+    # count : qty of bytes read after to_send
+    # return : byte(s) read (list)
+    def xfer(self, to_send, count=0):
+        self._spi_select()
+        for b in to_send:
+            self._spi_wr(b)
+        reply = [self._spi_rd() for i in range(count)]
+        self._spi_deselect()
+        return reply
+
+    def close(self):
+        pass
+
+# Base of transports with full duplex transfer
+class _DuplexSpi:
+    # SPI transaction
+    # to_send : bytes to be written
+    # count : qty of bytes read after to_send
+    # return : byte(s) read (list)
+    def xfer(self, to_send, count=0):
+        data = self._transfer(bytes(to_send) + b"\xff" * count)
+        if(_debug):
+            print("\t_xfer: ", ' '.join('{:02x}'.format(x) for x in data))
+        return list(data[len(to_send):])
+
+# SPI bit banged in pigpiod, one pigpio call per transaction
+# pi : pigpio.pi
+# baud : SCLK(Hz), 50 - 250000
+# pins : PinMap
+class BbSpi(_DuplexSpi):
+    def __init__(self, pi, baud=250000, pins=None):
+        self.pi = pi
+        self.pins = PinMap() if pins is None else pins
+        self.pi.set_mode(self.pins.nSEL, OUTPUT)
+        self.pi.write(self.pins.nSEL, 1)  # nSEL = 1
+        self.pi.set_pull_up_down(self.pins.SDO, PUD_DOWN)
+        # mode 0, nSEL active low, SDO/SDI/SCLK may be shared by other nSEL
+        self.pi.bb_spi_open(self.pins.nSEL, self.pins.SDO, self.pins.SDI, self.pins.SCLK, baud, 0)
+
+    def _transfer(self, data):
+        return self.pi.bb_spi_xfer(self.pins.nSEL, data)[1]
+
+    def close(self):
+        self.pi.bb_spi_close(self.pins.nSEL)
+
+# Chip enable of hardware SPI0 at nSEL of pins
+# return : 0=CE0, 1=CE1
+def _spi0_channel(pins):
+    nsel = GPIO_nSEL if pins is None else pins.nSEL
+    if(nsel not in SPI0_CE):
+        raise Exception("Error: nSEL GPIO{} is not CE of SPI0".format(nsel))
+    return SPI0_CE.index(nsel)
+
+# Hardware SPI0 by pigpiod, CE0 = GPIO_nSEL
+# pi : pigpio.pi
+# baud : SCLK(Hz), up to 10MHz(si4063)
+# channel : chip enable, 0=CE0, None=nSEL of pins
+# pins : PinMap
+class PigpioSpi(_DuplexSpi):
+    def __init__(self, pi, baud=5000000, channel=None, pins=None):
+        self.pi = pi
+        if(channel is None):
+            channel = _spi0_channel(pins)
+        self.handle = self.pi.spi_open(channel, baud, 0)    # mode 0
+
+    def _transfer(self, data):
+        return self.pi.spi_xfer(self.handle, data)[1]
+
+    def close(self):
+        self.pi.spi_close(self.handle)
+
+# Hardware SPI0 by linux spidev (dtparam=spi=on), /dev/spidev<bus>.<device>
+# baud : SCLK(Hz), up to 10MHz(si4063)
+# pi : pigpio.pi, if given the SPI pins are set back to SPI0 function
+# device : chip enable, None=nSEL of pins
+# pins : PinMap
+class SpidevSpi(_DuplexSpi):
+    def __init__(self, baud=5000000, bus=0, device=None, pi=None, pins=None):
+        try:
+            import spidev
+        except ImportError:
+            raise Exception("Error: spidev NOT installed")
+        if(device is None):
+            device = _spi0_channel(pins)
+        if(pi is not None):
+            p = PinMap() if pins is None else pins
+            for gpio in (p.nSEL, p.SDO, p.SDI, p.SCLK):
+                pi.set_mode(gpio, ALT0)
+        self.dev = spidev.SpiDev()
+        self.dev.open(bus, device)
+        self.dev.mode = 0
+        self.dev.max_speed_hz = baud
+
+    def _transfer(self, data):
+        return self.dev.xfer2(list(data))
+
+    def close(self):
+        self.dev.close()
+
+# Open a transport by name
+# kind : "soft", "bb", "pigpio" or "spidev"
+# pi : pigpio.pi
+# baud : SCLK(Hz), None=default of the transport
+# pins : PinMap of the hat
+def open_spi(kind, pi, baud=None, pins=None):
+    if(kind == "soft"):
+        return SoftSpi(pi, pins)
+    kw = {"pins": pins} if baud is None else {"pins": pins, "baud": baud}
+    if(kind == "bb"):
+        return BbSpi(pi, **kw)
+    elif(kind == "pigpio"):
+        return PigpioSpi(pi, **kw)
+    elif(kind == "spidev"):
+        return SpidevSpi(pi=pi, **kw)
+    raise Exception("Error: SPI transport {}".format(kind))
@@ -0,0 +1,144 @@
+# si4063telemetry.py
+# temperature and supply voltage sampler for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# A thread reads GET_ADC_READING every interval into a ring buffer.
+# A reading holds radio.cmd_lock, then it is not mixed with commands of other threads.
+# TX edges by DMA waves are clocked out by pigpiod and never wait for it.
+# TX edges keyed by python publish the next edge in radio.next_edge, a reading
+# is started only if it ends guard before that edge.
+#
+# usage:
+#   sampler = TelemetrySampler(radio, interval=1.0).start()
+#   sampler.on_threshold("temperature", high=60, func=alarm)
+#   radio_morse.send_morse(text, 20, radio)
+#   print(sampler.stats(60))
+#   sampler.stop()
+#
+import time
+import threading
+from collections import deque
+
+FIELDS = ("temperature", "voltage")
+
+class TelemetrySampler:
+    # radio : Si4063 after power_up()
+    # interval : S between readings
+    # size : readings kept in the ring buffer
+    # guard : S kept clear before a TX_DATA edge keyed by python
+    # executor : CommandExecutor of radio, readings go in its housekeeping lane
+    def __init__(self, radio, interval=1.0, size=3600, guard=0.002, executor=None):
+        self.radio = radio
+        self.executor = executor
+        self.interval = interval
+        self.guard = guard
+        self.samples = deque(maxlen=size)   # (time.time(), temperature, voltage)
+        self.duration = 0.0     # longest reading (S)
+        self.deferred = 0       # readings put off for a TX edge
+        self.errors = 0
+        self.last_error = None
+        self._thresholds = []   # [field, low, high, func, out of range]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="si4063_telemetry", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if(self._thread is not None):
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        next_time = time.perf_counter()
+        while(not self._stop.is_set()):
+            try:
+                self.sample()
+            except Exception as e:      # e.g. CTS timeout, try again at next interval
+                self.errors += 1
+                self.last_error = e
+            next_time += self.interval
+            now = time.perf_counter()
+            if(next_time < now):
+                next_time = now         # late, no burst of readings
+            self._stop.wait(next_time - now)
+
+    # Read temperature and voltage once
+    # return : (time.time(), temperature, voltage)
+    def sample(self):
+        self._clear_of_edges()
+        t = time.perf_counter()
+        if(self.executor is not None):
+            temperature, voltage = self.executor.get_adc_reading().result()
+        else:
+            temperature, voltage = self.radio.get_adc_reading()
+        self.duration = max(self.duration, time.perf_counter() - t)
+        sample = (time.time(), temperature, voltage)
+        if(temperature is not None):
+            self.samples.append(sample)
+            self._check(sample)
+        return sample
+
+    # Wait until a reading ends guard before the next TX_DATA edge
+    def _clear_of_edges(self):
+        limit = time.perf_counter() + 1.0   # keying stalled, do not wait forever
+        deferred = False
+        while(True):
+            edge = self.radio.next_edge
+            now = time.perf_counter()
+            if(edge is None or edge - now >= self.duration + self.guard or now > limit):
+                break
+            deferred = True
+            time.sleep(max(edge - now, 0) + 0.0002)   # just after the edge
+        if(deferred):
+            self.deferred += 1
+
+    # Call func when a field leaves or comes back to low..high
+    # field : "temperature" or "voltage"
+    # low, high : limits (None: no limit)
+    # func : func(field, value, alarm), alarm True when out of range, False when back
+    def on_threshold(self, field, low=None, high=None, func=None):
+        if(field not in FIELDS):
+            raise Exception("Error: telemetry field {}".format(field))
+        self._thresholds.append([field, low, high, func, False])
+
+    def _check(self, sample):
+        for threshold in self._thresholds:
+            field, low, high, func, out = threshold
+            value = sample[1 + FIELDS.index(field)]
+            alarm = (low is not None and value < low) or (high is not None and value > high)
+            if(alarm != out):
+                threshold[4] = alarm
+                if(func):
+                    func(field, value, alarm)
+
+    # Readings in the ring buffer
+    # seconds : the last seconds only (None: all)
+    def readings(self, seconds=None):
+        samples = list(self.samples)
+        if(seconds is not None):
+            since = time.time() - seconds
+            samples = [s for s in samples if s[0] >= since]
+        return samples
+
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    # min/max/mean of the readings
+    # seconds : the last seconds only (None: all)
+    # return : {"count": n, "temperature": (min, max, mean), "voltage": (min, max, mean)}
+    def stats(self, seconds=None):
+        samples = self.readings(seconds)
+        stats = {"count": len(samples)}
+        for i, field in enumerate(FIELDS):
+            values = [s[1 + i] for s in samples]
+            stats[field] = (min(values), max(values), sum(values) / len(values)) if values else None
+        return stats
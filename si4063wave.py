@@ -0,0 +1,197 @@
+# si4063wave.py
+# DMA timed transmit data for raspi si4063 2m radio hat(my own work, see hat directory)
+#
+# This implementation is for personal experiments.
+# Copyright (c) 2023 Tsuyoshi Ohashi
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+#
+# Bits are converted to pigpio waveforms on GPIO_TX_DATA.
+# pigpiod clocks the edges out by DMA, so the timing does not depend on python.
+# Edges are placed on absolute times (rounded to 1μS), then no drift is accumulated.
+# A wave sent by WAVE_MODE_ONE_SHOT_SYNC waits for the end of the wave on air,
+# pigpiod keeps one waiting wave. The next wave is sent after the oldest one
+# has ended (wave_tx_at()), then 2 waves at most are on air or waiting.
+# pigpiod has one wave engine, runs of several hats on one raspi are merged
+# into one wave by send_streams().
+#
+import time
+import heapq
+from collections import deque
+from si4063const import *
+
+WAVE_MODE_ONE_SHOT_SYNC = 2     # pigpio.WAVE_MODE_ONE_SHOT_SYNC
+WAVE_TX_NONE = 9999             # wave_tx_at(): no wave is transmitted
+
+# pulse for pigpio wave_add_generic()
+class Pulse:
+    __slots__ = ("gpio_on", "gpio_off", "delay")
+
+    def __init__(self, gpio_on, gpio_off, delay):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delay = delay
+
+# Convert bits to runs (lazy)
+# bits : iterable of 0/1
+# baud : bits per second
+# return : generator of (level, duration_us)
+def bits_to_runs(bits, baud):
+    bit_us = 1e6 / baud
+    level, count = None, 0
+    for bit in bits:
+        bit = 1 if bit else 0
+        if(bit == level):
+            count += 1
+        else:
+            if(count):
+                yield level, count * bit_us
+            level, count = bit, 1
+    if(count):
+        yield level, count * bit_us
+
+# Convert runs of a gpio to pulses (lazy), same levels in one pulse
+# mask : bit of the gpio
+# return : generator of Pulse
+def runs_to_pulses(runs, mask):
+    pulse, last = None, None
+    t, t_edge = 0.0, 0
+    for level, duration in runs:
+        if(duration <= 0):
+            continue
+        t += duration
+        edge = round(t)
+        if(level == last and pulse is not None):
+            pulse.delay += edge - t_edge
+        else:
+            if(pulse is not None):
+                yield pulse
+            pulse = Pulse(mask, 0, edge - t_edge) if level else Pulse(0, mask, edge - t_edge)
+        last, t_edge = level, edge
+    if(pulse is not None):
+        yield pulse
+
+# Edges of runs of a gpio
+# return : generator of (time_us, gpio, level), level -1 at the end of runs
+def _edges(gpio, runs):
+    t, last = 0.0, None
+    for level, duration in runs:
+        if(duration <= 0):
+            continue
+        level = 1 if level else 0
+        if(level != last):
+            yield round(t), gpio, level
+            last = level
+        t += duration
+    yield round(t), gpio, -1
+
+# Merge runs of several gpios to pulses (lazy)
+# streams : {gpio: iterable of (level, duration_us)}
+# return : generator of Pulse
+def merge_streams(streams):
+    gpio_on, gpio_off = 0, 0
+    t_edge = None
+    for t, gpio, level in heapq.merge(*(_edges(g, runs) for g, runs in streams.items())):
+        if(t_edge is not None and t > t_edge):
+            yield Pulse(gpio_on, gpio_off, t - t_edge)
+            gpio_on, gpio_off = 0, 0
+        t_edge = t
+        mask = 1 << gpio
+        if(level == 1):
+            gpio_on, gpio_off = gpio_on | mask, gpio_off & ~mask
+        elif(level == 0):
+            gpio_on, gpio_off = gpio_on & ~mask, gpio_off | mask
+    if(gpio_on or gpio_off):
+        yield Pulse(gpio_on, gpio_off, 0)
+
+class TxWave:
+    # pi : pigpio.pi (or si4063sim.pi)
+    # gpio : TX DATA pin
+    # max_pulses : pulses in one DMA wave
+    # max_waves : waves in pigpiod, on air and waiting (1 or 2)
+    def __init__(self, pi, gpio=GPIO_TX_DATA, max_pulses=2000, max_waves=2):
+        if(max_waves < 1 or max_waves > 2):
+            raise Exception("Error: max_waves {}, pigpiod keeps one waiting wave".format(max_waves))
+        self.pi = pi
+        self.gpio = gpio
+        self.max_pulses = max_pulses
+        self.max_waves = max_waves
+        self.underruns = 0      # wave queue was empty before the next wave
+        self._gpios = {gpio}    # gpios driven, set Low by stop()
+        self._waves = deque()   # wave ids sent to pigpiod
+        self._end = 0.0         # estimated end of the queued waves (perf_counter)
+
+    # Send bits
+    # bits : iterable of 0/1
+    # baud : bits per second
+    # wait : wait for end of transmission
+    def send_bits(self, bits, baud, wait=True):
+        self.send_runs(bits_to_runs(bits, baud), wait)
+
+    # Send runs
+    # runs : iterable of (level, duration_us), consumed lazily
+    # wait : wait for end of transmission
+    def send_runs(self, runs, wait=True):
+        self._send(runs_to_pulses(runs, 1 << self.gpio), wait)
+
+    # Send runs on several gpios at the same time, in one wave
+    # streams : {gpio: iterable of (level, duration_us)}, consumed lazily
+    # wait : wait for end of transmission
+    def send_streams(self, streams, wait=True):
+        self._gpios.update(streams)
+        self._send(merge_streams(streams), wait)
+
+    # Queue pulses by max_pulses
+    def _send(self, pulses, wait):
+        chunk = []
+        try:
+            for pulse in pulses:
+                chunk.append(pulse)
+                if(len(chunk) >= self.max_pulses):
+                    self._queue(chunk)
+                    chunk = []
+            if(chunk):
+                self._queue(chunk)
+            if(wait):
+                self.wait()
+        except BaseException:
+            self.stop()
+            raise
+
+    # Wait for end of transmission and release waves
+    def wait(self):
+        while(self.pi.wave_tx_busy()):
+            time.sleep(max(self._end - time.perf_counter(), 0.001))
+        self._release(len(self._waves))
+
+    # Stop transmission at once, TX_DATA = Low
+    def stop(self):
+        self.pi.wave_tx_stop()
+        for gpio in self._gpios:
+            self.pi.write(gpio, 0)
+        self._release(len(self._waves))
+
+    # Create a wave and queue it after the current one
+    def _queue(self, pulses):
+        # the oldest wave ends before another one is sent
+        while(len(self._waves) >= self.max_waves):
+            if(self.pi.wave_tx_at() == self._waves[0]):
+                time.sleep(0.001)
+                continue
+            self._release(1)
+        self.pi.wave_add_new()
+        self.pi.wave_add_generic(pulses)
+        wid = self.pi.wave_create()
+        if(wid < 0):
+            raise Exception("Error: wave_create {}".format(wid))
+        now = time.perf_counter()
+        if(self._waves and not self.pi.wave_tx_busy()):
+            self.underruns += 1
+        self.pi.wave_send_using_mode(wid, WAVE_MODE_ONE_SHOT_SYNC)
+        self._end = max(self._end, now) + sum(p.delay for p in pulses) / 1e6
+        self._waves.append(wid)
+
+    # Delete the oldest waves
+    def _release(self, count):
+        for i in range(count):
+            self.pi.wave_delete(self._waves.popleft())
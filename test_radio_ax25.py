@@ -0,0 +1,53 @@
+# test_radio_ax25.py
+# tests of radio_ax25.py, APRS information fields and the G3RUH scrambler
+#
+# python -m pytest -q
+#
+import pytest
+import radio_ax25
+
+@pytest.mark.parametrize("lat, lon, expected", [
+    (35.681236, 139.767125, "!3540.87N/13946.03E-"),
+    (35.99999, 139.99999, "!3600.00N/14000.00E-"),      # rounded up into the next degree
+    (35.999, 139.999, "!3559.94N/13959.94E-"),
+    (-33.99999, -70.99999, "!3400.00S/07100.00W-"),
+    (-33.8688, -151.2093, "!3352.13S/15112.56W-"),
+    (0, 0, "!0000.00N/00000.00E-"),
+    (-0.0000001, -0.0000001, "!0000.00N/00000.00E-"),   # rounded to zero, no hemisphere
+    (-0.01, 0.01, "!0000.60S/00000.60E-"),
+    (89.99999, 179.99999, "!9000.00N/18000.00E-"),
+])
+def test_aprs_position(lat, lon, expected):
+    assert radio_ax25.aprs_position(lat, lon) == expected
+
+def test_aprs_position_symbol():
+    assert radio_ax25.aprs_position(35.5, 139.5, "test", "/>") == "!3530.00N/13930.00E>test"
+
+# scrambler a bit at a time, 17 bit shift register
+def scramble_bits(bits, state=0):
+    out = []
+    for b in bits:
+        o = b ^ (state >> 11 & 1) ^ (state >> 16 & 1)
+        state = (state << 1 | o) & 0x1ffff
+        out.append(o)
+    return out
+
+@pytest.mark.parametrize("n", [1, 11, 12, 13, 17, 100, 1001])
+@pytest.mark.parametrize("state", [0, 0x1abcd])
+def test_scramble(n, state):
+    bits = [(i * 7 + i // 3) % 5 & 1 for i in range(n)]
+    x = int("".join(map(str, bits)), 2)
+    y = radio_ax25.scramble(x, n, state)
+    assert format(y, "0{}b".format(n)) == "".join(map(str, scramble_bits(bits, state)))
+    assert radio_ax25.descramble(y, n, state) == x
+
+def test_encode_scrambler():
+    frame = radio_ax25.ui_frame("APRS", "JA1XXX-7", ">test", ("WIDE1-1",))
+    plain = radio_ax25.encode(frame)
+    scrambled = radio_ax25.encode(frame, scrambler=True)
+    assert len(scrambled) == len(plain) and scrambled != plain
+    n = len(plain)
+    y = int(bytes(b + 0x30 for b in scrambled), 2)
+    assert format(radio_ax25.descramble(y, n), "0{}b".format(n)).encode() == bytes(b + 0x30 for b in plain)
+    fifo = radio_ax25.encode_fifo(frame, scrambler=True)
+    assert int.from_bytes(fifo, "big") >> (len(fifo) * 8 - n) == y
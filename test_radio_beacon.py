@@ -0,0 +1,48 @@
+# test_radio_beacon.py
+# tests of radio_beacon.py on the simulator
+#
+# python -m pytest -q
+#
+import time
+import pytest
+import si4063
+import si4063sim
+import si4063keyer
+import radio_beacon
+from si4063const import *
+
+@pytest.fixture
+def radio():
+    radio = si4063.Si4063(pi=si4063sim.pi(), spi="bb")
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_OOK)
+    return radio
+
+def test_keyer_calibrated_before_first_slot(radio, monkeypatch):
+    calibrated = []
+    calibrate = si4063keyer.Keyer.calibrate
+    def count(keyer):
+        calibrated.append(time.time())
+        return calibrate(keyer)
+    monkeypatch.setattr(si4063keyer.Keyer, "calibrate", count)
+    beacon = radio_beacon.Beacon(radio, "E", wpm=30, interval=0.3)
+    assert len(calibrated) == 1
+    beacon.run(1)
+    assert len(calibrated) == 1     # not again in the slot
+    slot, late, status = beacon.reports[0]
+    assert status != "missed"
+    assert late < 0.015     # calibration is about 20mS
+
+def test_late_at_first_edge(radio):
+    beacon = radio_beacon.Beacon(radio, "E", wpm=30, interval=0.3)
+    start_tx = radio.start_tx
+    def slow_start_tx(*args):
+        start_tx(*args)
+        time.sleep(0.005)       # the first edge is 5mS after the slot
+    radio.start_tx = slow_start_tx
+    beacon.run(1)
+    slot, late, status = beacon.reports[0]
+    assert late >= 0.005
+    assert status == "late"
+    assert beacon.stats()["late"] == 1
@@ -0,0 +1,93 @@
+# test_radio_morse.py
+# tests of radio_morse.py, schedules and streaming on the simulator
+#
+# python -m pytest -q
+#
+import pytest
+import radio_morse
+
+def test_compile_morse():
+    # E T : dot, word gap, dash
+    assert radio_morse.compile_morse("E T") == [(1, 1), (0, 7), (1, 3)]
+
+def test_farnsworth_gaps():
+    k = radio_morse.farnsworth_factor(20, 10)
+    assert k > 1
+    assert radio_morse.compile_morse("EE", 20, 10) == [(1, 1), (0, 3 * k), (1, 1)]
+    assert radio_morse.farnsworth_factor(20, 20) == 1
+    assert radio_morse.farnsworth_factor(None, None) == 1
+
+def test_iter_morse_ends_on_gap():
+    chunks = list(radio_morse.iter_morse(["E", "E", " E"]))
+    assert chunks == [("E", [(1, 1), (0, 3)]), ("E", [(1, 1), (0, 3)]), (" E", [(0, 4), (1, 1), (0, 3)])]
+    units = sum(radio_morse.schedule_units(schedule) for text, schedule in chunks)
+    assert units == radio_morse.schedule_units(radio_morse.compile_morse("EE E")) + 3   # word gap kept
+
+def test_farnsworth_without_wpm():
+    with pytest.raises(Exception, match="needs the character speed wpm"):
+        radio_morse.compile_morse("EE", fwpm=10)
+    with pytest.raises(Exception, match="needs the character speed wpm"):
+        list(radio_morse.iter_morse(["EE"], fwpm=10))
+
+### stream_morse on the simulator
+import time
+import threading
+import si4063
+import si4063sim
+from si4063const import *
+
+@pytest.fixture
+def radio():
+    radio = si4063.Si4063(pi=si4063sim.pi(), spi="bb")
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_OOK)
+    return radio
+
+def test_stream_morse(radio):
+    assert radio_morse.stream_morse(["E", "E"], 60, radio) == 0
+    levels = [level for tick, gpio, level in radio.pi.timeline]
+    assert levels == [1, 0, 1, 0]
+
+def test_stream_morse_chunk_error(radio):
+    def chunks():
+        yield "E"
+        raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+    with pytest.raises(UnicodeDecodeError):
+        radio_morse.stream_morse(chunks(), 60, radio)
+    assert radio.pi.chip.state == STATE_READY   # TX stopped
+    assert radio.pi.read(radio.pins.TX_DATA) == 0
+
+def test_stream_morse_stop_with_full_queue(radio):
+    def chunks():
+        while(True):
+            yield "E"
+    def fail(runs, resume=False):
+        raise RuntimeError("keying")
+    radio.key_runs = fail
+    before = set(threading.enumerate())
+    with pytest.raises(RuntimeError):
+        radio_morse.stream_morse(chunks(), 60, radio)
+    producers = [t for t in set(threading.enumerate()) - before if "produce" in t.name]
+    for t in producers:
+        t.join(1)       # the producer gives up within 0.1 S
+        assert not t.is_alive()
+
+# chunks, each after stall S but the first
+def stalled(chunks, stall):
+    for i, text in enumerate(chunks):
+        if(i):
+            time.sleep(stall)
+        yield text
+
+@pytest.mark.parametrize("dma", [False, True])
+def test_stream_morse_stall(radio, dma):
+    underruns = radio_morse.stream_morse(stalled(["E", "E"], 0.3), 60, radio, dma=dma)
+    assert underruns >= 1
+    edges = [(tick, level) for tick, gpio, level in radio.pi.timeline]
+    assert [level for tick, level in edges] == [1, 0, 1, 0]
+    assert (edges[1][0] - edges[0][0]) & 0xffffffff < 30000     # dot of 20mS, not held in the stall
+    assert (edges[2][0] - edges[1][0]) & 0xffffffff > 150000    # the space(60mS) is stretched
+
+def test_stream_morse_no_underrun(radio):
+    assert radio_morse.stream_morse(["E", "E", "E"], 60, radio) == 0
@@ -0,0 +1,63 @@
+# test_si4063async.py
+# tests of si4063async.py on the simulated chip(si4063sim.py)
+#
+# python -m pytest -q
+#
+import time
+import asyncio
+import pytest
+import si4063
+import si4063sim
+import radio_morse
+from si4063async import AsyncSi4063
+from si4063wave import TxWave
+from si4063const import *
+
+WPM = 60
+DOT = radio_morse.calculate_unit_time(WPM) / 1000
+
+@pytest.fixture
+def radio():
+    radio = si4063.Si4063(pi=si4063sim.pi(), spi="bb")
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_OOK)
+    radio.wave = TxWave(radio.pi, radio.pins.TX_DATA, max_pulses=16)    # a wave per char or so
+    return radio
+
+# μS from t(perf_counter) to tick, signed
+def after(tick, t):
+    d = (tick - int(t * 1e6)) & 0xffffffff
+    return d - (1 << 32) if d & 0x80000000 else d
+
+def tx_edges(radio):
+    return [(tick, level) for tick, gpio, level in radio.pi.timeline if gpio == radio.pins.TX_DATA]
+
+def test_send_morse_dma(radio):
+    async def main():
+        arad = AsyncSi4063(radio)
+        await arad.send_morse("EE", WPM, dma=True)
+        arad.close()
+    asyncio.run(main())
+    assert [level for tick, level in tx_edges(radio)] == [1, 0, 1, 0]
+    assert radio.pi.chip.state == STATE_READY
+
+def test_send_morse_dma_cancel(radio):
+    async def main():
+        arad = AsyncSi4063(radio)
+        task = asyncio.create_task(arad.send_morse("PARIS PARIS PARIS PARIS", WPM, dma=True))
+        await asyncio.sleep(10 * DOT)
+        cancelled = time.perf_counter()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        arad.close()
+        return cancelled, time.perf_counter()
+    cancelled, returned = asyncio.run(main())
+    assert returned - cancelled < 3 * DOT
+    tick, level = tx_edges(radio)[-1]
+    assert level == 0
+    assert after(tick, cancelled) < 3 * DOT * 1e6      # TX_DATA Low within a few dots
+    assert radio.pi.read(radio.pins.TX_DATA) == 0
+    assert not radio.pi.wave_tx_busy()
+    assert radio.pi.chip.state == STATE_READY
@@ -0,0 +1,40 @@
+# test_si4063bench.py
+# tests of the edge metrics and the baseline compare of si4063bench.py
+#
+# python -m pytest -q
+#
+import pytest
+import si4063bench
+import si4063edges
+
+RUNS = si4063edges.toggle_runs(1000, 6)     # 1000 μS each, High first
+# measured edges, late by 0, 10, -5, 20, 0, 30 μS
+EDGES = [((0xfffffc00 + t + e) & 0xffffffff, l)
+         for t, e, l in zip(range(0, 6000, 1000), (0, 10, -5, 20, 0, 30), (1, 0, 1, 0, 1, 0))]
+
+def test_edge_errors():
+    pytest.importorskip("numpy")
+    result = si4063bench.edge_errors(EDGES, RUNS, 1000)
+    ticks, levels = zip(*EDGES)
+    assert result == si4063edges.summary(si4063edges.analyze(ticks, levels, RUNS, 1000))
+    assert result["drift_us"] == 30
+    assert result["max_error_us"] == 30
+    assert result["jitter_max_us"] == 30     # 0 -> 30 between the last edges
+    assert result["level_errors"] == 0
+
+def test_edge_errors_without_numpy(monkeypatch):
+    expected = si4063bench.edge_errors(EDGES, RUNS) if si4063edges.np is not None else None
+    monkeypatch.setattr(si4063edges, "np", None)
+    result = si4063bench.edge_errors(EDGES, RUNS)
+    assert result == {"edges": 6, "intended_edges": 6, "drift_us": 30,
+                      "max_error_us": 30, "jitter_max_us": 30}
+    if(expected is not None):
+        for key, value in result.items():
+            assert expected[key] == value
+
+def test_compare():
+    baseline = {"toggle": {"drift_us": -200, "jitter_p99_us": 50, "edges": 100, "effective_rate": 100}}
+    assert si4063bench.compare({"toggle": {"drift_us": 180, "jitter_p99_us": 55, "edges": 10,
+                                           "effective_rate": 90}}, baseline) == []
+    worse = si4063bench.compare({"toggle": {"drift_us": -400, "jitter_p99_us": 500}}, baseline)
+    assert [metric for name, metric, base, value in worse] == ["drift_us", "jitter_p99_us"]
@@ -0,0 +1,41 @@
+# test_si4063cfg.py
+# tests of si4063cfg.py, config blobs applied on the simulator
+#
+# python -m pytest -q
+#
+import os
+import pytest
+import si4063
+import si4063sim
+import si4063cfg
+from si4063const import *
+
+@pytest.fixture
+def radio():
+    radio = si4063.Si4063(pi=si4063sim.pi(), spi="bb")
+    radio.reset()
+    radio.power_up()
+    return radio
+
+def test_apply_config_round_trip(radio):
+    blob = si4063cfg.compile_config(MOD_TYPE_FSK, 144050000, freq_dev=8000, freq_offset=3000)
+    si4063cfg.apply_config(radio, blob)
+    assert radio.verify() == {}
+    assert radio.verify(si4063cfg.config_properties(blob)) == {}
+    assert radio.pi.chip.errors == 0
+    properties = sum(1 for cmd in si4063cfg.config_commands(blob) if cmd[0] == CMD_SET_PROPERTY)
+    stats = radio.property_stats()
+    assert stats["requested"] == properties
+    assert stats["sent"] == properties
+    si4063cfg.apply_config(radio, blob)     # on the chip already
+    stats = radio.property_stats()
+    assert stats["requested"] == 2 * properties
+    assert stats["sent"] == properties
+
+@pytest.mark.parametrize("name", sorted(si4063cfg.PROFILES))
+def test_profiles_up_to_date(radio, name):
+    blob = si4063cfg.read_config(os.path.join(si4063cfg.PROFILE_DIR, name + ".bin"))
+    assert blob == si4063cfg.compile_config(**si4063cfg.PROFILES[name])
+    si4063cfg.load_profile(radio, name)
+    assert radio.verify(si4063cfg.config_properties(blob)) == {}
+    assert radio.pi.chip.errors == 0
@@ -0,0 +1,59 @@
+# test_si4063chan.py
+# tests of the channel plan and hop() on the simulated chip(si4063sim.py)
+#
+# python -m pytest -q
+#
+import pytest
+import si4063
+import si4063sim
+from si4063chan import ChannelPlan, dividers, output_frequency
+from si4063const import *
+
+def test_plan():
+    plan = ChannelPlan(step=25000)
+    assert len(plan) == 81
+    assert plan.freqs[0] == 144000000 and plan.freqs[-1] == 146000000
+    assert plan.max_error() < 3
+    assert plan.channel(144050000) == 2
+
+def test_plan_float():
+    plan = ChannelPlan(144.05e6, 144.1e6, 12.5e3)
+    assert plan.freqs == [144050000, 144062500, 144075000, 144087500, 144100000]
+    assert all(isinstance(f, int) for f in plan.freqs)
+
+def test_plan_range():
+    with pytest.raises(Exception, match="channel plan"):
+        ChannelPlan(143e6)
+    with pytest.raises(Exception, match="channel plan"):
+        ChannelPlan(step=0.4)
+
+def test_check():
+    plan = ChannelPlan(step=500000)
+    assert plan.check(0) == 0 and plan.check(4) == 4
+    for ch in (-1, 5):
+        with pytest.raises(Exception, match="not in channel plan"):
+            plan.check(ch)
+
+@pytest.fixture
+def radio():
+    radio = si4063.Si4063(pi=si4063sim.pi(), spi="bb")
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_CW)
+    radio.plan = ChannelPlan(step=500000)
+    return radio
+
+def test_hop(radio):
+    chip = radio.pi.chip
+    radio.hop(4)
+    inte, frac = dividers(146000000)
+    assert chip.props[(0x40, 0x00)] == inte
+    assert output_frequency(inte, frac) == pytest.approx(146e6, abs=3)
+
+def test_hop_out_of_plan(radio):
+    chip = radio.pi.chip
+    sent = len(chip.commands)
+    for ch in (-1, 5):
+        with pytest.raises(Exception, match="not in channel plan"):
+            radio.hop(ch)
+    assert len(chip.commands) == sent    # nothing written
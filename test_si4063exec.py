@@ -0,0 +1,73 @@
+# test_si4063exec.py
+# tests of CommandExecutor(si4063exec.py)
+#
+# python -m pytest -q
+#
+import time
+import threading
+import pytest
+from concurrent.futures import wait
+from si4063exec import CommandExecutor, LANE_TX, LANE_HOUSEKEEPING
+
+def test_lanes():
+    executor = CommandExecutor(None)
+    gate = threading.Event()
+    order = []
+    executor.submit(gate.wait)      # the worker waits while the queue is filled
+    futures = [executor.submit(order.append, "housekeeping", lane=LANE_HOUSEKEEPING),
+               executor.submit(order.append, "config"),
+               executor.submit(order.append, "tx", lane=LANE_TX)]
+    gate.set()
+    wait(futures, timeout=2)
+    executor.close()
+    assert order == ["tx", "config", "housekeeping"]
+
+def test_submit_after_close():
+    executor = CommandExecutor(None)
+    future = executor.submit(lambda: 1)
+    executor.close()
+    assert future.result(0) == 1
+    with pytest.raises(Exception, match="executor closed"):
+        executor.submit(lambda: 1)
+
+def test_close_while_submitting():
+    for i in range(20):
+        executor = CommandExecutor(None, maxsize=4)
+        futures = []
+        def submitter():
+            while(True):
+                try:
+                    futures.append(executor.submit(time.sleep, 0.0001))
+                except Exception:
+                    return
+        threads = [threading.Thread(target=submitter, daemon=True) for n in range(4)]
+        for t in threads:
+            t.start()
+        time.sleep(0.005)
+        executor.close()
+        for t in threads:
+            t.join(2)
+            assert not t.is_alive()     # not blocked on the full queue
+        done, pending = wait(futures, timeout=2)
+        assert not pending
+        for future in done:
+            assert future.exception() is None or "executor closed" in str(future.exception())
+
+def test_submit_racing_close():
+    executor = CommandExecutor(None)
+    put = executor._queue.put
+    checked = threading.Event()
+    def late_put(item, timeout=None):
+        checked.set()
+        time.sleep(0.05)    # close() runs between the check and the put
+        put(item, timeout=timeout)
+    executor._queue.put = late_put
+    futures = []
+    t = threading.Thread(target=lambda: futures.append(executor.submit(lambda: 1)))
+    t.start()
+    checked.wait()
+    executor._queue.put = put
+    executor.close()
+    t.join(2)
+    with pytest.raises(Exception, match="executor closed"):
+        futures[0].result(timeout=2)
@@ -0,0 +1,79 @@
+# test_si4063metrics.py
+# tests of si4063metrics.py, Prometheus text of a run on the simulator
+#
+# python -m pytest -q
+#
+import os
+import pytest
+import si4063
+import si4063sim
+import si4063metrics
+from si4063const import *
+
+@pytest.fixture
+def radio():
+    radio = si4063.Si4063(pi=si4063sim.pi(), spi="bb", metrics=True)
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_OOK)
+    radio.start_tx()
+    radio.stop_tx()
+    return radio
+
+# samples of the text
+# return : {name{labels}: value}
+def samples(text):
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if not line.startswith("#")}
+
+def test_prometheus_text(radio):
+    plain = si4063.Si4063(pi=si4063sim.pi(), spi="bb")     # no metrics, not exported
+    text = si4063metrics.prometheus_text({"hat0": radio, "hat1": plain})
+    types = [line.split()[2:] for line in text.splitlines() if line.startswith("# TYPE")]
+    assert ["si4063_commands_total", "counter"] in types
+    assert ["si4063_tx_starts_total", "counter"] in types
+    assert ["si4063_on_air", "gauge"] in types
+    assert ["si4063_cts_wait_seconds", "histogram"] in types
+    values = samples(text)
+    assert values['si4063_commands_total{radio="hat0",command="START_TX"}'] == 1
+    assert values['si4063_commands_total{radio="hat0",command="POWER_UP"}'] == 1
+    assert values['si4063_tx_starts_total{radio="hat0"}'] == 1
+    assert values['si4063_on_air{radio="hat0"}'] == 0
+    assert values['si4063_spi_transactions_total{radio="hat0"}'] == radio.metrics.spi_transactions
+    assert values['si4063_cts_wait_seconds_bucket{radio="hat0",le="+Inf"}'] == values['si4063_cts_wait_seconds_count{radio="hat0"}']
+    assert not any('radio="hat1"' in key for key in values)
+
+def test_write_textfile_replaces_at_once(radio, tmp_path, monkeypatch):
+    path = str(tmp_path / "si4063.prom")
+    with open(path, "w") as f:
+        f.write("old\n")
+    replaced = []
+    replace = os.replace
+    def check_replace(src, dst):
+        with open(src) as f:
+            replaced.append((src, dst, f.read()))
+        with open(dst) as f:
+            assert f.read() == "old\n"      # not touched until the rename
+        replace(src, dst)
+    monkeypatch.setattr(si4063metrics.os, "replace", check_replace)
+    si4063metrics.write_textfile(path, {"hat0": radio})
+    src, dst, text = replaced[0]
+    assert dst == path and src != path
+    with open(path) as f:
+        assert f.read() == text
+    assert "# TYPE si4063_commands_total counter" in text
+    assert os.listdir(tmp_path) == ["si4063.prom"]     # no tmp file left
+
+def test_write_textfile_error_keeps_file(radio, tmp_path, monkeypatch):
+    path = str(tmp_path / "si4063.prom")
+    si4063metrics.write_textfile(path, {"hat0": radio})
+    with open(path) as f:
+        before = f.read()
+    def fail(radios):
+        raise RuntimeError("render")
+    monkeypatch.setattr(si4063metrics, "prometheus_text", fail)
+    with pytest.raises(RuntimeError):
+        si4063metrics.write_textfile(path, {"hat0": radio})
+    with open(path) as f:
+        assert f.read() == before
+    assert os.listdir(tmp_path) == ["si4063.prom"]
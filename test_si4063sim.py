@@ -0,0 +1,361 @@
+# test_si4063sim.py
+# tests of si4063.py on the simulated chip(si4063sim.py), no hat
+#
+# python -m pytest -q
+#
+import gc
+import threading
+import time
+import sys
+import pytest
+import si4063
+import si4063sim
+import si4063cmd
+from si4063const import *
+
+@pytest.fixture
+def radio():
+    radio = si4063.Si4063(pi=si4063sim.pi(), spi="bb")
+    yield radio
+    radio.pi.chip._end_packet()
+
+# opcodes of the commands executed by the chip
+def opcodes(chip):
+    return [cmd[0] for tick, cmd in chip.commands]
+
+def test_reset(radio):
+    chip = radio.pi.chip
+    radio.reset()
+    assert chip.powered
+    assert not chip.booted
+    assert chip.cts()       # POR done
+    assert chip.state == STATE_SLEEP
+    assert chip.errors == 0
+
+def test_reset_forgets_properties(radio):
+    chip = radio.pi.chip
+    radio.reset()
+    radio.power_up()
+    radio.set_prop(MODEM_MOD_TYPE, MOD_TYPE_OOK)
+    radio.reset()
+    assert chip.props == {}
+
+# CTS of the last command stays High for a while after the SHDN pulse
+class StaleCtsChip(si4063sim.Si4063Chip):
+    STALE = 0.002   # S
+
+    def shdn(self, level):
+        if(level and self.cts()):
+            self._stale = time.perf_counter() + self.STALE
+        super().shdn(level)
+
+    def cts(self):
+        if(time.perf_counter() < getattr(self, "_stale", 0)):
+            return 1
+        return super().cts()
+
+def test_reset_waits_por():
+    chip = StaleCtsChip()
+    radio = si4063.Si4063(pi=si4063sim.pi(chip=chip), spi="bb")
+    radio.reset()
+    radio.power_up()
+    radio.reset()       # CTS of POWER_UP is High at the pulse
+    assert time.perf_counter() >= chip._cts_at     # POR done
+    radio.power_up()
+    assert chip.errors == 0
+
+def test_bring_up_without_sleep(radio, monkeypatch):
+    def no_sleep(seconds):
+        raise AssertionError("time.sleep({})".format(seconds))
+    monkeypatch.setattr(time, "sleep", no_sleep)     # waits are on CTS edges
+    radio.reset()
+    radio.power_up()
+    radio.shutdown()
+    assert not radio.pi.chip.powered
+    radio.wakeup()
+    radio.power_up()
+    assert radio.pi.chip.errors == 0
+
+def test_power_up(radio):
+    chip = radio.pi.chip
+    radio.reset()
+    radio.power_up()
+    assert chip.booted
+    assert chip.state == STATE_READY
+    assert chip.commands[-1][1] == si4063cmd.POWER_UP
+    assert chip.errors == 0
+
+def test_command_before_power_up(radio):
+    chip = radio.pi.chip
+    radio.reset()
+    radio.change_state(STATE_READY)
+    assert chip.errors == 1
+
+def test_part_info(radio):
+    radio.reset()
+    radio.power_up()
+    count, chip_no = radio.part_info()
+    assert chip_no == 0x4063
+    assert count == 1
+    assert radio.pi.chip.errors == 0
+
+def test_setup(radio):
+    chip = radio.pi.chip
+    radio.reset()
+    radio.power_up()
+    radio.set_radio_frequency(144050000)
+    radio.setup(MOD_TYPE_OOK)
+    mod_type = chip.props[tuple(MODEM_MOD_TYPE[:2])]
+    assert mod_type & 0x07 == MOD_TYPE_OOK
+    assert (mod_type >> 3) & 3 == MOD_SOURCE_DIRECT
+    assert radio.verify() == {}     # the shadow is what the chip has
+    assert chip.errors == 0
+
+def test_setup_fsk(radio):
+    chip = radio.pi.chip
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_FSK, freq_dev=8333)
+    assert chip.props[tuple(MODEM_MOD_TYPE[:2])] & 0x07 == MOD_TYPE_FSK
+    assert (MODEM_FREQ_DEV[0], MODEM_FREQ_DEV[1]) in chip.props
+    assert chip.errors == 0
+
+def test_start_tx(radio):
+    chip = radio.pi.chip
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_OOK)
+    radio.start_tx()
+    assert chip.state == STATE_TX
+    cmd = chip.commands[-1][1]
+    assert cmd[0] == CMD_START_TX
+    assert cmd[2] == STATE_READY << 4   # READY after TX
+    radio.stop_tx()
+    assert chip.state == STATE_READY
+    assert opcodes(chip)[-2:] == [CMD_START_TX, CMD_CHANGE_STATE]
+    assert chip.errors == 0
+
+def test_del_after_failed_init(monkeypatch):
+    errors = []     # exceptions of __del__
+    monkeypatch.setattr(sys, "unraisablehook", errors.append)
+    pi = si4063sim.pi()
+    pi.connected = False
+    with pytest.raises(Exception, match="NOT connected"):
+        si4063.Si4063(pi=pi)
+    gc.collect()
+    assert errors == []
+
+def test_debug_print_of_shared_buffer(radio, capsys, monkeypatch):
+    chip = radio.pi.chip
+    radio.reset()
+    radio.power_up()
+    monkeypatch.setattr(si4063, "debug", True)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)     # threads switch often, in the print too
+    capsys.readouterr()
+    sent = len(chip.commands)
+    def states(state):
+        for i in range(200):
+            radio.change_state(state)
+    threads = [threading.Thread(target=states, args=(s,)) for s in (STATE_READY, STATE_TX_TUNE)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    printed = [line.split(": ")[1].strip() for line in capsys.readouterr().out.splitlines()
+               if line.startswith("to_send")]
+    executed = [cmd.hex(" ") for tick, cmd in chip.commands[sent:]]
+    assert printed == executed      # each print is its own command, in order
+
+### property shadow
+@pytest.fixture
+def ready_radio(radio):
+    radio.reset()
+    radio.power_up()
+    return radio
+
+# SET_PROPERTY commands executed by the chip since sent
+def set_properties(chip, sent=0):
+    return [bytes(cmd) for tick, cmd in chip.commands[sent:] if cmd[0] == CMD_SET_PROPERTY]
+
+def test_property_elided(ready_radio):
+    chip = ready_radio.pi.chip
+    ready_radio.set_property(0x22, 0x01, 0x7f)
+    sent = len(chip.commands)
+    ready_radio.set_property(0x22, 0x01, 0x7f)     # on the chip already
+    assert set_properties(chip, sent) == []
+    stats = ready_radio.property_stats()
+    assert (stats["requested"], stats["sent"], stats["elided"]) == (2, 1, 1)
+
+def test_batch_merges_near_properties(ready_radio):
+    chip = ready_radio.pi.chip
+    ready_radio.set_property(0x22, 0x01, 0x10)     # in the shadow
+    sent = len(chip.commands)
+    with ready_radio.batch():
+        ready_radio.set_property(0x22, 0x00, 0x08)
+        ready_radio.set_property(0x22, 0x02, 0x1d)
+    assert set_properties(chip, sent) == [bytes([CMD_SET_PROPERTY, 0x22, 3, 0x00, 0x08, 0x10, 0x1d])]
+    assert chip.errors == 0
+
+def test_batch_splits_at_12(ready_radio):
+    chip = ready_radio.pi.chip
+    sent = len(chip.commands)
+    with ready_radio.batch():
+        for i in range(14):
+            ready_radio.set_property(0x20, i, i + 1)
+    cmds = set_properties(chip, sent)
+    assert [(cmd[2], cmd[3]) for cmd in cmds] == [(12, 0), (2, 12)]     # num, index
+    assert all(chip.props[(0x20, i)] == i + 1 for i in range(14))
+
+def test_batch_unknown_gap_splits(ready_radio):
+    chip = ready_radio.pi.chip
+    sent = len(chip.commands)
+    with ready_radio.batch():
+        ready_radio.set_property(0x22, 0x00, 0x08)     # 0x22 0x01 is not in the shadow
+        ready_radio.set_property(0x22, 0x02, 0x1d)
+    cmds = set_properties(chip, sent)
+    assert [(cmd[2], cmd[3]) for cmd in cmds] == [(1, 0x00), (1, 0x02)]
+    assert (0x22, 0x01) not in chip.props
+
+def test_nested_batch_flushes_once(ready_radio):
+    chip = ready_radio.pi.chip
+    sent = len(chip.commands)
+    with ready_radio.batch():
+        ready_radio.set_property(0x22, 0x00, 0x08)
+        with ready_radio.batch():
+            ready_radio.set_property(0x22, 0x01, 0x10)
+        assert set_properties(chip, sent) == []     # held by the outer batch
+    assert len(set_properties(chip, sent)) == 1
+
+def test_set_property_during_flush(ready_radio):
+    chip = ready_radio.pi.chip
+    send = ready_radio._send_properties
+    threads = []
+    def send_and_set(group, index, vals):
+        if(not threads):    # another thread writes while the batch is sent
+            t = threading.Thread(target=ready_radio.set_property, args=(0x23, 0x00, 0x2c))
+            threads.append(t)
+            t.start()
+            time.sleep(0.05)
+        send(group, index, vals)
+    ready_radio._send_properties = send_and_set
+    with ready_radio.batch():
+        ready_radio.set_property(0x22, 0x00, 0x08)
+    threads[0].join()
+    assert chip.props.get((0x23, 0x00)) == 0x2c     # not lost
+    assert ready_radio.verify() == {}
+
+### PN9 by the chip
+# modulation type, source and data rate on the chip
+def modem(chip):
+    mod_type = chip.props[(MODEM_MOD_TYPE.group, MODEM_MOD_TYPE.index)]
+    rate = bytes(chip.props[(MODEM_DATA_RATE.group, MODEM_DATA_RATE.index + i)] for i in range(3))
+    return mod_type & 0x07, (mod_type >> 3) & 3, int.from_bytes(rate, "big")
+
+def test_pn9_then_direct(ready_radio):
+    chip = ready_radio.pi.chip
+    ready_radio.setup(MOD_TYPE_FSK, 8000, MOD_SOURCE_PSEUDO, 10000)
+    assert modem(chip) == (MOD_TYPE_FSK, MOD_SOURCE_PSEUDO, 10000)
+    assert ready_radio.data_rate == 10000
+    ready_radio.start_tx()
+    assert chip.state == STATE_TX
+    ready_radio.stop_tx()
+    assert chip.state == STATE_READY
+    assert ready_radio.pi.timeline == []    # TX_DATA not used
+    with pytest.raises(Exception, match="not in packet mode"):
+        ready_radio.send_packet(b"x")
+    # normal TX again
+    ready_radio.setup(MOD_TYPE_FSK, 8000)
+    assert modem(chip) == (MOD_TYPE_FSK, MOD_SOURCE_DIRECT, 64000)
+    assert (ready_radio.mod_source, ready_radio.data_rate) == (MOD_SOURCE_DIRECT, None)
+    assert ready_radio.verify() == {}
+    ready_radio.start_tx()
+    ready_radio.tx_data(1)
+    ready_radio.tx_data(0)
+    ready_radio.stop_tx()
+    assert [level for tick, gpio, level in ready_radio.pi.timeline] == [1, 0]
+    assert chip.errors == 0
+
+def test_pn9_data_rate(ready_radio):
+    with pytest.raises(Exception, match="data rate"):
+        ready_radio.setup(MOD_TYPE_OOK, source=MOD_SOURCE_PSEUDO)
+    ready_radio.setup(MOD_TYPE_OOK, source=MOD_SOURCE_PSEUDO, data_rate=DATA_RATE_MIN)
+    assert modem(ready_radio.pi.chip) == (MOD_TYPE_OOK, MOD_SOURCE_PSEUDO, DATA_RATE_MIN)
+
+### register image
+def test_verify_reports_changed_property(ready_radio):
+    chip = ready_radio.pi.chip
+    ready_radio.setup(MOD_TYPE_OOK)
+    assert ready_radio.verify() == {}
+    key = (MODEM_MOD_TYPE.group, MODEM_MOD_TYPE.index)
+    expected = chip.props[key]
+    chip.props[key] = expected ^ 0x01      # behind the driver
+    assert ready_radio.verify() == {key: (expected, expected ^ 0x01)}
+
+def test_snapshot_reads(ready_radio):
+    chip = ready_radio.pi.chip
+    ready_radio.setup(MOD_TYPE_OOK)
+    keys = {(0x20, 0x00), (0x20, 0x03), (0x20, 0x04), (0x20, 0x05), (0x22, 0x01), (0x23, 0x02)}
+    sent = len(chip.commands)
+    image = ready_radio.snapshot(keys)
+    reads = [cmd for tick, cmd in chip.commands[sent:] if cmd[0] == CMD_GET_PROPERTY]
+    assert len(reads) == len(si4063.snapshot_reads(keys)) == 3
+    assert {k: image[k] for k in keys} == {k: chip.props.get(k, 0) for k in keys}    # gaps of a read too
+
+def test_diff_image_and_checksum():
+    expected = {(0x20, 0x00): 0x09, (0x22, 0x01): 0x7f}
+    image = {(0x22, 0x01): 0x7f, (0x20, 0x00): 0x0a}
+    assert si4063.diff_image(image, expected) == {(0x20, 0x00): (0x09, 0x0a)}
+    assert si4063.diff_image({}, expected) == {k: (val, None) for k, val in expected.items()}
+    assert si4063.property_checksum(dict(reversed(list(expected.items())))) == si4063.property_checksum(expected)
+    assert si4063.property_checksum(image) != si4063.property_checksum(expected)
+
+### packet mode
+PACKET = bytes(range(200))
+
+@pytest.fixture
+def packet_radio(radio):
+    radio.reset()
+    radio.power_up()
+    radio.setup(MOD_TYPE_FSK, 8000, MOD_SOURCE_PACKET, 9600)
+    radio.cts_timeout = 0.1     # an underflow ends in the nIRQ timeout
+    return radio
+
+# refills of the TX FIFO are late by delay (S)
+def late_refills(radio, delay):
+    write = radio.write_tx_fifo
+    def late_write(data):
+        if(radio.pi.chip._pkt is not None):     # a refill, not the first write
+            time.sleep(delay)
+        write(data)
+    radio.write_tx_fifo = late_write
+
+def test_send_packet(packet_radio):
+    chip = packet_radio.pi.chip
+    assert packet_radio.send_packet(PACKET) >= 1
+    assert chip.packets == [PACKET]
+    assert chip.underflows == 0
+
+def test_packet_underflow_late_refill(packet_radio):
+    chip = packet_radio.pi.chip
+    late_refills(packet_radio, 0.06)    # 32 bytes free are 27mS at 9600bps
+    with pytest.raises(TimeoutError):
+        packet_radio.send_packet(PACKET)
+    assert chip.underflows == 1
+    assert chip.packets == []
+
+def test_packet_underflow_timer_blocked(packet_radio):
+    chip = packet_radio.pi.chip
+    start_tx = packet_radio.start_tx
+    def stalled_start_tx(tx_len=0):
+        start_tx(tx_len)
+        with chip._lock:        # the almost empty interrupt is late, the FIFO runs dry
+            time.sleep(0.08)
+    packet_radio.start_tx = stalled_start_tx
+    with pytest.raises(TimeoutError):
+        packet_radio.send_packet(PACKET)
+    assert chip.underflows == 1
+    assert chip.timer_late > 0.03
@@ -0,0 +1,31 @@
+# test_si4063wave.py
+# tests of si4063wave.py, DMA waves on the simulator
+#
+# python -m pytest -q
+#
+import pytest
+import si4063sim
+from si4063wave import TxWave, bits_to_runs, runs_to_pulses
+from si4063const import *
+
+def test_bits_to_runs():
+    assert list(bits_to_runs([1, 1, 0, 1], 1000)) == [(1, 2000), (0, 1000), (1, 1000)]
+
+def test_runs_to_pulses():
+    pulses = list(runs_to_pulses([(1, 1000.4), (1, 1000.4), (0, 999.6)], 1 << GPIO_TX_DATA))
+    assert [(p.gpio_on, p.gpio_off, p.delay) for p in pulses] == [(1 << GPIO_TX_DATA, 0, 2001), (0, 1 << GPIO_TX_DATA, 999)]     # edges on absolute times
+
+# waves are on air in the real time of the simulator, not played at once
+def test_two_waves_in_pigpiod():
+    pi = si4063sim.pi()
+    wave = TxWave(pi, GPIO_TX_DATA, max_pulses=2)       # a wave of 4mS
+    wave.send_runs([(i & 1 ^ 1, 2000) for i in range(20)])
+    assert pi.wave_overflows == 0       # no wave sent while one was waiting
+    ticks = [tick for tick, gpio, level in pi.timeline]
+    assert [level for tick, gpio, level in pi.timeline] == [i & 1 ^ 1 for i in range(20)]
+    assert all((b - a) & 0xffffffff == 2000 for a, b in zip(ticks, ticks[1:]))
+    assert pi._waves == {}      # all deleted
+
+def test_max_waves():
+    with pytest.raises(Exception, match="max_waves"):
+        TxWave(si4063sim.pi(), GPIO_TX_DATA, max_waves=3)